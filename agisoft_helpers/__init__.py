@@ -0,0 +1 @@
+"""Helper library used by master.py. Modules here are loaded by PhotoScan's Python."""
@@ -0,0 +1,147 @@
+"""Content-addressed cache of built dense clouds and textured models on shared storage.
+
+An entry is keyed by a fingerprint of everything the products depend on:
+the aligned cameras, calibration, chunk transform and region
+(checkpoint.camera_state), the content hashes of the photos and of the
+camera masks, and the build task parameters. So re-running a stage after revert_to_clean, or on a copy
+of the same scan, finds the earlier result. Entries are folders named by
+key holding the exported files and an entry.json with their size and last
+use, and are written to a temporary folder and renamed into place so that
+readers on other nodes never see a partial entry. When the cache grows past
+its size bound, the least recently used entries are removed, except those
+used within RECENT_SECONDS, which another node may be importing.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from agisoft_helpers import checkpoint
+
+ENTRY_NAME = 'entry.json'
+DENSE_NAME = 'dense.ply'
+MODEL_NAME = 'model.obj'
+# Bump when what an entry holds changes, so old entries are not imported.
+CACHE_VERSION = 2
+# Temporary folders older than this are left over from failed stores.
+STALE_SECONDS = 24 * 3600
+# Entries used more recently than this are never evicted.
+RECENT_SECONDS = 10 * 60
+
+
+def mask_hash(camera):
+    """SHA-1 of a camera's mask pixels, or None when it has no mask."""
+    mask = getattr(camera, 'mask', None)
+    if mask is None:
+        return None
+    return hashlib.sha1(mask.image().tostring()).hexdigest()
+
+
+def chunk_key(chunk, image_hashes, params):
+    """Cache key of chunk's build products for photo hashes {path: hash} and build params."""
+    photos = [image_hashes.get(camera.photo.path.replace('\\', '/')) for camera in chunk.cameras]
+    masks = [mask_hash(camera) for camera in chunk.cameras]
+    return checkpoint.fingerprint(CACHE_VERSION, checkpoint.camera_state(chunk), photos, masks,
+                                  params)
+
+
+def folder_size(folder):
+    """Total size of the files below folder."""
+    total = 0
+    for parent, _, files in os.walk(folder):
+        for name in files:
+            total += os.path.getsize(os.path.join(parent, name))
+    return total
+
+
+class ArtifactCache(object):
+    """Cache folder of entries, bounded to max_bytes."""
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def folder(self, key):
+        return self.root + '/' + key
+
+    def _read_entry(self, key):
+        try:
+            with open(self.folder(key) + '/' + ENTRY_NAME, 'r') as handle:
+                return json.load(handle)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_entry(self, folder, entry):
+        with open(folder + '/' + ENTRY_NAME + '.tmp', 'w') as handle:
+            json.dump(entry, handle, indent=1, sort_keys=True)
+        os.replace(folder + '/' + ENTRY_NAME + '.tmp', folder + '/' + ENTRY_NAME)
+
+    def lookup(self, key):
+        """Folder of the entry for key, marked as used, or None."""
+        entry = self._read_entry(key)
+        if entry is None:
+            return None
+        entry['used'] = time.time()
+        try:
+            self._write_entry(self.folder(key), entry)
+        except (IOError, OSError):
+            pass
+        return self.folder(key)
+
+    def store(self, key, write):
+        """Adds an entry for key unless there is one; write(folder) writes its files.
+
+        Returns the entry folder, then evicts down to the size bound.
+        """
+        if self._read_entry(key) is not None:
+            return self.folder(key)
+        temporary = '%s/.%s.%s' % (self.root, key, uuid.uuid4().hex)
+        os.makedirs(temporary)
+        try:
+            write(temporary)
+            now = time.time()
+            self._write_entry(temporary, {'key': key, 'created': now, 'used': now,
+                                          'bytes': folder_size(temporary)})
+            os.rename(temporary, self.folder(key))
+        except OSError:
+            # another node stored the same key first
+            if self._read_entry(key) is None:
+                raise
+        finally:
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict()
+        return self.folder(key)
+
+    def entries(self):
+        """[(last used, bytes, key)] of complete entries."""
+        found = []
+        for name in os.listdir(self.root):
+            if name.startswith('.'):
+                path = self.root + '/' + name
+                if time.time() - os.path.getmtime(path) > STALE_SECONDS:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            entry = self._read_entry(name)
+            if entry is not None:
+                found.append((entry['used'], entry['bytes'], name))
+        return found
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits max_bytes.
+
+        Entries used within RECENT_SECONDS are kept even above the bound.
+        Returns the removed keys.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        recent = time.time() - RECENT_SECONDS
+        removed = []
+        for used, size, key in entries:
+            if total <= self.max_bytes or used > recent:
+                break
+            shutil.rmtree(self.folder(key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
@@ -0,0 +1,132 @@
+"""Per-project stage manifest for checkpoint/resume and incremental re-runs.
+
+The manifest lives next to the project file (PROCESSING/<uid>.stages.json)
+and records, for every completed stage, a fingerprint of its inputs and of
+the document state it produced. A stage's input fingerprint includes the
+output fingerprint of the stage before it, so a change anywhere upstream
+(new images, different camera parameters, different task settings) makes
+every later stage run again while unchanged stages are skipped.
+"""
+import hashlib
+import json
+import os
+import time
+
+MANIFEST_SUFFIX = '.stages.json'
+MANIFEST_VERSION = 1
+# Stages whose results survive master.revert_to_clean.
+CLEAN_STAGES = ('ingest', 'align')
+
+
+def fingerprint(*parts):
+    """Stable hash of JSON-serialisable parts."""
+    data = json.dumps(parts, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def save_json(path, data, indent=None):
+    """Writes data to path as JSON atomically, creating its folder."""
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path + '.tmp', 'w') as handle:
+        json.dump(data, handle, indent=indent)
+    os.replace(path + '.tmp', path)
+
+
+def manifest_path(project_path):
+    """Stage manifest path for a .psx path."""
+    return os.path.splitext(project_path)[0] + MANIFEST_SUFFIX
+
+
+def _matrix(matrix):
+    if matrix is None:
+        return None
+    return [round(matrix[row, column], 9) for row in range(4) for column in range(4)]
+
+
+def _calibration(sensor):
+    calibration = sensor.calibration
+    if calibration is None:
+        return None
+    return [round(getattr(calibration, name, 0.0) or 0.0, 9)
+            for name in ('f', 'cx', 'cy', 'b1', 'b2', 'k1', 'k2', 'k3', 'k4', 'p1', 'p2')]
+
+
+def chunk_state(chunk):
+    """Summary of a chunk's cameras, calibration and reconstruction products."""
+    point_cloud = chunk.point_cloud
+    return {'label': chunk.label,
+            'enabled': chunk.enabled,
+            'cameras': [(camera.label, camera.enabled, _matrix(camera.transform))
+                        for camera in chunk.cameras],
+            'sensors': [_calibration(sensor) for sensor in chunk.sensors],
+            'tie_points': len(point_cloud.points) if point_cloud is not None else 0,
+            'dense_cloud': chunk.dense_cloud is not None,
+            'model_faces': len(chunk.model.faces) if chunk.model is not None else 0}
+
+
+def camera_state(chunk):
+    """What a chunk's dense cloud and model depend on besides the photos and settings.
+
+    Camera poses, masks present, calibration, chunk transform and region.
+    """
+    region = chunk.region
+    return {'cameras': [(camera.label, camera.enabled, _matrix(camera.transform),
+                         getattr(camera, 'mask', None) is not None)
+                        for camera in chunk.cameras],
+            'sensors': [_calibration(sensor) for sensor in chunk.sensors],
+            'transform': _matrix(chunk.transform.matrix),
+            'region': [[round(value, 9) for value in list(region.center)[:3]],
+                       [round(value, 9) for value in list(region.size)[:3]],
+                       [round(region.rot[row, column], 9)
+                        for row in range(3) for column in range(3)]]}
+
+
+def document_fingerprint(document):
+    """Fingerprint of every chunk's state in a document."""
+    return fingerprint([chunk_state(chunk) for chunk in document.chunks])
+
+
+class StageManifest(object):
+    """Completed stages of one project and the fingerprints they were run with."""
+
+    def __init__(self, path):
+        self.path = path
+        self.stages = {}
+        try:
+            with open(path, 'r') as handle:
+                data = json.load(handle)
+            if data.get('version') == MANIFEST_VERSION:
+                self.stages = data.get('stages', {})
+        except (IOError, OSError, ValueError):
+            pass
+
+    def save(self):
+        save_json(self.path, {'version': MANIFEST_VERSION, 'stages': self.stages}, indent=1)
+
+    def output(self, stage):
+        """Output fingerprint recorded for stage, or None."""
+        record = self.stages.get(stage)
+        return record['output'] if record else None
+
+    def is_current(self, stage, inputs):
+        """True when stage completed with the same input fingerprint."""
+        record = self.stages.get(stage)
+        return record is not None and record['inputs'] == inputs
+
+    def complete(self, stage, inputs, output, seconds=None):
+        """Records a completed stage and saves the manifest."""
+        self.stages[stage] = {'inputs': inputs, 'output': output,
+                              'completed': time.time(), 'seconds': seconds}
+        self.save()
+
+    def invalidate(self, stages):
+        """Forgets the given stages and saves the manifest."""
+        for stage in stages:
+            self.stages.pop(stage, None)
+        self.save()
+
+    def keep_only(self, stages):
+        """Forgets every stage not in stages and saves the manifest."""
+        self.invalidate([stage for stage in list(self.stages) if stage not in stages])
@@ -0,0 +1,29 @@
+"""Headless entry point used by executor.run_per_chunk.
+
+Run as: photoscan -r chunk_worker.py <project.psx> <action>
+Opens the single-chunk project, runs the named master.py action on its chunk
+and saves the project.
+"""
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PhotoScan
+import master
+
+
+def main(argv):
+    """Runs one action on the chunk in the given project."""
+    logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+    path, action_name = argv[1], argv[2]
+    document = PhotoScan.app.document
+    document.open(path)
+    getattr(master, action_name)(document.chunk)
+    document.save()
+
+
+main(sys.argv)
+if hasattr(PhotoScan.app, 'quit'):
+    PhotoScan.app.quit()
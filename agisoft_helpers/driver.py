@@ -0,0 +1,236 @@
+"""Headless driver running the pipeline for many UID folders with overlapped stages.
+
+Run as: photoscan -r driver.py [--one-side] [--limit stage=N ...] ROOT_OR_UID [...]
+
+Each project runs its stages in order on its own thread. Every stage has a
+concurrency limit, so while one project waits on a network stage (dense
+cloud, model) other projects run their local stages (ingestion, sparse
+optimization with scale bars, export). Local stages run in headless PhotoScan
+processes when master.PHOTOSCAN_EXECUTABLE is set; otherwise they run in this
+process one at a time.
+
+Completed stages are recorded in the project's stage manifest, as are the
+pipeline steps run from the menu (see master.record_stage). Re-running a
+project skips stages whose inputs are unchanged and resumes from the first
+stage that is missing or affected by a change.
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PhotoScan
+import master
+from agisoft_helpers import checkpoint
+from agisoft_helpers import network
+from agisoft_helpers import sparse
+from agisoft_helpers import tracing
+
+LOG = logging.getLogger(__name__)
+
+LOCAL = 'local'
+NETWORK = 'network'
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'project_worker.py')
+
+# (stage name, kind, master.py action). Network actions return a batch id in
+# network mode, which the driver waits on; in local mode they run in place.
+FLIPFLOP_STAGES = [('ingest', LOCAL, None),
+                   ('align', NETWORK, 'align_sides'),
+                   ('optimize', LOCAL, 'optimize_sides_in_place'),
+                   ('dense_mask', NETWORK, 'auto_phase_two_nside'),
+                   ('merged_align', NETWORK, 'auto_phase_three'),
+                   ('merged_optimize', LOCAL, 'auto_optimize_merged_sides'),
+                   ('final', NETWORK, 'auto_phase_four'),
+                   ('export', LOCAL, 'export_final_models')]
+
+ONE_SIDE_STAGES = [('ingest', LOCAL, None),
+                   ('align', NETWORK, 'align_sides'),
+                   ('optimize', LOCAL, 'optimize_sides_in_place'),
+                   ('final', NETWORK, 'auto_phase_two_noalign'),
+                   ('export', LOCAL, 'export_final_models')]
+
+DEFAULT_LIMITS = {'ingest': 4, 'align': 8, 'optimize': 2, 'dense_mask': 8,
+                  'merged_align': 8, 'merged_optimize': 2, 'final': 8, 'export': 2}
+
+
+def find_uid_folders(paths):
+    """Expands root folders into the UID folders (those with an images folder) below them."""
+    folders = []
+    for path in paths:
+        path = path.replace('\\', '/').rstrip('/')
+        if os.path.isdir(path + '/' + master.IMAGES_FOLDER):
+            folders.append(path)
+            continue
+        for entry in sorted(os.listdir(path)):
+            if os.path.isdir(path + '/' + entry + '/' + master.IMAGES_FOLDER):
+                folders.append(path + '/' + entry)
+    return folders
+
+
+class Driver(object):
+    """Runs a stage list for many projects with per-stage concurrency limits."""
+
+    def __init__(self, stages, limits=None, poll_interval=30.0):
+        self.stages = stages
+        limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.semaphores = dict((name, threading.BoundedSemaphore(limits.get(name, 1)))
+                               for name, _, _ in stages)
+        self.poll_interval = poll_interval
+        self.in_process = threading.Lock()
+        self.client_lock = threading.Lock()
+        self.results = {}
+
+    def run(self, uid_folders):
+        """Runs every project; returns {uid folder: {stage: seconds or error}}."""
+        workers = max(1, len(uid_folders))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(self.run_project, uid_folders))
+        return self.results
+
+    def run_project(self, uid_folder):
+        """Runs the stages of one project, recording each one's seconds or error in results.
+
+        A failure before the first stage, such as an unreadable images folder,
+        is recorded under 'setup'. Calls traced on this thread go to the
+        project's own trace, whichever project is open at the time.
+        """
+        project = master.project_path(uid_folder)
+        with tracing.trace_to(os.path.dirname(project) + '/' + tracing.TRACE_NAME):
+            self._run_project(uid_folder, project)
+
+    def _run_project(self, uid_folder, project):
+        timings = self.results.setdefault(uid_folder, {})
+        try:
+            manifest = checkpoint.StageManifest(checkpoint.manifest_path(project))
+            images = master.images_fingerprint(uid_folder)
+            rerun_from = self._rerun_from(manifest, images, project)
+        except Exception as error:
+            LOG.exception('%s: cannot determine the stages to run', uid_folder)
+            timings['setup'] = 'failed: ' + str(error)
+            return
+        previous = images
+        for index, (name, kind, action) in enumerate(self.stages):
+            inputs = checkpoint.fingerprint(name, master.stage_settings(name), previous)
+            if index < rerun_from or (index > rerun_from and manifest.is_current(name, inputs)):
+                timings[name] = 'skipped'
+                previous = manifest.output(name)
+                LOG.info('%s: stage %s is up to date', uid_folder, name)
+                continue
+            start = time.time()
+            try:
+                with self.semaphores[name]:
+                    if name == 'ingest':
+                        self._ingest(uid_folder)
+                    elif kind == NETWORK:
+                        self._network_stage(uid_folder, action)
+                    else:
+                        self._local_stage(uid_folder, action)
+                previous = self._document_fingerprint(project)
+            except Exception as error:
+                LOG.exception('%s: stage %s failed', uid_folder, name)
+                timings[name] = 'failed: ' + str(error)
+                return
+            timings[name] = time.time() - start
+            manifest.complete(name, inputs, previous, timings[name])
+            LOG.info('%s: stage %s finished in %.1fs', uid_folder, name, timings[name])
+
+    def _rerun_from(self, manifest, images, project):
+        """Index of the first stage that must run.
+
+        Stages are up to date until the first one whose inputs changed. If the
+        project was modified after the last up-to-date stage, that stage runs
+        again. Later stages are skipped again if their inputs come out unchanged.
+        """
+        previous = images
+        index = 0
+        for name, _, _ in self.stages:
+            inputs = checkpoint.fingerprint(name, master.stage_settings(name), previous)
+            if not manifest.is_current(name, inputs):
+                break
+            previous = manifest.output(name)
+            index += 1
+        if index and os.path.exists(project) and previous != self._document_fingerprint(project):
+            index -= 1
+        return index
+
+    def _document_fingerprint(self, project):
+        with self.in_process:
+            document = PhotoScan.app.document
+            document.open(project)
+            sparse.invalidate()
+            return checkpoint.document_fingerprint(document)
+
+    def _ingest(self, uid_folder):
+        with self.in_process:
+            master.prepare_project(uid_folder, master.open_project(uid_folder))
+
+    def _run_in_process(self, uid_folder, action):
+        """Opens the project in this process, runs action and saves; returns its result."""
+        with self.in_process:
+            document = PhotoScan.app.document
+            document.open(master.project_path(uid_folder))
+            sparse.invalidate()
+            result = getattr(master, action)()
+            document.save()
+            return result
+
+    def _local_stage(self, uid_folder, action):
+        if not master.PHOTOSCAN_EXECUTABLE:
+            self._run_in_process(uid_folder, action)
+            return
+        command = [master.PHOTOSCAN_EXECUTABLE, '-r', WORKER_SCRIPT,
+                   master.project_path(uid_folder), action]
+        if subprocess.call(command) != 0:
+            raise RuntimeError(action + ' failed')
+
+    def _network_stage(self, uid_folder, action):
+        batch_id = self._run_in_process(uid_folder, action)
+        if batch_id is None:
+            return
+        while True:
+            with self.client_lock:
+                status = network.get_client(master.SERVER_IP).batchStatus(batch_id)
+            state = status.get('status')
+            if state == 'completed':
+                return
+            if state in ('failed', 'aborted'):
+                raise RuntimeError('batch ' + str(batch_id) + ' ' + state)
+            time.sleep(self.poll_interval)
+
+
+def parse_limits(values):
+    """Parses 'stage=N' strings."""
+    limits = {}
+    for value in values or []:
+        name, count = value.split('=')
+        limits[name] = int(count)
+    return limits
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run the pipeline for many UID folders.')
+    parser.add_argument('paths', nargs='+', help='UID folders or folders containing them')
+    parser.add_argument('--one-side', action='store_true', help='use the one-side pipeline')
+    parser.add_argument('--limit', action='append', metavar='STAGE=N',
+                        help='concurrency limit for a stage')
+    parser.add_argument('--poll', type=float, default=30.0, help='batch poll interval (s)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+    stages = ONE_SIDE_STAGES if args.one_side else FLIPFLOP_STAGES
+    driver = Driver(stages, parse_limits(args.limit), args.poll)
+    results = driver.run(find_uid_folders(args.paths))
+    for uid_folder, timings in sorted(results.items()):
+        LOG.info('%s: %s', uid_folder, timings)
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+    if hasattr(PhotoScan.app, 'quit'):
+        PhotoScan.app.quit()
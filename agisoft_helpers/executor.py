@@ -0,0 +1,80 @@
+"""Runs independent per-chunk work in parallel headless PhotoScan processes.
+
+Each chunk is copied into its own project file under PROCESSING/parts, a
+headless PhotoScan runs chunk_worker.py on it, and the resulting chunk is
+appended back into the open document in place of the original. With a single
+worker, a single chunk or no executable configured, the work runs inline.
+"""
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import PhotoScan
+
+from agisoft_helpers import sparse
+
+LOG = logging.getLogger(__name__)
+
+PARTS_FOLDER = 'parts'
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chunk_worker.py')
+
+
+def part_path(document, chunk):
+    """Project file used to hand a chunk to a worker process."""
+    folder = os.path.join(os.path.dirname(document.path), PARTS_FOLDER)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return os.path.join(folder, 'chunk_' + str(chunk.key) + '.psx').replace('\\', '/')
+
+
+def _run_worker(executable, arguments, path, action_name):
+    """Runs one headless worker and returns (path, return code, seconds)."""
+    start = time.time()
+    command = [executable] + list(arguments) + [WORKER_SCRIPT, path, action_name]
+    returncode = subprocess.call(command)
+    return path, returncode, time.time() - start
+
+
+def run_per_chunk(chunks, action, workers=1, executable='', arguments=('-r',), document=None):
+    """Runs action(chunk) for every chunk, in parallel processes when possible.
+
+    action must be a module-level function of master.py, as workers look it up
+    by name. Returns the chunks holding the results, in the order given.
+    """
+    if document is None:
+        document = PhotoScan.app.document
+    chunks = list(chunks)
+    if workers <= 1 or len(chunks) <= 1 or not executable or not document.path:
+        for chunk in chunks:
+            action(chunk)
+        return chunks
+
+    paths = []
+    for chunk in chunks:
+        part = PhotoScan.Document()
+        part.append(document, chunks=[chunk])
+        path = part_path(document, chunk)
+        part.save(path)
+        paths.append(path)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_worker, executable, arguments, path, action.__name__)
+                   for path in paths]
+        results = [future.result() for future in futures]
+
+    merged = []
+    for chunk, (path, returncode, seconds) in zip(chunks, results):
+        LOG.info('%s on %s finished with code %d in %.1fs', action.__name__, chunk.label,
+                 returncode, seconds)
+        if returncode != 0:
+            raise RuntimeError(action.__name__ + ' failed for chunk ' + chunk.label)
+        result = PhotoScan.Document()
+        result.open(path)
+        document.append(result)
+        new_chunk = document.chunks[-1]
+        sparse.invalidate(chunk)
+        document.remove(chunk)
+        merged.append(new_chunk)
+    return merged
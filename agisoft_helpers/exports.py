@@ -0,0 +1,372 @@
+"""Post-processing and validation of exported models, run in worker processes.
+
+Exports of high-poly models are several GB, so nothing here loads a whole
+mesh through Python objects. Binary PLY files are mapped with np.memmap and
+processed in blocks. OBJ files are scanned with regular expressions over an
+mmap. Each job takes and returns plain values so it can run in a process
+pool next to PhotoScan while it writes the next format:
+
+- validate_ply / validate_obj: counts, bounding box, NaN and index checks, SHA-256
+- compress: gzip copy
+- make_lod: vertex-clustering decimation to a fraction of the faces, as binary PLY
+- make_thumbnail: depth-shaded orthographic view as PNG (requires Pillow)
+
+submit queues the jobs for one file and collect gathers them for the report.
+"""
+import gzip
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+BLOCK_ROWS = 1 << 22
+PLY_TYPES = {'char': 'i1', 'uchar': 'u1', 'short': 'i2', 'ushort': 'u2', 'int': 'i4',
+             'uint': 'u4', 'float': 'f4', 'double': 'f8', 'int8': 'i1', 'uint8': 'u1',
+             'int16': 'i2', 'uint16': 'u2', 'int32': 'i4', 'uint32': 'u4', 'float32': 'f4',
+             'float64': 'f8'}
+OBJ_VERTEX = re.compile(rb'^v[ \t]+(\S+)[ \t]+(\S+)[ \t]+(\S+)', re.M)
+OBJ_FACE = re.compile(rb'^f[ \t]', re.M)
+THUMBNAIL_SIZE = 256
+LOD_STEPS = 4
+
+
+def read_ply_header(path):
+    """Returns (format, [(element, count, [(property, type, list count type or None)])], size)."""
+    elements = []
+    file_format = None
+    with open(path, 'rb') as handle:
+        if handle.readline().strip() != b'ply':
+            raise ValueError(path + ' is not a PLY file')
+        while True:
+            line = handle.readline()
+            if not line:
+                raise ValueError(path + ' has no end_header')
+            words = line.decode('ascii', 'replace').split()
+            if not words or words[0] in ('comment', 'obj_info'):
+                continue
+            if words[0] == 'end_header':
+                return file_format, elements, handle.tell()
+            if words[0] == 'format':
+                file_format = words[1]
+            elif words[0] == 'element':
+                elements.append((words[1], int(words[2]), []))
+            elif words[0] == 'property' and words[1] == 'list':
+                elements[-1][2].append((words[4], words[3], words[2]))
+            elif words[0] == 'property':
+                elements[-1][2].append((words[2], words[1], None))
+
+
+def _list_length(path, offset, count_type, endian):
+    with open(path, 'rb') as handle:
+        handle.seek(offset)
+        return int(np.frombuffer(handle.read(np.dtype(endian + PLY_TYPES[count_type]).itemsize),
+                                 dtype=endian + PLY_TYPES[count_type])[0])
+
+
+def ply_arrays(path):
+    """Memory-mapped structured arrays {element: array} of a binary PLY.
+
+    List properties are assumed to have the same length in every row, as
+    in triangle meshes; the length is read from the first row and checked
+    by validate_ply.
+    """
+    file_format, elements, offset = read_ply_header(path)
+    if file_format not in ('binary_little_endian', 'binary_big_endian'):
+        raise ValueError(path + ' is not a binary PLY')
+    endian = '<' if file_format == 'binary_little_endian' else '>'
+    arrays = {}
+    for name, count, properties in elements:
+        fields = []
+        position = offset
+        for prop, prop_type, list_type in properties:
+            if list_type is None:
+                fields.append((prop, endian + PLY_TYPES[prop_type]))
+                position += np.dtype(PLY_TYPES[prop_type]).itemsize
+            else:
+                length = _list_length(path, position, list_type, endian) if count else 0
+                fields.append((prop + '_count', endian + PLY_TYPES[list_type]))
+                fields.append((prop, endian + PLY_TYPES[prop_type], (length,)))
+                position += (np.dtype(PLY_TYPES[list_type]).itemsize +
+                             length * np.dtype(PLY_TYPES[prop_type]).itemsize)
+        dtype = np.dtype(fields)
+        arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        offset += dtype.itemsize * count
+    return arrays
+
+
+def checksum(path):
+    """SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 24), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _vertex_xyz(vertices, start, stop):
+    block = vertices[start:stop]
+    return np.column_stack([block['x'], block['y'], block['z']]).astype(np.float64)
+
+
+def validate_ply(path):
+    """Streams through a binary PLY; returns counts, bounds, problems and checksum."""
+    arrays = ply_arrays(path)
+    vertices = arrays.get('vertex')
+    faces = arrays.get('face')
+    problems = []
+    low = np.full(3, np.inf)
+    high = np.full(3, -np.inf)
+    vertex_count = 0 if vertices is None else len(vertices)
+    for start in range(0, vertex_count, BLOCK_ROWS):
+        xyz = _vertex_xyz(vertices, start, start + BLOCK_ROWS)
+        finite = np.isfinite(xyz).all(axis=1)
+        if not finite.all():
+            problems.append('%d vertices with NaN or infinite coordinates from row %d'
+                            % (np.count_nonzero(~finite), start))
+            xyz = xyz[finite]
+        if len(xyz):
+            low = np.minimum(low, xyz.min(axis=0))
+            high = np.maximum(high, xyz.max(axis=0))
+    face_count = 0 if faces is None else len(faces)
+    index_name = None
+    if faces is not None:
+        names = faces.dtype.names
+        index_name = 'vertex_indices' if 'vertex_indices' in names else 'vertex_index'
+    for start in range(0, face_count, BLOCK_ROWS):
+        block = faces[start:start + BLOCK_ROWS]
+        counts = block[index_name + '_count']
+        if (counts != block[index_name].shape[1]).any():
+            problems.append('faces with a different vertex count from row %d' % start)
+            break
+        indices = block[index_name]
+        if indices.size and (indices.min() < 0 or indices.max() >= vertex_count):
+            problems.append('face indices out of range from row %d' % start)
+    return {'path': path, 'vertices': vertex_count, 'faces': face_count,
+            'bounds': [low.tolist(), high.tolist()] if vertex_count else None,
+            'problems': problems, 'sha256': checksum(path), 'bytes': os.path.getsize(path)}
+
+
+def validate_obj(path):
+    """Scans an OBJ through mmap; returns counts, bounds, problems and checksum."""
+    problems = []
+    low = np.full(3, np.inf)
+    high = np.full(3, -np.inf)
+    vertex_count = 0
+    face_count = 0
+    with open(path, 'rb') as handle:
+        if os.path.getsize(path):
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                batch = []
+                for match in OBJ_VERTEX.finditer(mapped):
+                    batch.append(match.groups())
+                    if len(batch) >= BLOCK_ROWS:
+                        low, high = _obj_bounds(batch, low, high, problems)
+                        vertex_count += len(batch)
+                        batch = []
+                if batch:
+                    low, high = _obj_bounds(batch, low, high, problems)
+                    vertex_count += len(batch)
+                face_count = sum(1 for _ in OBJ_FACE.finditer(mapped))
+            finally:
+                mapped.close()
+    return {'path': path, 'vertices': vertex_count, 'faces': face_count,
+            'bounds': [low.tolist(), high.tolist()] if vertex_count else None,
+            'problems': problems, 'sha256': checksum(path), 'bytes': os.path.getsize(path)}
+
+
+def _obj_bounds(batch, low, high, problems):
+    try:
+        xyz = np.array(batch, dtype=np.float64)
+    except ValueError:
+        problems.append('unparseable vertex lines')
+        return low, high
+    finite = np.isfinite(xyz).all(axis=1)
+    if not finite.all():
+        problems.append('%d vertices with NaN or infinite coordinates' % np.count_nonzero(~finite))
+        xyz = xyz[finite]
+    if len(xyz):
+        low = np.minimum(low, xyz.min(axis=0))
+        high = np.maximum(high, xyz.max(axis=0))
+    return low, high
+
+
+def compress(path):
+    """Writes path + '.gz' next to path; returns its path and size."""
+    target = path + '.gz'
+    with open(path, 'rb') as source, gzip.open(target + '.tmp', 'wb', compresslevel=6) as output:
+        shutil.copyfileobj(source, output, 1 << 24)
+    os.replace(target + '.tmp', target)
+    return {'path': target, 'bytes': os.path.getsize(target)}
+
+
+def write_ply(path, vertices, faces):
+    """Writes float32 vertices (n, 3) and int32 triangles (m, 3) as binary PLY."""
+    header = ('ply\nformat binary_little_endian 1.0\nelement vertex %d\n'
+              'property float x\nproperty float y\nproperty float z\n'
+              'element face %d\nproperty list uchar int vertex_indices\nend_header\n'
+              % (len(vertices), len(faces)))
+    rows = np.empty(len(faces), dtype=[('count', 'u1'), ('indices', '<i4', (3,))])
+    rows['count'] = 3
+    rows['indices'] = faces
+    with open(path + '.tmp', 'wb') as handle:
+        handle.write(header.encode('ascii'))
+        handle.write(np.ascontiguousarray(vertices, dtype='<f4').tobytes())
+        handle.write(rows.tobytes())
+    os.replace(path + '.tmp', path)
+
+
+def _cluster(xyz, low, cell):
+    cells = np.floor((xyz - low) / cell).astype(np.int64)
+    return (cells[:, 0] * 2097152 + cells[:, 1]) * 2097152 + cells[:, 2]
+
+
+def _vertex_blocks(vertices, low):
+    """Yields (start, xyz, finite mask) per block of vertices, non-finite ones moved to low."""
+    for start in range(0, len(vertices), BLOCK_ROWS):
+        xyz = _vertex_xyz(vertices, start, start + BLOCK_ROWS)
+        finite = np.isfinite(xyz).all(axis=1)
+        xyz[~finite] = low
+        yield start, xyz, finite
+
+
+def _bounds(vertices):
+    """Low corner and largest extent of the finite vertices."""
+    low, high = np.full(3, np.inf), np.full(3, -np.inf)
+    for start in range(0, len(vertices), BLOCK_ROWS):
+        xyz = _vertex_xyz(vertices, start, start + BLOCK_ROWS)
+        xyz = xyz[np.isfinite(xyz).all(axis=1)]
+        if len(xyz):
+            low, high = np.minimum(low, xyz.min(axis=0)), np.maximum(high, xyz.max(axis=0))
+    if not np.isfinite(low).all():
+        return np.zeros(3), 1.0
+    return low, float((high - low).max()) or 1.0
+
+
+def _cells(vertices, low, cell):
+    """Sorted keys of the cells occupied by the vertices."""
+    occupied = np.zeros(0, dtype=np.int64)
+    for _, xyz, _ in _vertex_blocks(vertices, low):
+        occupied = np.union1d(occupied, _cluster(xyz, low, cell))
+    return occupied
+
+
+def make_lod(path, target_path, fraction):
+    """Decimates a binary triangle PLY by vertex clustering to about fraction of its faces.
+
+    Vertices are read in blocks of BLOCK_ROWS, so only the cell of each
+    vertex and the merged cells are held in memory.
+    """
+    arrays = ply_arrays(path)
+    vertices, faces = arrays['vertex'], arrays['face']
+    index_name = 'vertex_indices' if 'vertex_indices' in faces.dtype.names else 'vertex_index'
+    low, extent = _bounds(vertices)
+    target = max(int(len(faces) * fraction) // 2, 4)
+    # occupied cells grow with the square of the resolution on a surface
+    resolution = 64.0
+    for _ in range(LOD_STEPS):
+        cells = len(_cells(vertices, low, extent / resolution))
+        resolution = min(max(resolution * math.sqrt(float(target) / cells), 1.0), 2097151.0)
+    cell = extent / resolution
+    unique = _cells(vertices, low, cell)
+    remap = np.empty(len(vertices), dtype=np.int32)
+    finite = np.empty(len(vertices), dtype=bool)
+    counts = np.zeros(len(unique))
+    sums = np.zeros((len(unique), 3))
+    for start, xyz, block_finite in _vertex_blocks(vertices, low):
+        block = np.searchsorted(unique, _cluster(xyz, low, cell))
+        remap[start:start + len(block)] = block
+        finite[start:start + len(block)] = block_finite
+        counts += np.bincount(block, minlength=len(unique))
+        for axis in range(3):
+            sums[:, axis] += np.bincount(block, xyz[:, axis], len(unique))
+    merged = sums / counts[:, None]
+    triangles = []
+    for start in range(0, len(faces), BLOCK_ROWS):
+        indices = np.asarray(faces[start:start + BLOCK_ROWS][index_name], dtype=np.int64)
+        block = remap[indices]
+        keep = ((block[:, 0] != block[:, 1]) & (block[:, 1] != block[:, 2]) &
+                (block[:, 0] != block[:, 2]) & finite[indices].all(axis=1))
+        triangles.append(block[keep])
+    triangles = np.concatenate(triangles) if triangles else np.zeros((0, 3), dtype=np.int64)
+    triangles = np.unique(np.sort(triangles, axis=1), axis=0) if len(triangles) else triangles
+    write_ply(target_path, merged, triangles.astype(np.int32))
+    return {'path': target_path, 'fraction': fraction, 'vertices': len(merged),
+            'faces': len(triangles)}
+
+
+def make_thumbnail(path, target_path, size=THUMBNAIL_SIZE):
+    """Renders a depth-shaded front view of a PLY's vertices to a PNG."""
+    if Image is None:
+        raise ImportError('Pillow is required for thumbnails')
+    vertices = ply_arrays(path)['vertex']
+    step = max(1, len(vertices) // (size * size * 4))
+    xyz = _vertex_xyz(vertices[::step], 0, len(vertices[::step]))
+    xyz = xyz[np.isfinite(xyz).all(axis=1)]
+    image = np.zeros((size, size), dtype=np.uint8)
+    if len(xyz):
+        low, high = xyz.min(axis=0), xyz.max(axis=0)
+        scale = (size - 1) / max(float((high - low)[:2].max()), 1e-12)
+        columns = ((xyz[:, 0] - low[0]) * scale).astype(np.int64)
+        rows = (size - 1 - (xyz[:, 1] - low[1]) * scale).astype(np.int64)
+        depth = (xyz[:, 2] - low[2]) / max(float(high[2] - low[2]), 1e-12)
+        order = np.argsort(depth)
+        image[rows[order], columns[order]] = (55 + 200 * depth[order]).astype(np.uint8)
+    Image.fromarray(image).save(target_path)
+    return {'path': target_path}
+
+
+def submit(pool, path, lod_paths=None, thumbnail_path=None, compressed=True):
+    """Queues the jobs for one exported file; returns {job name: future}.
+
+    lod_paths maps face fractions to output paths and, like thumbnail_path,
+    only applies to binary PLY files.
+    """
+    futures = {'validate': pool.submit(validate_ply if path.lower().endswith('.ply')
+                                       else validate_obj, path)}
+    if compressed:
+        futures['compress'] = pool.submit(compress, path)
+    for fraction, target_path in sorted((lod_paths or {}).items(), reverse=True):
+        futures['lod_%g' % fraction] = pool.submit(make_lod, path, target_path, fraction)
+    if thumbnail_path and Image is not None:
+        futures['thumbnail'] = pool.submit(make_thumbnail, path, thumbnail_path)
+    return futures
+
+
+def collect(futures):
+    """Waits for submit() futures; returns {job name: result}, failed jobs as {'error': ...}."""
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as error:
+            results[name] = {'error': repr(error)}
+    return results
+
+
+def problems(report):
+    """Problem descriptions of a report of collect() results per exported file."""
+    found = []
+    for path, results in sorted(report.items()):
+        for name, result in sorted(results.items()):
+            if 'error' in result:
+                found.append('%s %s: %s' % (path, name, result['error']))
+        for problem in results.get('validate', {}).get('problems', []):
+            found.append('%s: %s' % (path, problem))
+    return found
+
+
+def save_report(path, report):
+    """Writes an export report as JSON."""
+    with open(path, 'w') as handle:
+        json.dump(report, handle, indent=1, sort_keys=True)
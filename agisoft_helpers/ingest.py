@@ -0,0 +1,290 @@
+"""Image-set ingestion with a per-UID manifest and EXIF pre-grouping.
+
+Side folders are listed in parallel with os.scandir (which gets size and
+mtime from the directory listing on Windows shares). Only the EXIF header of
+each image is read, in a thread pool, and the results are kept in a JSON
+manifest under PROCESSING so that re-runs only read files whose size or mtime
+changed.
+
+Image width and height are only taken from tags that describe the main
+image: the Exif pixel dimensions, or IFD0 of a TIFF whose first image is not
+a reduced-resolution preview. The IFD0 size of a DNG is its preview's.
+"""
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_NAME = 'ingest_manifest.json'
+MANIFEST_VERSION = 3
+
+# TIFF tag ids used for grouping and capture order.
+TAG_NEW_SUBFILE_TYPE = 0x00FE
+TAG_WIDTH = 0x0100
+TAG_HEIGHT = 0x0101
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_FOCAL_LENGTH = 0x920A
+TAG_SUBSEC_ORIGINAL = 0x9291
+TAG_PIXEL_X = 0xA002
+TAG_PIXEL_Y = 0xA003
+TAG_FOCAL_PLANE_X_RES = 0xA20E
+TAG_FOCAL_PLANE_UNIT = 0xA210
+TAG_FOCAL_LENGTH_35MM = 0xA405
+TAG_SERIAL = 0xA431
+
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+# FocalPlaneResolutionUnit values in millimetres.
+UNIT_MM = {2: 25.4, 3: 10.0, 4: 1.0}
+# Bytes of a JPEG searched for the APP1 Exif segment.
+JPEG_HEADER_LIMIT = 1 << 17
+
+
+def scan_side(folder, extensions):
+    """Returns (path, size, mtime) for every image in folder, sorted by name."""
+    images = []
+    for entry in os.scandir(folder):
+        if entry.name.startswith('._') or not entry.is_file():
+            continue
+        if entry.name.split('.')[-1].lower() not in extensions:
+            continue
+        stat = entry.stat()
+        images.append((entry.path.replace('\\', '/'), stat.st_size, stat.st_mtime))
+    images.sort()
+    return images
+
+
+def list_images(images_folder, extensions):
+    """Returns {side: [(path, size, mtime)]} without reading any image."""
+    sides = sorted(entry.name for entry in os.scandir(images_folder) if entry.is_dir())
+    return dict((side, scan_side(os.path.join(images_folder, side), extensions))
+                for side in sides)
+
+
+def _read_ifd(handle, base, offset, endian):
+    """Returns {tag: (type, count, raw value)} for one IFD."""
+    handle.seek(base + offset)
+    count = struct.unpack(endian + 'H', handle.read(2))[0]
+    entries = {}
+    for _ in range(count):
+        data = handle.read(12)
+        if len(data) < 12:
+            break
+        tag, value_type, value_count, raw = struct.unpack(endian + 'HHI4s', data)
+        entries[tag] = (value_type, value_count, raw)
+    return entries
+
+
+def _value(handle, base, endian, entry):
+    """Decodes the first value of an IFD entry."""
+    value_type, value_count, raw = entry
+    size = TYPE_SIZES.get(value_type, 1) * value_count
+    if size > 4:
+        handle.seek(base + struct.unpack(endian + 'I', raw)[0])
+        data = handle.read(size)
+    else:
+        data = raw[:size]
+    if value_type == 2:
+        return data.split(b'\0', 1)[0].decode('ascii', 'replace').strip()
+    if value_type == 3:
+        return struct.unpack(endian + 'H', data[:2])[0]
+    if value_type in (4, 9):
+        return struct.unpack(endian + ('I' if value_type == 4 else 'i'), data[:4])[0]
+    if value_type in (5, 10):
+        numerator, denominator = struct.unpack(endian + ('II' if value_type == 5 else 'ii'),
+                                               data[:8])
+        return float(numerator) / denominator if denominator else 0.0
+    return None
+
+
+def _tiff_base(handle):
+    """Returns the offset of the TIFF header in a JPEG or TIFF/DNG file, or None."""
+    start = handle.read(4)
+    if start in (b'II*\x00', b'MM\x00*'):
+        return 0
+    if start[:2] != b'\xff\xd8':
+        return None
+    position = 2
+    handle.seek(position)
+    while position < JPEG_HEADER_LIMIT:
+        marker = handle.read(4)
+        if len(marker) < 4 or marker[0:1] != b'\xff':
+            return None
+        length = struct.unpack('>H', marker[2:4])[0]
+        if marker[1:2] == b'\xe1' and handle.read(6) == b'Exif\x00\x00':
+            return position + 10
+        if marker[1:2] in (b'\xda', b'\xd9'):
+            return None
+        position += 2 + length
+        handle.seek(position)
+    return None
+
+
+def read_exif(path):
+    """Reads the camera fields used for calibration grouping and capture time from a header."""
+    exif = {}
+    try:
+        with open(path, 'rb') as handle:
+            base = _tiff_base(handle)
+            if base is None:
+                return exif
+            handle.seek(base)
+            endian = '<' if handle.read(2) == b'II' else '>'
+            handle.seek(base + 4)
+            ifd0 = _read_ifd(handle, base, struct.unpack(endian + 'I', handle.read(4))[0], endian)
+            entries = dict(ifd0)
+            if TAG_EXIF_IFD in ifd0:
+                exif_offset = _value(handle, base, endian, ifd0[TAG_EXIF_IFD])
+                entries.update(_read_ifd(handle, base, exif_offset, endian))
+            fields = [('make', TAG_MAKE), ('model', TAG_MODEL), ('serial', TAG_SERIAL),
+                      ('focal_length', TAG_FOCAL_LENGTH),
+                      ('focal_length_35mm', TAG_FOCAL_LENGTH_35MM),
+                      ('width', TAG_PIXEL_X), ('height', TAG_PIXEL_Y),
+                      ('focal_plane_x_res', TAG_FOCAL_PLANE_X_RES),
+                      ('focal_plane_unit', TAG_FOCAL_PLANE_UNIT),
+                      ('datetime', TAG_DATETIME_ORIGINAL), ('subsec', TAG_SUBSEC_ORIGINAL)]
+            for name, tag in fields:
+                if tag in entries:
+                    exif[name] = _value(handle, base, endian, entries[tag])
+            # IFD0 describes the main image unless it is flagged as a reduced-resolution one
+            main_image = (TAG_NEW_SUBFILE_TYPE not in ifd0 or
+                          not _value(handle, base, endian, ifd0[TAG_NEW_SUBFILE_TYPE]) & 1)
+            for name, tag in (('width', TAG_WIDTH), ('height', TAG_HEIGHT)):
+                if main_image and name not in exif and tag in ifd0:
+                    exif[name] = _value(handle, base, endian, ifd0[tag])
+    except (IOError, OSError, struct.error, ValueError):
+        pass
+    if exif.get('focal_plane_x_res'):
+        unit = UNIT_MM.get(exif.get('focal_plane_unit', 2), 25.4)
+        exif['pixel_size'] = unit / exif['focal_plane_x_res']
+    return exif
+
+
+def group_key(exif):
+    """Calibration group a set of EXIF fields belongs to."""
+    return (exif.get('make', ''), exif.get('model', ''), exif.get('serial', ''),
+            round(exif.get('focal_length') or 0.0, 2), exif.get('width', 0), exif.get('height', 0))
+
+
+def load_manifest(path):
+    """Returns {image path: record} from a manifest file, or an empty dict."""
+    try:
+        with open(path, 'r') as handle:
+            manifest = json.load(handle)
+    except (IOError, OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('files', {})
+
+
+def save_manifest(path, files):
+    """Writes the manifest atomically."""
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as handle:
+        json.dump({'version': MANIFEST_VERSION, 'files': files}, handle)
+    os.replace(temp_path, path)
+
+
+def ingest(images_folder, manifest_path, extensions, workers=8):
+    """Scans every side folder and returns ({side: [record]}, [changed paths]).
+
+    A record is a dict with path, size, mtime and exif. EXIF is read only for
+    images that are new or whose size or mtime differ from the manifest.
+    """
+    sides = sorted(entry.name for entry in os.scandir(images_folder) if entry.is_dir())
+    known = load_manifest(manifest_path)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        listings = list(pool.map(lambda side: scan_side(os.path.join(images_folder, side),
+                                                        extensions), sides))
+        changed = []
+        for listing in listings:
+            for path, size, mtime in listing:
+                record = known.get(path)
+                if record is None or record['size'] != size or record['mtime'] != mtime:
+                    changed.append((path, size, mtime))
+        exifs = pool.map(read_exif, [path for path, _, _ in changed])
+        for (path, size, mtime), exif in zip(changed, exifs):
+            known[path] = {'path': path, 'size': size, 'mtime': mtime, 'exif': exif}
+    result = {}
+    files = {}
+    for side, listing in zip(sides, listings):
+        result[side] = [known[path] for path, _, _ in listing]
+        for path, _, _ in listing:
+            files[path] = known[path]
+    save_manifest(manifest_path, files)
+    return result, [path for path, _, _ in changed]
+
+
+SENSOR_FIELDS = ('type', 'width', 'height', 'pixel_width', 'pixel_height', 'focal_length')
+
+
+def _copy_sensor(chunk, source):
+    """New sensor with the image and lens properties of source."""
+    sensor = chunk.addSensor()
+    for field in SENSOR_FIELDS:
+        value = getattr(source, field, None)
+        if value is not None:
+            setattr(sensor, field, value)
+    return sensor
+
+
+def apply_calibration_groups(chunk, records):
+    """Puts the cameras of records into one sensor per EXIF calibration group.
+
+    Pass the records of every photo of the chunk, not only newly added ones.
+    Each group keeps the sensor most of its cameras already use, so sensors
+    built by PhotoScan and groups made by an earlier ingest are reused. Only
+    a group whose cameras share a sensor with a larger group gets a new one,
+    copied from that sensor.
+    """
+    cameras = {}
+    for camera in chunk.cameras:
+        cameras[camera.photo.path.replace('\\', '/')] = camera
+    groups = {}
+    for record in records:
+        if record['path'] in cameras:
+            groups.setdefault(group_key(record['exif']), []).append(record)
+    taken = set()
+    chosen = []
+    for key, members in sorted(groups.items(), key=lambda item: (-len(item[1]), item[0])):
+        votes = {}
+        for record in members:
+            sensor = cameras[record['path']].sensor
+            if sensor is not None:
+                count, _ = votes.get(sensor.key, (0, sensor))
+                votes[sensor.key] = (count + 1, sensor)
+        free = [(-count, sensor_key) for sensor_key, (count, _) in votes.items()
+                if sensor_key not in taken]
+        if free:
+            sensor = votes[min(free)[1]][1]
+        else:
+            source = cameras[members[0]['path']].sensor
+            sensor = _copy_sensor(chunk, source) if source is not None else chunk.addSensor()
+            sensor.label = ' '.join(str(part) for part in key[:2] if part) or 'Auto group'
+        taken.add(sensor.key)
+        chosen.append((sensor, members))
+    # copies are made above, before any sensor is changed
+    for sensor, members in chosen:
+        exif = members[0]['exif']
+        if exif.get('width') and exif.get('height'):
+            sensor.width = exif['width']
+            sensor.height = exif['height']
+        if exif.get('pixel_size'):
+            sensor.pixel_width = exif['pixel_size']
+            sensor.pixel_height = exif['pixel_size']
+        if exif.get('focal_length'):
+            sensor.focal_length = exif['focal_length']
+        for record in members:
+            camera = cameras[record['path']]
+            if camera.sensor is None or camera.sensor.key != sensor.key:
+                camera.sensor = sensor
+    used = set(camera.sensor.key for camera in chunk.cameras if camera.sensor is not None)
+    unused = [sensor for sensor in chunk.sensors if sensor.key not in used]
+    if unused:
+        chunk.remove(unused)
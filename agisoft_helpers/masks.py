@@ -0,0 +1,202 @@
+"""Foreground masks computed from the photos, for aligning flipflop sides.
+
+The model-based masks of auto_phase_two_nside need a dense cloud and model
+per side only to be thrown away after the sides are aligned. Here each
+photo is segmented on its own, at reduced size, either by its distance from
+the backdrop colour (taken from the image border) or by differencing
+against a photo of the empty turntable plate. Masks are cached under
+PROCESSING/masks by a hash of the image content and the mask settings, and
+are linked per chunk and photo folder under {filename}_mask.png names, so
+one ImportMasks call per folder loads them and photos with the same name
+in different folders keep their own masks. Requires Pillow.
+"""
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from agisoft_helpers import checkpoint
+from agisoft_helpers import pools
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+THRESHOLD = 'threshold'
+BACKGROUND = 'background'
+CACHE_FOLDER = 'masks'
+LINK_FOLDER = 'mask_links'
+INDEX_NAME = 'index.json'
+MASK_SUFFIX = '_mask.png'
+ANALYSIS_SIZE = 1024
+BORDER = 8
+DEFAULT_SETTINGS = {'method': THRESHOLD, 'background': '', 'threshold': None, 'dilate': 4}
+
+_PLATES = {}
+
+
+def file_hash(path):
+    """SHA-1 of a file's content."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def otsu(values):
+    """Otsu threshold of values scaled to 0-255."""
+    histogram = np.bincount(np.clip(values, 0, 255).astype(np.int64).ravel(), minlength=256)
+    weights = np.cumsum(histogram).astype(np.float64)
+    sums = np.cumsum(histogram * np.arange(256)).astype(np.float64)
+    total, total_sum = weights[-1], sums[-1]
+    background = np.maximum(weights, 1.0)
+    foreground = np.maximum(total - weights, 1.0)
+    between = weights * (total - weights) * (sums / background -
+                                             (total_sum - sums) / foreground) ** 2
+    return float(np.argmax(between))
+
+
+def _shift_max(mask, radius):
+    """Binary dilation by a (2 * radius + 1) square."""
+    grown = mask.copy()
+    for axis in (0, 1):
+        source = grown.copy()
+        for offset in range(1, radius + 1):
+            forward = [slice(None), slice(None)]
+            backward = [slice(None), slice(None)]
+            forward[axis], backward[axis] = slice(offset, None), slice(None, -offset)
+            grown[tuple(forward)] |= source[tuple(backward)]
+            grown[tuple(backward)] |= source[tuple(forward)]
+    return grown
+
+
+def clean(mask, radius):
+    """Closes small holes, drops specks, then grows the mask by radius pixels."""
+    if radius <= 0:
+        return mask
+    closed = ~_shift_max(~_shift_max(mask, 2), 2)
+    opened = _shift_max(~_shift_max(~closed, 2), 2)
+    return _shift_max(opened, radius)
+
+
+def _load(path):
+    """Image as a float RGB array at analysis size, and its full size."""
+    image = Image.open(path)
+    size = image.size
+    image.draft('RGB', (ANALYSIS_SIZE, ANALYSIS_SIZE))
+    image = image.convert('RGB')
+    image.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    return np.asarray(image, dtype=np.float32), size
+
+
+def _plate(path, shape):
+    """Background plate at the analysis shape, loaded once per process."""
+    key = (path, shape)
+    if key not in _PLATES:
+        image = Image.open(path).convert('RGB').resize((shape[1], shape[0]))
+        _PLATES[key] = np.asarray(image, dtype=np.float32)
+    return _PLATES[key]
+
+
+def foreground(pixels, settings):
+    """Boolean foreground mask of an RGB array."""
+    if settings['method'] == BACKGROUND and settings['background']:
+        reference = _plate(settings['background'], pixels.shape[:2])
+    else:
+        border = np.concatenate([pixels[:BORDER].reshape(-1, 3), pixels[-BORDER:].reshape(-1, 3),
+                                 pixels[:, :BORDER].reshape(-1, 3),
+                                 pixels[:, -BORDER:].reshape(-1, 3)])
+        reference = np.median(border, axis=0)
+    distance = np.sqrt(np.sum((pixels - reference) ** 2, axis=2)) / np.sqrt(3.0)
+    threshold = settings['threshold']
+    if threshold is None:
+        threshold = otsu(distance)
+    return clean(distance > threshold, settings['dilate'])
+
+
+def make_mask(task):
+    """Writes the mask of one image; task is (image path, mask path, settings)."""
+    if Image is None:
+        raise ImportError('Pillow is required for image masks')
+    path, mask_path, settings = task
+    pixels, size = _load(path)
+    mask = Image.fromarray(foreground(pixels, settings).astype(np.uint8) * 255)
+    mask = mask.resize(size, Image.NEAREST)
+    mask.save(mask_path + '.tmp.png')
+    os.replace(mask_path + '.tmp.png', mask_path)
+    return mask_path
+
+
+def content_hashes(paths, index_path, workers=8):
+    """Returns {path: content hash}, hashing only files new or changed since the index."""
+    try:
+        with open(index_path, 'r') as handle:
+            index = json.load(handle)
+    except (IOError, OSError, ValueError):
+        index = {}
+    stale = []
+    for path in paths:
+        stat = os.stat(path)
+        entry = index.get(path)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+            stale.append((path, stat.st_size, stat.st_mtime))
+    if stale:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (path, size, mtime), digest in zip(stale, pool.map(file_hash,
+                                                                   [item[0] for item in stale])):
+                index[path] = {'size': size, 'mtime': mtime, 'hash': digest}
+        checkpoint.save_json(index_path, index)
+    return dict((path, index[path]['hash']) for path in paths)
+
+
+def _link(source, target):
+    """Hard-links source to target, copying where links are not supported."""
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except (OSError, AttributeError):
+        shutil.copyfile(source, target)
+
+
+def chunk_masks(chunk, processing_folder, settings=None, workers=None, python_executable=''):
+    """Makes masks for the photos of chunk.
+
+    Returns [(path template, cameras)], one ImportMasks call's arguments per
+    photo folder.
+    """
+    if settings is None:
+        settings = DEFAULT_SETTINGS
+    cache_folder = os.path.join(processing_folder, CACHE_FOLDER).replace('\\', '/')
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    cameras = {}
+    for camera in chunk.cameras:
+        cameras[camera.photo.path.replace('\\', '/')] = camera
+    paths = sorted(cameras)
+    hashes = content_hashes(paths, cache_folder + '/' + INDEX_NAME)
+    masks = {}
+    for path in paths:
+        masks[path] = cache_folder + '/' + checkpoint.fingerprint(hashes[path], settings) + '.png'
+    missing = [(path, masks[path], settings) for path in paths if not os.path.exists(masks[path])]
+    if missing:
+        with pools.worker_pool(workers, python_executable) as pool:
+            list(pool.map(make_mask, missing))
+    imports = []
+    photo_folders = sorted(set(os.path.dirname(path) for path in paths))
+    for index, photo_folder in enumerate(photo_folders):
+        link_folder = '/'.join([processing_folder, LINK_FOLDER, str(chunk.key), str(index)])
+        if not os.path.exists(link_folder):
+            os.makedirs(link_folder)
+        members = [path for path in paths if os.path.dirname(path) == photo_folder]
+        for path in members:
+            name = os.path.splitext(os.path.basename(path))[0]
+            _link(masks[path], link_folder + '/' + name + MASK_SUFFIX)
+        imports.append((link_folder + '/{filename}' + MASK_SUFFIX,
+                        [cameras[path] for path in members]))
+    return imports
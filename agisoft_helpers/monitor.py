@@ -0,0 +1,176 @@
+"""Asynchronous monitor for network batches.
+
+Polls the status of many batches over one client connection and records when
+each task starts and ends and on which node. Events are appended to a JSONL
+timeline; summary() reports projects per hour and node-hours per stage. A
+callback given to watch() runs as soon as its batch finishes and may submit
+and watch the next stage.
+
+A task that starts and finishes between two polls is recorded from the
+server's start time when the status has one, else from the previous poll.
+A batch whose status cannot be read STATUS_RETRIES times in a row is given
+up as 'error' without stopping the other watches.
+
+The client is not assumed to be thread safe, so every call to it goes through
+a single worker thread.
+"""
+import asyncio
+import csv
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LOG = logging.getLogger(__name__)
+
+FINISHED = ('completed', 'failed', 'aborted')
+# Consecutive failed status requests after which a batch is given up.
+STATUS_RETRIES = 5
+TIMELINE_FIELDS = ['batch_id', 'project', 'task', 'index', 'node', 'status', 'start', 'end',
+                   'duration']
+
+
+def _task_nodes(task):
+    """Node names assigned to a task status entry."""
+    nodes = task.get('nodes', task.get('node'))
+    if nodes is None:
+        return []
+    if isinstance(nodes, (list, tuple)):
+        return [str(node) for node in nodes]
+    return [str(nodes)]
+
+
+class BatchMonitor(object):
+    """Watches network batches and keeps a timeline of their tasks."""
+
+    def __init__(self, client, timeline_path=None, poll_interval=10.0, clock=time.time):
+        self.client = client
+        self.timeline_path = timeline_path
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.records = []
+        self.batches = {}
+        self._queued = []
+        self._tasks = []
+        self._loop = None
+        self._executor = None
+
+    def watch(self, batch_id, project='', on_complete=None):
+        """Starts watching batch_id; on_complete(monitor, batch_id, status) runs when it ends."""
+        self.batches[batch_id] = {'project': project, 'status': 'pending',
+                                  'start': None, 'end': None}
+        coroutine = self._watch(batch_id, project, on_complete)
+        if self._loop is not None and self._loop.is_running():
+            self._tasks.append(self._loop.create_task(coroutine))
+        else:
+            self._queued.append(coroutine)
+
+    def run(self):
+        """Polls until every watched batch, including ones added by callbacks, has finished."""
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            self._loop.run_until_complete(self._run_all())
+        finally:
+            self._loop.close()
+            self._executor.shutdown()
+            self._loop = None
+        return self.summary()
+
+    async def _run_all(self):
+        self._tasks = [self._loop.create_task(coroutine) for coroutine in self._queued]
+        self._queued = []
+        while self._tasks:
+            tasks, self._tasks = self._tasks, []
+            await asyncio.gather(*tasks)
+
+    async def _call(self, method, *args):
+        return await self._loop.run_in_executor(self._executor, method, *args)
+
+    async def _status(self, batch_id):
+        """batchStatus of batch_id, or an 'error' status once it failed STATUS_RETRIES times."""
+        for attempt in range(1, STATUS_RETRIES + 1):
+            try:
+                return await self._call(self.client.batchStatus, batch_id)
+            except Exception as error:
+                LOG.warning('status of batch %s failed (%d/%d): %s', batch_id, attempt,
+                            STATUS_RETRIES, error)
+                if attempt < STATUS_RETRIES:
+                    await asyncio.sleep(self.poll_interval)
+        return {'batch_id': batch_id, 'status': 'error', 'tasks': []}
+
+    async def _watch(self, batch_id, project, on_complete):
+        open_tasks = {}
+        recorded = set()
+        batch = self.batches[batch_id]
+        previous = self.clock()
+        while True:
+            status = await self._status(batch_id)
+            now = self.clock()
+            batch['status'] = status.get('status', 'unknown')
+            for index, task in enumerate(status.get('tasks', [])):
+                task_status = task.get('status', '')
+                if task_status == 'running' and index not in open_tasks:
+                    start = task.get('start', now)
+                    open_tasks[index] = (start, _task_nodes(task))
+                    if batch['start'] is None:
+                        batch['start'] = start
+                elif task_status in FINISHED and index not in recorded:
+                    # finished between two polls when it was never seen running
+                    start, nodes = open_tasks.pop(index, (task.get('start', previous), []))
+                    nodes = _task_nodes(task) or nodes
+                    if batch['start'] is None or start < batch['start']:
+                        batch['start'] = start
+                    self._record(batch_id, project, task.get('name', ''), index, nodes,
+                                 task_status, start, task.get('end', now))
+                    recorded.add(index)
+            previous = now
+            if batch['status'] in FINISHED or batch['status'] == 'error':
+                for index, (start, nodes) in sorted(open_tasks.items()):
+                    self._record(batch_id, project, '', index, nodes, batch['status'], start, now)
+                batch['end'] = now
+                if batch['start'] is None:
+                    batch['start'] = now
+                LOG.info('batch %s for %s %s', batch_id, project, batch['status'])
+                if on_complete is not None:
+                    on_complete(self, batch_id, status)
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    def _record(self, batch_id, project, name, index, nodes, status, start, end):
+        record = {'batch_id': batch_id, 'project': project, 'task': name, 'index': index,
+                  'node': ','.join(nodes), 'status': status, 'start': start, 'end': end,
+                  'duration': end - start}
+        self.records.append(record)
+        if self.timeline_path:
+            with open(self.timeline_path, 'a') as handle:
+                handle.write(json.dumps(record) + '\n')
+
+    def write_csv(self, path):
+        """Writes the task timeline as CSV."""
+        with open(path, 'w', newline='') as handle:
+            writer = csv.DictWriter(handle, fieldnames=TIMELINE_FIELDS)
+            writer.writeheader()
+            for record in self.records:
+                writer.writerow(record)
+
+    def summary(self):
+        """Returns throughput figures for the watched batches."""
+        finished = [batch for batch in self.batches.values() if batch['end'] is not None]
+        node_hours = {}
+        for record in self.records:
+            nodes = max(1, len([node for node in record['node'].split(',') if node]))
+            hours = record['duration'] * nodes / 3600.0
+            node_hours[record['task']] = node_hours.get(record['task'], 0.0) + hours
+        completed = [batch for batch in finished if batch['status'] == 'completed']
+        projects = set(batch['project'] for batch in completed)
+        if finished:
+            wall = max(batch['end'] for batch in finished) - min(batch['start'] for batch in finished)
+        else:
+            wall = 0.0
+        return {'batches': len(self.batches),
+                'completed': len(completed),
+                'failed': len(finished) - len(completed),
+                'wall_hours': wall / 3600.0,
+                'projects_per_hour': len(projects) / (wall / 3600.0) if wall > 0 else 0.0,
+                'node_hours': node_hours}
@@ -0,0 +1,92 @@
+"""Network batch building and submission over a pooled client connection.
+
+One client per server address is connected on first use and reused for every
+later submission. A BatchBuilder collects the tasks for a whole pipeline in
+order so a project can be submitted as a single batch; submit_projects sends
+batches for many projects over the same connection.
+"""
+import logging
+
+import PhotoScan
+
+LOG = logging.getLogger(__name__)
+
+_CLIENTS = {}
+
+
+def get_client(server_ip, factory=None):
+    """Returns the pooled client for server_ip, connecting it on first use."""
+    client = _CLIENTS.get(server_ip)
+    if client is None:
+        if factory is None:
+            factory = PhotoScan.NetworkClient
+        client = factory()
+        client.connect(server_ip)
+        _CLIENTS[server_ip] = client
+    return client
+
+
+def reset_client(server_ip=None):
+    """Drops the pooled client for server_ip, or every pooled client."""
+    if server_ip is None:
+        _CLIENTS.clear()
+    else:
+        _CLIENTS.pop(server_ip, None)
+
+
+class BatchBuilder(object):
+    """Collects network tasks, in execution order, for one project."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def add(self, chunks, task_parameters):
+        """Adds one task from a parameter dict ('name' plus task params) for chunks."""
+        network_task = PhotoScan.NetworkTask()
+        network_task.name = task_parameters['name']
+        for chunk in chunks:
+            network_task.frames.append((chunk.key, 0))
+        for key in task_parameters:
+            if key != 'name':
+                network_task.params[key] = task_parameters[key]
+        self.tasks.append(network_task)
+        return self
+
+    def add_stage(self, chunks, tasks):
+        """Adds a list of parameter dicts for the same chunks."""
+        for task_parameters in tasks:
+            self.add(chunks, task_parameters)
+        return self
+
+    def add_script(self, path, args=''):
+        """Adds a RunScript task; the script runs with the project open."""
+        return self.add([], {'name': 'RunScript', 'path': path, 'args': args})
+
+    def __len__(self):
+        return len(self.tasks)
+
+
+def submit(server_ip, project_path, builder, factory=None, resume=True):
+    """Creates a batch for project_path from builder and returns its id.
+
+    A failed call on the pooled connection is retried once on a fresh one.
+    """
+    try:
+        client = get_client(server_ip, factory)
+        batch_id = client.createBatch(project_path, builder.tasks)
+    except RuntimeError:
+        reset_client(server_ip)
+        client = get_client(server_ip, factory)
+        batch_id = client.createBatch(project_path, builder.tasks)
+    if resume:
+        client.resumeBatch(batch_id)
+    LOG.info('submitted batch %s for %s with %d tasks', batch_id, project_path, len(builder))
+    return batch_id
+
+
+def submit_projects(server_ip, projects, factory=None):
+    """Submits (project_path, builder) pairs over one connection; returns {path: batch id}."""
+    batches = {}
+    for project_path, builder in projects:
+        batches[project_path] = submit(server_ip, project_path, builder, factory)
+    return batches
@@ -0,0 +1,38 @@
+"""Entry point for RunScript tasks in network batches.
+
+Run by a processing node with the project open; args name a master.py
+function that takes no arguments. The project is saved afterwards so later
+tasks of the batch see the result.
+
+Args may start with "--project PATH", the project path relative to
+SHARED_ROOT (see master.network_script_args). master.SHARED_ROOT is then set
+to the node's own mount of the share, so paths under it such as the
+artifact cache are found on the node.
+"""
+import logging
+import os
+import sys
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PhotoScan
+import master
+
+
+def main(argv):
+    """Runs the named master.py action on the open project and saves it."""
+    logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+    args = argv[1:]
+    if args[:1] == ['--project']:
+        project = unquote(args[1])
+        path = PhotoScan.app.document.path.replace('\\', '/')
+        if path.endswith(project):
+            master.SHARED_ROOT = path[:len(path) - len(project)]
+        args = args[2:]
+    for action_name in args:
+        getattr(master, action_name)()
+    PhotoScan.app.document.save()
+
+
+main(sys.argv)
@@ -0,0 +1,168 @@
+"""Turntable-aware planning of the image pairs passed to matchPhotos.
+
+Generic preselection still looks at every pair of photos. On a turntable
+capture the capture order already says which frames overlap: neighbours on
+the same ring, frames at the same angle on the next ring and, once sides are
+merged, a few frames spread over every other side. plan_pairs lists those
+pairs, about n * k of them instead of n * n. Plans are cached per image set
+and settings under PROCESSING.
+"""
+import datetime
+import json
+import os
+
+from agisoft_helpers import checkpoint
+
+CACHE_FOLDER = 'pairs'
+DEFAULT_SETTINGS = {'neighbors': 3, 'cross_ring': 1, 'cross_side': 4, 'gap_factor': 3.0,
+                    'frames_per_ring': None}
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def capture_time(exif):
+    """Seconds since the epoch from EXIF DateTimeOriginal and SubSecTimeOriginal, or None."""
+    try:
+        taken = datetime.datetime.strptime(exif.get('datetime', ''), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    seconds = (taken - EPOCH).total_seconds()
+    subsec = str(exif.get('subsec') or '').strip()
+    if subsec.isdigit():
+        seconds += float('0.' + subsec)
+    return seconds
+
+
+def order_side(frames):
+    """Indices of frames in capture order: by time when every frame has one, else by name."""
+    indices = list(range(len(frames)))
+    if frames and all(frame['time'] is not None for frame in frames):
+        return sorted(indices, key=lambda index: (frames[index]['time'], frames[index]['path']))
+    return sorted(indices, key=lambda index: frames[index]['path'])
+
+
+def split_rings(times, gap_factor, frames_per_ring=None):
+    """Splits frames in capture order into rings; returns lists of positions.
+
+    With frames_per_ring the split is by count. Otherwise a new ring starts
+    at every pause longer than gap_factor times the typical interval, which
+    is where the camera was moved between revolutions.
+    """
+    count = len(times)
+    if frames_per_ring:
+        return [list(range(start, min(start + frames_per_ring, count)))
+                for start in range(0, count, frames_per_ring)]
+    if count < 3 or any(time is None for time in times):
+        return [list(range(count))]
+    gaps = [times[index + 1] - times[index] for index in range(count - 1)]
+    typical = sorted(gaps)[len(gaps) // 2] or sum(gaps) / float(len(gaps))
+    rings = [[0]]
+    for index, gap in enumerate(gaps):
+        if typical > 0 and gap > gap_factor * typical:
+            rings.append([])
+        rings[-1].append(index + 1)
+    return rings
+
+
+def ring_pairs(ring, neighbors):
+    """Links every frame to its next neighbors frames, wrapping around a full revolution."""
+    count = len(ring)
+    closed = count > 2 * neighbors + 1
+    links = []
+    for position in range(count):
+        for offset in range(1, neighbors + 1):
+            other = position + offset
+            if other >= count:
+                if not closed:
+                    break
+                other -= count
+            links.append((ring[position], ring[other]))
+    return links
+
+
+def cross_pairs(first, second, width):
+    """Links every frame of first to the frames of second at about the same angle."""
+    links = []
+    if not first or not second:
+        return links
+    for position, frame in enumerate(first):
+        center = int(round(position * len(second) / float(len(first))))
+        for offset in range(-width, width + 1):
+            links.append((frame, second[(center + offset) % len(second)]))
+    return links
+
+
+def spread_pairs(first, second, count):
+    """Links every frame of first to count frames spread evenly over second."""
+    links = []
+    if not first or not second:
+        return links
+    count = min(count, len(second))
+    for position, frame in enumerate(first):
+        start = position * len(second) // len(first)
+        for step in range(count):
+            links.append((frame, second[(start + step * len(second) // count) % len(second)]))
+    return links
+
+
+def plan_pairs(frames, settings=None):
+    """Planned (i, j) index pairs, i < j, for frames of dicts with path, side and time."""
+    if settings is None:
+        settings = DEFAULT_SETTINGS
+    sides = {}
+    for index, frame in enumerate(frames):
+        sides.setdefault(frame['side'], []).append(index)
+    ordered = {}
+    links = []
+    for side, members in sorted(sides.items()):
+        side_frames = [frames[index] for index in members]
+        order = [members[position] for position in order_side(side_frames)]
+        ordered[side] = order
+        rings = split_rings([frames[index]['time'] for index in order],
+                            settings['gap_factor'], settings['frames_per_ring'])
+        rings = [[order[position] for position in ring] for ring in rings]
+        for ring in rings:
+            links.extend(ring_pairs(ring, settings['neighbors']))
+        for first, second in zip(rings, rings[1:]):
+            links.extend(cross_pairs(first, second, settings['cross_ring']))
+    names = sorted(ordered)
+    for position, side in enumerate(names):
+        for other in names[position + 1:]:
+            links.extend(spread_pairs(ordered[side], ordered[other], settings['cross_side']))
+    return sorted(set((min(pair), max(pair)) for pair in links if pair[0] != pair[1]))
+
+
+def cached_plan(cache_folder, frames, settings=None):
+    """plan_pairs, reusing the plan saved for the same frames and settings."""
+    if settings is None:
+        settings = DEFAULT_SETTINGS
+    key = checkpoint.fingerprint([(frame['path'], frame['side'], frame['time'])
+                                  for frame in frames], settings)
+    path = os.path.join(cache_folder, key + '.json')
+    try:
+        with open(path, 'r') as handle:
+            return [tuple(pair) for pair in json.load(handle)]
+    except (IOError, OSError, ValueError):
+        pass
+    planned = plan_pairs(frames, settings)
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    with open(path, 'w') as handle:
+        json.dump(planned, handle)
+    return planned
+
+
+def chunk_pairs(chunk, manifest, cache_folder, settings=None):
+    """Planned (camera key, camera key) pairs for the cameras of chunk.
+
+    The side of a camera is the folder its photo is in; capture times come
+    from the EXIF fields in the ingest manifest.
+    """
+    cameras = [camera for camera in chunk.cameras if camera.photo is not None]
+    frames = []
+    for camera in cameras:
+        path = camera.photo.path.replace('\\', '/')
+        record = manifest.get(path, {})
+        frames.append({'path': path, 'side': path.split('/')[-2] if '/' in path else '',
+                       'time': capture_time(record.get('exif', {}))})
+    return [(cameras[first].key, cameras[second].key)
+            for first, second in cached_plan(cache_folder, frames, settings)]
@@ -0,0 +1,20 @@
+"""Worker pools for the helpers that process many images or files.
+
+Inside PhotoScan sys.executable is the application itself, so worker
+processes need a separate Python interpreter with NumPy and Pillow; without
+one, threads are used.
+"""
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def worker_pool(workers=None, python_executable=''):
+    """Process pool when a Python interpreter is available for workers, else a thread pool."""
+    if python_executable:
+        multiprocessing.set_executable(python_executable)
+        return ProcessPoolExecutor(max_workers=workers)
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return ProcessPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers or 8)
@@ -0,0 +1,213 @@
+"""Pre-flight cost estimate that picks processing settings per project.
+
+A project is profiled from its images: image count, resolution (from the
+ingest manifest) and texture richness, measured as corner density on a few
+downsampled frames. Each stage's cost is modelled from a work figure derived
+from the profile and the settings (pixels processed, keypoints matched),
+as time = exp(b0) * work ** b1 and memory = m0 + m1 * work. The time model
+is fitted to past runs from the monitor timeline; until there are enough
+runs, and for memory, the default coefficients below are used. The most
+detailed settings whose predicted time and memory fit the budget are
+chosen and saved next to the project.
+
+Downscale settings are PhotoScan's own levels: match accuracy 0 (Highest,
+photos upscaled twice), 1, 2, 4, 8 and dense quality 1 (Ultra), 2, 4, 8, 16.
+Downscale d processes 1 / d ** 2 of the pixels.
+"""
+import itertools
+import json
+import math
+import os
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+PREFLIGHT_NAME = 'preflight.json'
+ANALYSIS_SIZE = 512
+SAMPLE_FRAMES = 6
+# Corners per pixel assumed when frames cannot be sampled.
+DEFAULT_DENSITY = 0.004
+MIN_RUNS = 3
+
+# Options per setting, most detailed first, with the weight of one step down.
+OPTIONS = [('dense_downscale', (1, 2, 4), 8),
+           ('match_downscale', (0, 1, 2), 4),
+           ('face_count', (3, 2, 1), 2),
+           ('texture_size', (4096, 2048, 1024), 1),
+           ('keypoint_limit', (80000, 60000, 40000), 1)]
+
+# Network task names per modelled stage.
+STAGE_TASKS = {'align': ('MatchPhotos', 'AlignCameras'),
+               'dense': ('BuildDenseCloud',),
+               'model': ('BuildModel',),
+               'texture': ('BuildUV', 'BuildTexture')}
+
+# Default coefficients: time (b0, b1) in seconds, memory (m0, m1) in GB.
+DEFAULT_MODELS = {'align': {'time': (math.log(0.075), 1.0), 'memory': (1.0, 1e-4)},
+                  'dense': {'time': (math.log(1.0), 1.0), 'memory': (1.0, 5e-4)},
+                  'model': {'time': (math.log(0.25), 1.0), 'memory': (2.0, 5e-4)},
+                  'texture': {'time': (math.log(0.17), 1.0), 'memory': (1.0, 5e-4)}}
+
+
+def corner_density(path):
+    """Harris corners per pixel of a downsampled grey frame."""
+    image = Image.open(path)
+    image.draft('L', (ANALYSIS_SIZE, ANALYSIS_SIZE))
+    image = image.convert('L')
+    image.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    pixels = np.asarray(image, dtype=np.float32)
+    gradient_y, gradient_x = np.gradient(pixels)
+    xx, yy, xy = [_box(values) for values in (gradient_x * gradient_x, gradient_y * gradient_y,
+                                              gradient_x * gradient_y)]
+    response = xx * yy - xy * xy - 0.04 * (xx + yy) ** 2
+    peak = response.max()
+    if peak <= 0:
+        return 0.0
+    center = response[1:-1, 1:-1]
+    local_max = np.ones(center.shape, dtype=bool)
+    for row in (0, 1, 2):
+        for column in (0, 1, 2):
+            if (row, column) != (1, 1):
+                neighbour = response[row:row + center.shape[0], column:column + center.shape[1]]
+                local_max &= center >= neighbour
+    return float(np.count_nonzero(local_max & (center > 0.01 * peak))) / pixels.size
+
+
+def _box(values):
+    """3x3 box sum, same shape, edges padded."""
+    padded = np.pad(values, 1, mode='edge')
+    total = np.zeros(values.shape, dtype=np.float64)
+    for row in (0, 1, 2):
+        for column in (0, 1, 2):
+            total += padded[row:row + values.shape[0], column:column + values.shape[1]]
+    return total
+
+
+def profile_images(records, sample=SAMPLE_FRAMES):
+    """Profile of an image set from ingest records: count, megapixels and corner density."""
+    sizes = [record['exif'].get('width', 0) * record['exif'].get('height', 0)
+             for record in records]
+    known = [size for size in sizes if size]
+    paths = [record['path'] for record in records]
+    picked = [paths[int(index)] for index in np.linspace(0, len(paths) - 1,
+                                                         min(sample, len(paths)))]
+    if not known and Image is not None and picked:
+        width, height = Image.open(picked[0]).size
+        known = [width * height]
+    density = DEFAULT_DENSITY
+    if Image is not None and picked:
+        density = float(np.median([corner_density(path) for path in picked]))
+    return {'images': len(records),
+            'megapixels': float(np.median(known)) / 1e6 if known else 0.0,
+            'density': density}
+
+
+def pixel_fraction(downscale):
+    """Fraction of the full-resolution pixels processed at a downscale level."""
+    if downscale == 0:
+        return 4.0
+    return 1.0 / downscale ** 2
+
+
+def stage_work(profile, settings):
+    """Work figure per stage for a profile and settings."""
+    images = max(profile['images'], 1)
+    megapixels = max(profile['megapixels'], 0.1)
+    matched_pixels = megapixels * 1e6 * pixel_fraction(settings['match_downscale'])
+    keypoints = min(settings['keypoint_limit'], profile['density'] * matched_pixels)
+    dense = images * megapixels * pixel_fraction(settings['dense_downscale'])
+    return {'align': images * keypoints / 1000.0,
+            'dense': dense,
+            'model': dense * settings['face_count'] / 3.0,
+            'texture': images * megapixels + 4.0 * (settings['texture_size'] / 1024.0) ** 2}
+
+
+def predict(profile, settings, models=None):
+    """Returns {stage: (seconds, memory GB)}."""
+    if models is None:
+        models = DEFAULT_MODELS
+    prediction = {}
+    for stage, work in stage_work(profile, settings).items():
+        b0, b1 = models[stage]['time']
+        m0, m1 = models[stage]['memory']
+        prediction[stage] = (math.exp(b0) * max(work, 1e-6) ** b1, m0 + m1 * work)
+    return prediction
+
+
+def choose_settings(profile, hours, memory_gb, models=None):
+    """Most detailed settings predicted to fit the budget, else the cheapest.
+
+    Returns (settings, prediction).
+    """
+    best = None
+    for levels in itertools.product(*[range(len(options)) for _, options, _ in OPTIONS]):
+        settings = dict((name, options[level])
+                        for (name, options, _), level in zip(OPTIONS, levels))
+        prediction = predict(profile, settings, models)
+        seconds = sum(cost[0] for cost in prediction.values())
+        memory = max(cost[1] for cost in prediction.values())
+        fits = seconds <= hours * 3600.0 and memory <= memory_gb
+        penalty = sum(weight * level for (_, _, weight), level in zip(OPTIONS, levels))
+        key = (not fits, penalty if fits else seconds, seconds)
+        if best is None or key < best[0]:
+            best = (key, settings, prediction)
+    return best[1], best[2]
+
+
+def load(path):
+    """Reads a saved pre-flight result, or None."""
+    try:
+        with open(path, 'r') as handle:
+            return json.load(handle)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save(path, profile, settings, prediction):
+    """Writes the profile, chosen settings and prediction for a project."""
+    with open(path, 'w') as handle:
+        json.dump({'profile': profile, 'settings': settings, 'prediction': prediction},
+                  handle, indent=1, sort_keys=True)
+
+
+def fit_models(timeline_path, project_folder):
+    """Fits the time models to a monitor timeline; returns models for predict().
+
+    project_folder(project) maps a timeline project path to its PROCESSING
+    folder, where the pre-flight result of that run is read from. Stages
+    with fewer than MIN_RUNS runs keep their default coefficients.
+    """
+    durations = {}
+    try:
+        with open(timeline_path, 'r') as handle:
+            for line in handle:
+                record = json.loads(line)
+                if record.get('status') != 'completed':
+                    continue
+                for stage, tasks in STAGE_TASKS.items():
+                    if record.get('task') in tasks:
+                        key = (record['project'], stage)
+                        durations[key] = durations.get(key, 0.0) + record['duration']
+    except (IOError, OSError, ValueError):
+        pass
+    samples = dict((stage, []) for stage in STAGE_TASKS)
+    results = {}
+    for (project, stage), seconds in durations.items():
+        if project not in results:
+            results[project] = load(os.path.join(project_folder(project), PREFLIGHT_NAME))
+        result = results[project]
+        if result is not None and seconds > 0:
+            work = stage_work(result['profile'], result['settings'])[stage]
+            samples[stage].append((math.log(max(work, 1e-6)), math.log(seconds)))
+    models = dict((stage, dict(model)) for stage, model in DEFAULT_MODELS.items())
+    for stage, points in samples.items():
+        if len(points) >= MIN_RUNS and len(set(point[0] for point in points)) > 1:
+            points = np.array(points)
+            design = np.column_stack([np.ones(len(points)), points[:, 0]])
+            b0, b1 = np.linalg.lstsq(design, points[:, 1], rcond=None)[0]
+            models[stage]['time'] = (float(b0), float(b1))
+    return models
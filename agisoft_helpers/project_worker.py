@@ -0,0 +1,29 @@
+"""Headless entry point used by the batch driver for local stages.
+
+Run as: photoscan -r project_worker.py <project.psx> <action> [<action> ...]
+Opens the project, runs each named master.py action (functions that work on
+the open document and take no arguments) and saves the project.
+"""
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PhotoScan
+import master
+
+
+def main(argv):
+    """Runs the named actions on the given project."""
+    logging.basicConfig(level=logging.INFO, format='%(name)s: %(message)s')
+    document = PhotoScan.app.document
+    document.open(argv[1])
+    for action_name in argv[2:]:
+        getattr(master, action_name)()
+    document.save()
+
+
+main(sys.argv)
+if hasattr(PhotoScan.app, 'quit'):
+    PhotoScan.app.quit()
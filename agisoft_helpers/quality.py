@@ -0,0 +1,159 @@
+"""Image-quality prefilter run before photo matching.
+
+Each image is decoded at reduced size (JPEG draft mode where possible) and
+scored for sharpness (variance of the Laplacian), exposure (mean and clipped
+fractions) and a 64-bit difference hash. Scoring runs in a process pool and
+scores are cached per file under PROCESSING, keyed by size and mtime, so
+reruns only score new or changed images. Requires Pillow.
+"""
+import json
+import os
+
+import numpy as np
+
+from agisoft_helpers import pools
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+SCORES_NAME = 'quality_scores.json'
+ANALYSIS_SIZE = 512
+HASH_SIZE = 8
+
+# Rejection rules, relative to the other images of the same chunk.
+BLUR_RATIO = 0.35
+MAX_CLIPPED_HIGH = 0.25
+MAX_CLIPPED_LOW = 0.5
+DUPLICATE_DISTANCE = 2
+MAX_REJECT_FRACTION = 0.2
+
+
+def score_image(path):
+    """Returns sharpness, exposure and hash scores for one image."""
+    if Image is None:
+        raise ImportError('Pillow is required for the image-quality prefilter')
+    image = Image.open(path)
+    image.draft('L', (ANALYSIS_SIZE, ANALYSIS_SIZE))
+    image = image.convert('L')
+    image.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    pixels = np.asarray(image, dtype=np.float32)
+    laplacian = (pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1]
+                 - 4.0 * pixels[1:-1, 1:-1])
+    small = np.asarray(image.resize((HASH_SIZE + 1, HASH_SIZE)), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    dhash = 0
+    for bit in bits:
+        dhash = (dhash << 1) | int(bit)
+    return {'sharpness': float(laplacian.var()),
+            'mean': float(pixels.mean()),
+            'clipped_high': float(np.count_nonzero(pixels >= 250) / float(pixels.size)),
+            'clipped_low': float(np.count_nonzero(pixels <= 5) / float(pixels.size)),
+            'dhash': dhash}
+
+
+def load_scores(path):
+    """Returns cached scores keyed by image path."""
+    try:
+        with open(path, 'r') as handle:
+            return json.load(handle)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_scores(path, scores):
+    """Writes cached scores atomically."""
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path + '.tmp', 'w') as handle:
+        json.dump(scores, handle)
+    os.replace(path + '.tmp', path)
+
+
+def score_images(paths, cache_path, workers=None, python_executable=''):
+    """Returns {path: scores}, scoring only images missing from or stale in the cache.
+
+    Scoring runs in worker processes. Inside PhotoScan sys.executable is the
+    application itself, so python_executable must name a Python interpreter
+    with NumPy and Pillow for processes to be used; otherwise threads are used.
+    """
+    cache = load_scores(cache_path)
+    stale = []
+    for path in paths:
+        stat = os.stat(path)
+        entry = cache.get(path)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+            stale.append((path, stat.st_size, stat.st_mtime))
+    if stale:
+        with pools.worker_pool(workers, python_executable) as pool:
+            results = pool.map(score_image, [path for path, _, _ in stale])
+            for (path, size, mtime), scores in zip(stale, results):
+                scores.update({'size': size, 'mtime': mtime})
+                cache[path] = scores
+        save_scores(cache_path, cache)
+    return dict((path, cache[path]) for path in paths)
+
+
+def _hamming(hashes):
+    """Pairwise Hamming distances of 64-bit hashes."""
+    values = np.array(hashes, dtype=np.uint64)
+    xor = values[:, None] ^ values[None, :]
+    distances = np.zeros(xor.shape, dtype=np.int64)
+    for shift in range(64):
+        distances += ((xor >> np.uint64(shift)) & np.uint64(1)).astype(np.int64)
+    return distances
+
+
+def find_rejects(scores):
+    """Returns paths to drop, worst first: blurred, badly exposed and duplicate frames."""
+    paths = sorted(scores)
+    if not paths:
+        return []
+    sharpness = np.array([scores[path]['sharpness'] for path in paths])
+    median = np.median(sharpness)
+    badness = {}
+    for index, path in enumerate(paths):
+        entry = scores[path]
+        if sharpness[index] < median * BLUR_RATIO:
+            badness[path] = 1.0 - sharpness[index] / median
+        elif entry['clipped_high'] > MAX_CLIPPED_HIGH or entry['clipped_low'] > MAX_CLIPPED_LOW:
+            badness[path] = max(entry['clipped_high'], entry['clipped_low'])
+    distances = _hamming([scores[path]['dhash'] for path in paths])
+    for first, second in np.argwhere(np.triu(distances <= DUPLICATE_DISTANCE, 1)):
+        if paths[first] in badness or paths[second] in badness:
+            continue
+        softer = first if sharpness[first] < sharpness[second] else second
+        badness[paths[softer]] = 0.5
+    ranked = sorted(badness, key=lambda path: -badness[path])
+    return ranked[:int(len(paths) * MAX_REJECT_FRACTION)]
+
+
+def prefilter_chunk(chunk, cache_path, action='remove', workers=None, python_executable=''):
+    """Scores a chunk's photos and removes or disables the rejected cameras.
+
+    Photos are judged together with the ones judged for the chunk before,
+    removed ones included, so running it again rejects nothing new and the
+    share rejected stays capped against every photo the chunk was given.
+    Returns the rejected cameras.
+    """
+    cameras = {}
+    for camera in chunk.cameras:
+        cameras[camera.photo.path.replace('\\', '/')] = camera
+    scores = score_images(sorted(cameras), cache_path, workers, python_executable)
+    cache = load_scores(cache_path)
+    for path, entry in cache.items():
+        if entry.get('chunk') == chunk.label and path not in scores:
+            scores[path] = entry
+    rejected = [cameras[path] for path in find_rejects(scores) if path in cameras]
+    for path in cameras:
+        cache[path]['chunk'] = chunk.label
+    save_scores(cache_path, cache)
+    if action == 'remove':
+        if rejected:
+            chunk.remove(rejected)
+    else:
+        for camera in rejected:
+            camera.enabled = False
+    return rejected
@@ -0,0 +1,152 @@
+"""Lazy helper imports and a declarative menu registry, to keep start-up cheap.
+
+PhotoScan runs master.py at start-up on every workstation and processing
+node. Helper modules, and NumPy and Pillow with them, are imported through
+lazy() proxies that load the module on first attribute access, and menu
+items are registered from a list of (menu path, action, mode) entries whose
+callables are looked up only when the item is invoked. An action is a name
+in the given namespace or 'module:function'. Import and start-up times are
+kept in TIMINGS and, when a log path is configured, appended to it as JSON
+lines.
+"""
+import importlib
+import json
+import logging
+import platform
+import sys
+import time
+
+LOG = logging.getLogger(__name__)
+
+TIMINGS = {'startup': None, 'imports': {}}
+_SETTINGS = {'log_path': ''}
+_PENDING = []
+
+
+def configure(log_path=''):
+    """Sets the JSONL file that start-up and import times are appended to."""
+    _SETTINGS['log_path'] = log_path
+
+
+def _record(record):
+    if not _SETTINGS['log_path']:
+        return
+    record.update({'host': platform.node(), 'time': time.time()})
+    try:
+        with open(_SETTINGS['log_path'], 'a') as handle:
+            handle.write(json.dumps(record) + '\n')
+    except (IOError, OSError) as error:
+        LOG.warning('cannot record start-up times: %s', error)
+
+
+def import_module(name):
+    """Imports name, recording how long it took when it was not loaded yet."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.time()
+    module = importlib.import_module(name)
+    seconds = time.time() - start
+    TIMINGS['imports'][name] = seconds
+    if TIMINGS['startup'] is not None:
+        _record({'event': 'import', 'module': name, 'seconds': seconds})
+    return module
+
+
+class LazyModule(object):
+    """Stands in for a module until one of its attributes is used."""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_hooks'] = []
+        _PENDING.append(self)
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = import_module(self.__dict__['_name'])
+            self._loaded(module)
+            # modules imported along with this one get their hooks now, too
+            for proxy in list(_PENDING):
+                if proxy.__dict__['_name'] in sys.modules:
+                    proxy._loaded(sys.modules[proxy.__dict__['_name']])
+        return module
+
+    def _loaded(self, module):
+        if self.__dict__['_module'] is None:
+            self.__dict__['_module'] = module
+            _PENDING.remove(self)
+            for hook in self.__dict__['_hooks']:
+                hook(module)
+
+    def __getattr__(self, key):
+        if key.startswith('__'):
+            raise AttributeError(key)
+        return getattr(self._load(), key)
+
+    def __setattr__(self, key, value):
+        setattr(self._load(), key, value)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return '<lazy module %s, %s>' % (self.__dict__['_name'], state)
+
+
+def lazy(name):
+    """Proxy for module name that imports it on first use."""
+    return LazyModule(name)
+
+
+def on_import(module, hook):
+    """Calls hook(module) once module is imported; at once if it already is."""
+    if isinstance(module, LazyModule):
+        if module.__dict__['_module'] is None:
+            module.__dict__['_hooks'].append(hook)
+            return
+        module = module.__dict__['_module']
+    hook(module)
+
+
+def resolve(action, namespace):
+    """Callable for an action name in namespace or 'module:function'."""
+    if ':' in action:
+        module_name, name = action.split(':', 1)
+        return getattr(import_module(module_name), name)
+    return namespace[action]
+
+
+def deferred(action, namespace, before=None):
+    """Callable that looks up action when called, so its module loads then.
+
+    before, if given, is called with no arguments ahead of the action.
+    """
+    def run(*args, **kwargs):
+        if before is not None:
+            before()
+        return resolve(action, namespace)(*args, **kwargs)
+    run.__name__ = action.split(':')[-1]
+    return run
+
+
+def register(app, actions, namespace, modes=None, before=None):
+    """Adds the menu items of actions, [(path, action, mode)], with mode in modes.
+
+    modes None registers every item. before is called ahead of every action
+    (see deferred). Returns the number registered.
+    """
+    registered = 0
+    for path, action, mode in actions:
+        if modes is None or mode in modes:
+            app.addMenuItem(path, deferred(action, namespace, before))
+            registered += 1
+    return registered
+
+
+def finish_startup(start):
+    """Records the start-up time since start and the imports made so far."""
+    TIMINGS['startup'] = time.time() - start
+    LOG.debug('started in %.3f s', TIMINGS['startup'])
+    _record({'event': 'startup', 'seconds': TIMINGS['startup'],
+             'imports': dict(TIMINGS['imports'])})
+    return TIMINGS['startup']
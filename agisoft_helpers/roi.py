@@ -0,0 +1,164 @@
+"""Tight, oriented regions of interest fitted to the sparse cloud.
+
+Dense cloud time grows with the region volume, and the default region keeps
+a lot of turntable and background. fit_box trims outlying tie points, orients
+a box along the principal axes of what is left and sizes it to the points
+kept, plus padding. Points near markers (the coded targets and scale-bar ends on the
+turntable) can be left out first, and optionally everything on the far side
+of the plane through the markers.
+"""
+import logging
+
+import numpy as np
+import PhotoScan
+
+from agisoft_helpers import sparse
+
+LOG = logging.getLogger(__name__)
+
+PERCENTILE = 'percentile'
+DENSITY = 'density'
+
+
+class Box(object):
+    """Oriented box: center (3,), axes as columns of a rotation (3, 3) and size (3,)."""
+
+    def __init__(self, center, axes, size):
+        self.center = center
+        self.axes = axes
+        self.size = size
+
+    def volume(self):
+        """Box volume in chunk units."""
+        return float(np.prod(self.size))
+
+    def contains(self, coords):
+        """Boolean mask of coords (n, 3) inside the box."""
+        local = (coords - self.center).dot(self.axes)
+        return np.all(np.abs(local) <= self.size / 2.0, axis=1)
+
+
+def marker_positions(chunk):
+    """Positions of the chunk's placed markers, shape (m, 3)."""
+    positions = [(marker.position[0], marker.position[1], marker.position[2])
+                 for marker in chunk.markers if marker.position is not None]
+    return np.array(positions, dtype=np.float64).reshape(-1, 3)
+
+
+def trim_percentile(coords, trim):
+    """Keeps points no further from the median than the (1 - trim) quantile of distances."""
+    distances = np.linalg.norm(coords - np.median(coords, axis=0), axis=1)
+    return distances <= np.percentile(distances, 100.0 * (1.0 - trim))
+
+
+def trim_density(coords, resolution=None, min_count=3):
+    """Keeps points in voxels holding at least min_count points.
+
+    The grid spans the 1-99% range of each axis in resolution cells, so a few
+    far outliers do not make the cells huge; by default it is sized for about
+    50 points per cell.
+    """
+    if resolution is None:
+        resolution = max(2, int(round((len(coords) / 50.0) ** (1.0 / 3.0))))
+    low = np.percentile(coords, 1.0, axis=0)
+    high = np.percentile(coords, 99.0, axis=0)
+    cell = np.maximum((high - low) / resolution, 1e-12)
+    voxels = np.floor((coords - low) / cell).astype(np.int64)
+    _, inverse, counts = np.unique(voxels, axis=0, return_inverse=True, return_counts=True)
+    return counts[inverse.reshape(-1)] >= min_count
+
+
+def away_from_markers(coords, markers, radius):
+    """Mask of points further than radius from every marker."""
+    keep = np.ones(len(coords), dtype=bool)
+    for marker in markers:
+        keep &= np.sum((coords - marker) ** 2, axis=1) > radius * radius
+    return keep
+
+
+def above_marker_plane(coords, markers, margin):
+    """Mask of points more than margin from the marker plane, on the side most points are on."""
+    if len(markers) < 3:
+        return np.ones(len(coords), dtype=bool)
+    center = markers.mean(axis=0)
+    normal = np.linalg.svd(markers - center)[2][2]
+    distances = (coords - center).dot(normal)
+    if np.count_nonzero(distances < 0) > np.count_nonzero(distances > 0):
+        distances = -distances
+    return distances > margin
+
+
+def principal_axes(coords):
+    """Right-handed principal axes of coords as the columns of a rotation matrix."""
+    _, vectors = np.linalg.eigh(np.cov(coords - coords.mean(axis=0), rowvar=False))
+    axes = vectors[:, ::-1]
+    if np.linalg.det(axes) < 0:
+        axes[:, 2] = -axes[:, 2]
+    return axes
+
+
+def fit_box(coords, trim=0.02, method=PERCENTILE, markers=None, marker_radius=None,
+            cut_marker_plane=False, padding=0.05):
+    """Fits an oriented box to coords (n, 3); returns a Box or None if too few points remain.
+
+    trim is the fraction of points dropped as outliers by the percentile
+    method; the box spans the points kept, widened by padding on each side.
+    marker_radius defaults to 2% of the trimmed cloud's diagonal.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) < 4:
+        return None
+    if method == DENSITY:
+        keep = trim_density(coords)
+    else:
+        keep = trim_percentile(coords, trim)
+    if markers is not None and len(markers):
+        if marker_radius is None:
+            kept = coords[keep]
+            marker_radius = 0.02 * np.linalg.norm(kept.max(axis=0) - kept.min(axis=0))
+        keep &= away_from_markers(coords, markers, marker_radius)
+        if cut_marker_plane:
+            keep &= above_marker_plane(coords, markers, marker_radius)
+    coords = coords[keep]
+    if len(coords) < 4:
+        return None
+    axes = principal_axes(coords)
+    local = (coords - coords.mean(axis=0)).dot(axes)
+    low = local.min(axis=0)
+    high = local.max(axis=0)
+    size = (high - low) * (1.0 + 2.0 * padding)
+    center = coords.mean(axis=0) + axes.dot((low + high) / 2.0)
+    return Box(center, axes, size)
+
+
+def region_box(chunk):
+    """The chunk's current region as a Box."""
+    region = chunk.region
+    axes = np.array([[region.rot[row, column] for column in range(3)] for row in range(3)])
+    return Box(np.array([region.center[index] for index in range(3)]), axes,
+               np.array([region.size[index] for index in range(3)]))
+
+
+def apply_box(chunk, box):
+    """Sets chunk.region to box."""
+    region = chunk.region
+    region.center = PhotoScan.Vector(box.center.tolist())
+    region.size = PhotoScan.Vector(box.size.tolist())
+    region.rot = PhotoScan.Matrix(box.axes.tolist())
+    chunk.region = region
+
+
+def fit_region(chunk, trim=0.02, method=PERCENTILE, exclude_markers=True,
+               cut_marker_plane=False, padding=0.05):
+    """Fits the region of chunk to its valid tie points; returns the Box or None."""
+    cloud = sparse.sparse_cloud(chunk)
+    markers = marker_positions(chunk) if exclude_markers else None
+    box = fit_box(cloud.coords[cloud.valid], trim, method, markers,
+                  cut_marker_plane=cut_marker_plane, padding=padding)
+    if box is None:
+        LOG.info('%s: too few tie points to fit a region', chunk.label)
+        return None
+    before = region_box(chunk).volume()
+    apply_box(chunk, box)
+    LOG.info('%s: region volume %.4g -> %.4g', chunk.label, before, box.volume())
+    return box
@@ -0,0 +1,136 @@
+"""Scale bars between coded targets, from calibrated target sets in a config file.
+
+The config file is JSON mapping a target set name to its reference accuracy
+and bars, each [code, code, distance in metres]:
+
+    {"default": {"accuracy": 0.0001, "bars": [[1, 3, 0.125], [49, 50, 0.50024]]}}
+
+Markers are indexed by the number at the end of their label ("target 49")
+once per apply call. Bars are added only where both targets were detected and
+are labelled "49_50", so applying a set again updates them. After
+alignment, every bar's residual is computed at once against the chunk's
+robust scale, and bars far off are disabled before the cameras are
+optimized, so one misdetected target does not distort the optimization.
+"""
+import json
+import re
+
+import numpy as np
+
+CODE = re.compile(r'(\d+)\s*$')
+# A bar is an outlier when its residual exceeds this many robust standard deviations,
+# and at least this many times its reference accuracy.
+OUTLIER_SIGMA = 4.0
+OUTLIER_ACCURACY = 3.0
+
+
+def load_config(path):
+    """Target sets of a config file: {name: {'accuracy': a, 'bars': [(code, code, distance)]}}."""
+    with open(path, 'r') as handle:
+        config = json.load(handle)
+    return dict((name, {'accuracy': float(target_set['accuracy']),
+                        'bars': [(int(left), int(right), float(distance))
+                                 for left, right, distance in target_set['bars']]})
+                for name, target_set in config.items())
+
+
+def marker_index(chunk):
+    """{code: marker} of the chunk's coded markers."""
+    index = {}
+    for marker in chunk.markers:
+        match = CODE.search(marker.label)
+        if match:
+            index[int(match.group(1))] = marker
+    return index
+
+
+def bar_label(left, right):
+    return '%d_%d' % (left, right)
+
+
+def apply(chunk, target_set):
+    """Adds or updates the bars of target_set whose targets are both in chunk.
+
+    Returns the number of bars set.
+    """
+    index = marker_index(chunk)
+    existing = dict((scalebar.label, scalebar) for scalebar in chunk.scalebars)
+    applied = 0
+    for left, right, distance in target_set['bars']:
+        if left not in index or right not in index:
+            continue
+        label = bar_label(left, right)
+        scalebar = existing.get(label)
+        if scalebar is None:
+            scalebar = chunk.addScalebar(index[left], index[right])
+            scalebar.label = label
+        scalebar.reference.accuracy = target_set['accuracy']
+        scalebar.reference.distance = distance
+        scalebar.reference.enabled = True
+        applied += 1
+    return applied
+
+
+def apply_all(chunks, target_set):
+    """Applies target_set to every chunk; returns {chunk label: bars set}."""
+    return dict((chunk.label, apply(chunk, target_set)) for chunk in chunks)
+
+
+def measure(chunk):
+    """Bars with a reference distance and both ends placed.
+
+    Returns (scalebars, reference distances, accuracies, distances in chunk
+    coordinates) with the last three as arrays.
+    """
+    scalebars, ends = [], []
+    for scalebar in chunk.scalebars:
+        distance = scalebar.reference.distance
+        first, second = scalebar.point0, scalebar.point1
+        if (distance and getattr(first, 'position', None) is not None and
+                getattr(second, 'position', None) is not None):
+            scalebars.append(scalebar)
+            ends.append(list(first.position)[:3] + list(second.position)[:3])
+    if not scalebars:
+        empty = np.zeros(0)
+        return scalebars, empty, empty, empty
+    ends = np.array(ends, dtype=np.float64)
+    reference = np.array([scalebar.reference.distance for scalebar in scalebars])
+    accuracy = np.array([scalebar.reference.accuracy or 0.0 for scalebar in scalebars])
+    return scalebars, reference, accuracy, np.linalg.norm(ends[:, :3] - ends[:, 3:], axis=1)
+
+
+def residuals(reference, measured):
+    """Residuals in metres of measured distances scaled by their median ratio to reference."""
+    usable = measured > 0
+    if not usable.any():
+        return np.full(len(reference), np.nan)
+    scale = np.median(reference[usable] / measured[usable])
+    return np.where(usable, measured * scale - reference, np.nan)
+
+
+def outliers(residual, accuracy, sigma=OUTLIER_SIGMA, accuracy_factor=OUTLIER_ACCURACY):
+    """Mask of residuals beyond sigma robust deviations and accuracy_factor accuracies."""
+    finite = np.isfinite(residual)
+    if np.count_nonzero(finite) < 3:
+        return ~finite
+    centre = np.median(residual[finite])
+    spread = 1.4826 * np.median(np.abs(residual[finite] - centre))
+    limit = np.maximum(sigma * spread, accuracy_factor * accuracy)
+    return ~finite | (np.abs(residual - centre) > limit)
+
+
+def disable_outliers(chunk, sigma=OUTLIER_SIGMA, accuracy_factor=OUTLIER_ACCURACY):
+    """Disables the outlier bars of chunk; returns [(label, residual)] of those disabled."""
+    scalebars, reference, accuracy, measured = measure(chunk)
+    enabled = np.array([scalebar.reference.enabled for scalebar in scalebars], dtype=bool)
+    if not enabled.any():
+        return []
+    residual = np.full(len(scalebars), np.nan)
+    residual[enabled] = residuals(reference[enabled], measured[enabled])
+    mask = np.zeros(len(scalebars), dtype=bool)
+    mask[enabled] = outliers(residual[enabled], accuracy[enabled], sigma, accuracy_factor)
+    disabled = []
+    for position in np.flatnonzero(mask):
+        scalebars[position].reference.enabled = False
+        disabled.append((scalebars[position].label, float(residual[position])))
+    return disabled
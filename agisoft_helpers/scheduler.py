@@ -0,0 +1,110 @@
+"""Adaptive schedule for the 'select, delete, optimizeCameras' loops.
+
+Each step removes a batch of the worst points and runs a bundle adjustment.
+Batches are large while many points are above the target error and shrink as
+the cloud approaches it. The loop stops once the error reaches the target,
+when a step stops improving it, at a point-count floor, or when the iteration
+or time budget runs out.
+"""
+import logging
+import time
+
+import numpy as np
+
+from agisoft_helpers import selection
+from agisoft_helpers import sparse
+from agisoft_helpers import tracing
+
+LOG = logging.getLogger(__name__)
+
+# Fraction of points whose value is used to measure progress, as in the
+# original 'worst 10%' loops.
+MEASURE_FRACTION = 0.1
+
+
+class Schedule(object):
+    """Limits and batch sizes for one optimization loop."""
+
+    def __init__(self, max_fraction=0.2, min_fraction=0.02, aggressiveness=0.5,
+                 min_improvement=0.01, patience=2, min_points=0, min_point_fraction=0.2,
+                 max_iterations=30, time_budget=None):
+        self.max_fraction = max_fraction
+        self.min_fraction = min_fraction
+        self.aggressiveness = aggressiveness
+        self.min_improvement = min_improvement
+        self.patience = patience
+        self.min_points = min_points
+        self.min_point_fraction = min_point_fraction
+        self.max_iterations = max_iterations
+        self.time_budget = time_budget
+
+    def batch_fraction(self, values, target):
+        """Fraction of points to remove given current values and the target error."""
+        if values.size == 0:
+            return 0.0
+        over = np.count_nonzero(values > target) / float(values.size)
+        return min(self.max_fraction, max(self.min_fraction, over * self.aggressiveness))
+
+
+def measure(chunk, criterion):
+    """Error level used to decide convergence: the worst-10% threshold."""
+    values = sparse.sparse_cloud(chunk).valid_metric(criterion)
+    return selection.threshold_for_fraction(values, MEASURE_FRACTION)
+
+
+def run(chunk, criterion, target, optimize, schedule=None, select=None):
+    """Runs the loop on chunk until the measured error drops below target.
+
+    optimize(chunk) is called after every deletion. select, when given, is a
+    selection strategy called as select(chunk) that returns the threshold it
+    used (for example the elbow selection); otherwise the batch size comes
+    from the schedule. Returns the last measured error.
+    """
+    if schedule is None:
+        schedule = Schedule()
+    start = time.time()
+    floor = max(schedule.min_points,
+                int(sparse.point_count(chunk) * schedule.min_point_fraction))
+    current = measure(chunk, criterion)
+    stalled = 0
+    iteration = 0
+    while current >= target:
+        if iteration >= schedule.max_iterations:
+            LOG.info('stopping: iteration budget of %d reached', schedule.max_iterations)
+            break
+        if schedule.time_budget is not None and time.time() - start >= schedule.time_budget:
+            LOG.info('stopping: time budget of %.0fs reached', schedule.time_budget)
+            break
+        cloud = sparse.sparse_cloud(chunk)
+        count = cloud.valid_count()
+        if count <= floor:
+            LOG.info('stopping: point floor of %d reached', floor)
+            break
+        if select is not None:
+            thresh = select(chunk)
+            removed = sparse.selected_count(chunk)
+        else:
+            values = cloud.valid_metric(criterion)
+            fraction = schedule.batch_fraction(values, target)
+            fraction = min(fraction, (count - floor) / float(count))
+            thresh = selection.threshold_for_fraction(values, fraction)
+            removed = cloud.select(criterion, thresh)
+        if removed == 0:
+            LOG.info('stopping: nothing selected at threshold %.4f', thresh)
+            break
+        sparse.invalidate_selected_points(chunk)
+        optimize(chunk)
+        iteration += 1
+        tracing.count('iterations')
+        previous, current = current, measure(chunk, criterion)
+        LOG.info('step %d: threshold %.4f, removed %d of %d points, error %.4f, %.1fs elapsed',
+                 iteration, thresh, removed, count, current, time.time() - start)
+        if previous > 0 and (previous - current) / previous < schedule.min_improvement:
+            stalled += 1
+            if stalled >= schedule.patience:
+                LOG.info('stopping: improvement below %.1f%% for %d steps',
+                         schedule.min_improvement * 100, stalled)
+                break
+        else:
+            stalled = 0
+    return current
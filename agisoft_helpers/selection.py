@@ -0,0 +1,86 @@
+"""Gradual selection of sparse cloud points by target fraction.
+
+The per-point filter values are read once into a NumPy array (cached in the
+chunk's SparseCloud) and the exact threshold for the requested fraction is found
+with a partition, so each selection costs a single selectPoints call instead of
+a threshold search.
+"""
+import numpy as np
+
+from agisoft_helpers import sparse
+
+
+def threshold_for_fraction(values, fraction):
+    """Returns the threshold that leaves int(n * fraction) values above it.
+
+    The threshold is placed half way between the last selected and the first
+    kept value, so it gives the same count whether selectPoints compares with
+    '>' or '>='.
+    """
+    count = values.size
+    target = int(count * fraction)
+    if count == 0:
+        return 0.0
+    if target <= 0:
+        return float(values.max()) + 1.0
+    if target >= count:
+        return float(values.min()) - 1.0
+    kth = count - target
+    part = np.partition(values, (kth - 1, kth))
+    return float((part[kth - 1] + part[kth]) / 2.0)
+
+
+def select_fraction(chunk, criterion, fraction=0.1):
+    """Selects the worst fraction of points by criterion; returns the threshold used."""
+    cloud = sparse.sparse_cloud(chunk)
+    thresh = threshold_for_fraction(cloud.valid_metric(criterion), fraction)
+    cloud.select(criterion, thresh)
+    return thresh
+
+
+def select_threshold(chunk, criterion, thresh):
+    """Selects points above a fixed threshold."""
+    sparse.sparse_cloud(chunk).select(criterion, thresh)
+    return thresh
+
+
+def remaining_curve(values, upper_percentile=99.9):
+    """Returns (thresholds, remaining) for the 'points above threshold' curve.
+
+    Built from one sort of the values. Values above upper_percentile are left
+    off the curve so a handful of extreme outliers do not flatten it.
+    """
+    thresholds = np.sort(values)
+    remaining = np.arange(thresholds.size - 1, -1, -1, dtype=np.float64)
+    if upper_percentile is not None and thresholds.size:
+        cutoff = np.percentile(thresholds, upper_percentile)
+        keep = np.searchsorted(thresholds, cutoff, side='right')
+        thresholds = thresholds[:keep]
+        remaining = remaining[:keep]
+    return thresholds, remaining
+
+
+def elbow_threshold(values, upper_percentile=99.9):
+    """Returns the threshold at the knee of the remaining-points curve.
+
+    Both axes are normalised to [0, 1]; the knee is the curve point furthest
+    below the chord joining its end points.
+    """
+    thresholds, remaining = remaining_curve(values, upper_percentile)
+    if thresholds.size < 3:
+        return float(thresholds[-1]) if thresholds.size else 0.0
+    x_span = thresholds[-1] - thresholds[0]
+    y_span = remaining[0] - remaining[-1]
+    if x_span <= 0 or y_span <= 0:
+        return float(thresholds[-1])
+    x_norm = (thresholds - thresholds[0]) / x_span
+    y_norm = (remaining - remaining[-1]) / y_span
+    return float(thresholds[np.argmax(1.0 - x_norm - y_norm)])
+
+
+def select_elbow(chunk, criterion, upper_percentile=99.9):
+    """Selects points above the elbow of the criterion's curve; returns the threshold."""
+    cloud = sparse.sparse_cloud(chunk)
+    thresh = elbow_threshold(cloud.valid_metric(criterion), upper_percentile)
+    cloud.select(criterion, thresh)
+    return thresh
@@ -0,0 +1,168 @@
+"""Compact snapshots of the state changed by sparse-cloud optimization.
+
+A snapshot holds what the optimization loop changes and nothing else: camera
+poses, sensor calibrations, the chunk transform, tie-point coordinates, the
+tie-point validity mask and tiepoint_accuracy. It is written as a compressed
+.npz, so keeping the unoptimized state costs a few megabytes instead of a
+full chunk copy. Restoring all of these together gives back a cloud that is
+consistent with its cameras, as the copied chunk used to be.
+
+Snapshots are named after the chunk's label without its 'Auto: Aligned',
+'Unoptimized' or 'Optimized' prefix, and cameras are matched by photo path,
+because chunks processed by executor.run_per_chunk come back with new chunk
+and camera keys. Points rejected by the optimization loop are only marked
+invalid, so the alignment can be restored, and the project file does not
+shrink until they are removed.
+"""
+import logging
+import os
+import re
+
+import numpy as np
+import PhotoScan
+
+from agisoft_helpers import sparse
+
+LOG = logging.getLogger(__name__)
+
+SNAPSHOT_FOLDER = 'snapshots'
+CALIBRATION_FIELDS = ('f', 'cx', 'cy', 'b1', 'b2', 'k1', 'k2', 'k3', 'k4',
+                      'p1', 'p2', 'p3', 'p4')
+
+
+def chunk_name(chunk):
+    """Name of chunk that survives relabelling and reloading, e.g. 'Side_1'."""
+    label = re.sub(r"^Auto: (Aligned|Unoptimized|Optimized) ", '', chunk.label)
+    return re.sub(r"\W+", '_', label).strip('_')
+
+
+def snapshot_path(document_path, chunk, name):
+    """Path of a named snapshot of chunk, next to the project file."""
+    folder = os.path.join(os.path.dirname(document_path), SNAPSHOT_FOLDER)
+    return os.path.join(folder, chunk_name(chunk) + '_' + name + '.npz').replace('\\', '/')
+
+
+def _photo_path(camera):
+    return camera.photo.path.replace('\\', '/') if camera.photo is not None else camera.label
+
+
+def capture(chunk):
+    """Returns the optimization state of chunk as a dict of arrays."""
+    cameras = list(chunk.cameras)
+    transforms = np.full((len(cameras), 16), np.nan)
+    for index, camera in enumerate(cameras):
+        if camera.transform is not None:
+            transforms[index] = [camera.transform[row, column]
+                                 for row in range(4) for column in range(4)]
+    sensors = list(chunk.sensors)
+    calibrations = np.full((len(sensors), len(CALIBRATION_FIELDS)), np.nan)
+    for index, sensor in enumerate(sensors):
+        if sensor.calibration is not None:
+            calibrations[index] = [getattr(sensor.calibration, field, 0.0) or 0.0
+                                   for field in CALIBRATION_FIELDS]
+    chunk_transform = np.full(16, np.nan)
+    if chunk.transform.matrix is not None:
+        chunk_transform[:] = [chunk.transform.matrix[row, column]
+                              for row in range(4) for column in range(4)]
+    cloud = sparse.sparse_cloud(chunk)
+    valid = cloud.valid
+    return {'camera_paths': np.array([_photo_path(camera) for camera in cameras], dtype=np.str_),
+            'transforms': transforms,
+            'calibrations': calibrations,
+            'chunk_transform': chunk_transform,
+            'coords': cloud.coords,
+            'valid': np.packbits(valid),
+            'point_count': np.array(valid.size),
+            'tiepoint_accuracy': np.array(chunk.tiepoint_accuracy)}
+
+
+def save(chunk, path):
+    """Writes a snapshot of chunk to path."""
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path, 'wb') as handle:
+        np.savez_compressed(handle, **capture(chunk))
+    return path
+
+
+def load(path):
+    """Reads a snapshot into a dict of arrays."""
+    with np.load(path) as data:
+        return dict((name, data[name]) for name in data.files)
+
+
+def valid_mask(state):
+    """Unpacked tie-point validity mask of a snapshot."""
+    return np.unpackbits(state['valid'])[:int(state['point_count'])].astype(bool)
+
+
+def restore(chunk, state):
+    """Puts cameras, calibration, chunk transform, tie points and tiepoint_accuracy back."""
+    cameras = dict((_photo_path(camera), camera) for camera in chunk.cameras)
+    for path, transform in zip(state['camera_paths'].tolist(), state['transforms']):
+        camera = cameras.get(path)
+        if camera is None:
+            continue
+        if np.isnan(transform).any():
+            camera.transform = None
+        else:
+            camera.transform = PhotoScan.Matrix(transform.reshape(4, 4).tolist())
+    if len(chunk.sensors) != len(state['calibrations']):
+        LOG.warning('%s: %d sensors, snapshot has %d; calibration not restored', chunk.label,
+                    len(chunk.sensors), len(state['calibrations']))
+    for sensor, values in zip(chunk.sensors, state['calibrations']):
+        if np.isnan(values).any() or sensor.calibration is None:
+            continue
+        calibration = sensor.calibration
+        for field, value in zip(CALIBRATION_FIELDS, values):
+            setattr(calibration, field, float(value))
+        sensor.calibration = calibration
+    if 'chunk_transform' in state and not np.isnan(state['chunk_transform']).any():
+        chunk.transform.matrix = PhotoScan.Matrix(state['chunk_transform'].reshape(4, 4).tolist())
+    wanted = valid_mask(state)
+    cloud = sparse.sparse_cloud(chunk)
+    if wanted.size == cloud.count:
+        points = chunk.point_cloud.points
+        for index in np.nonzero(wanted != cloud.valid)[0]:
+            points[int(index)].valid = bool(wanted[index])
+        if 'coords' in state:
+            for index, coord in enumerate(state['coords'].tolist()):
+                points[index].coord = PhotoScan.Vector(coord + [1.0])
+        else:
+            LOG.warning('%s: snapshot has no tie point coordinates; run optimizeCameras',
+                        chunk.label)
+    else:
+        LOG.warning('%s: %d tie points, snapshot has %d; tie points not restored',
+                    chunk.label, cloud.count, wanted.size)
+    chunk.tiepoint_accuracy = float(state['tiepoint_accuracy'])
+    sparse.invalidate(chunk)
+
+
+def compare(first, second):
+    """Summarises the differences between two snapshots of the same chunk."""
+    first_cameras = dict(zip(first['camera_paths'].tolist(), first['transforms']))
+    shifts = []
+    for path, transform in zip(second['camera_paths'].tolist(), second['transforms']):
+        if path in first_cameras:
+            before = first_cameras[path].reshape(4, 4)
+            after = transform.reshape(4, 4)
+            shifts.append(np.linalg.norm(after[:3, 3] - before[:3, 3]))
+    shifts = np.array(shifts, dtype=np.float64)
+    first_valid = valid_mask(first)
+    second_valid = valid_mask(second)
+    calibration_change = {}
+    if first['calibrations'].shape == second['calibrations'].shape:
+        delta = np.abs(second['calibrations'] - first['calibrations'])
+        for index, field in enumerate(CALIBRATION_FIELDS):
+            calibration_change[field] = float(np.nanmax(delta[:, index])) if delta.size else 0.0
+    same_points = first_valid.size == second_valid.size
+    return {'max_camera_shift': float(np.nanmax(shifts)) if shifts.size else 0.0,
+            'mean_camera_shift': float(np.nanmean(shifts)) if shifts.size else 0.0,
+            'calibration_change': calibration_change,
+            'valid_before': int(np.count_nonzero(first_valid)),
+            'valid_after': int(np.count_nonzero(second_valid)),
+            'invalidated': (int(np.count_nonzero(first_valid & ~second_valid))
+                            if same_points else None),
+            'tiepoint_accuracy': (float(first['tiepoint_accuracy']),
+                                  float(second['tiepoint_accuracy']))}
@@ -0,0 +1,209 @@
+"""Columnar, cached view of a chunk's sparse point cloud.
+
+Reading chunk.point_cloud.points goes through one Python object per point, so
+each chunk's cloud is copied into NumPy arrays once and reused until something
+changes it. The point columns (coordinates, flags, track ids) are read in a
+single pass the first time any of them is needed; filter metrics are read per
+criterion from PointCloud.Filter.values. Use the wrappers at the bottom of this
+module instead of calling removeSelectedPoints, optimizeCameras or alignCameras
+directly so the cached view is kept in step with the cloud.
+
+Points dropped by the optimization loop are marked invalid rather than
+deleted, so the point list keeps its order and snapshots can restore them.
+Validity and track ids therefore survive optimizeCameras; coordinates and
+metrics are re-read after it.
+
+Chunk keys are only unique within a document, so views are cached per
+document path and chunk key, and invalidate() must be called after a
+document is opened or reloaded in place. master.py also calls it before
+every menu action, as the cloud may have been edited in the GUI since.
+"""
+import numpy as np
+import PhotoScan
+
+_CACHE = {}
+
+
+class SparseCloud(object):
+    """Array-backed snapshot of one chunk's sparse point cloud."""
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.count = len(chunk.point_cloud.points)
+        self._columns = {}
+        self._selected = None
+        self._filters = {}
+
+    def __len__(self):
+        return self.count
+
+    def _load_columns(self):
+        """Copies coordinates, flags and track ids in a single pass over the points."""
+        coords = np.empty((self.count, 3), dtype=np.float64)
+        selected = np.empty(self.count, dtype=bool)
+        valid = np.empty(self.count, dtype=bool)
+        track_ids = np.empty(self.count, dtype=np.int64)
+        for index, point in enumerate(self.chunk.point_cloud.points):
+            coord = point.coord
+            coords[index] = (coord[0], coord[1], coord[2])
+            selected[index] = point.selected
+            valid[index] = point.valid
+            track_ids[index] = point.track_id
+        self._columns = {'coords': coords, 'valid': valid, 'track_ids': track_ids}
+        self._selected = selected
+
+    def _column(self, name):
+        if name not in self._columns:
+            self._load_columns()
+        return self._columns[name]
+
+    @property
+    def coords(self):
+        """Point coordinates in chunk space, shape (n, 3)."""
+        return self._column('coords')
+
+    @property
+    def selected(self):
+        """Selection flags as last read or as set through select()."""
+        if self._selected is None:
+            self._load_columns()
+        return self._selected
+
+    @property
+    def valid(self):
+        """Validity flags."""
+        return self._column('valid')
+
+    @property
+    def track_ids(self):
+        """Track id of every point."""
+        return self._column('track_ids')
+
+    def valid_count(self):
+        """Number of valid points."""
+        return int(np.count_nonzero(self.valid))
+
+    def loaded_valid_count(self):
+        """Number of valid points if the columns are loaded, else None."""
+        if 'valid' not in self._columns:
+            return None
+        return self.valid_count()
+
+    def point_filter(self, criterion):
+        """Returns the initialised filter and its values for a criterion."""
+        if criterion not in self._filters:
+            point_cloud_filter = PhotoScan.PointCloud.Filter()
+            point_cloud_filter.init(self.chunk, criterion)
+            values = np.asarray(point_cloud_filter.values, dtype=np.float64)
+            self._filters[criterion] = (point_cloud_filter, values)
+        return self._filters[criterion]
+
+    def metric(self, criterion):
+        """Per-point values of a filter criterion."""
+        return self.point_filter(criterion)[1]
+
+    def valid_metric(self, criterion):
+        """Values of a filter criterion for valid points only."""
+        return self.metric(criterion)[self.valid]
+
+    def select(self, criterion, thresh):
+        """Selects valid points whose criterion value is above thresh; returns the count.
+
+        Filter values of invalid points are not cleared, so selectPoints can
+        select them too; those are unselected again.
+        """
+        point_cloud_filter, values = self.point_filter(criterion)
+        point_cloud_filter.selectPoints(thresh)
+        above = values > thresh
+        points = self.chunk.point_cloud.points
+        for index in np.nonzero(above & ~self.valid)[0]:
+            points[int(index)].selected = False
+        self._selected = above & self.valid
+        return int(np.count_nonzero(self._selected))
+
+    def selected_count(self):
+        """Number of selected points."""
+        return int(np.count_nonzero(self.selected))
+
+    def invalidate_mask(self, mask):
+        """Marks the points in mask invalid and unselects them; returns the count."""
+        points = self.chunk.point_cloud.points
+        indices = np.nonzero(mask)[0]
+        for index in indices:
+            point = points[int(index)]
+            point.valid = False
+            point.selected = False
+        self._columns['valid'] = self.valid & ~mask
+        self._selected = self.selected & ~mask
+        return len(indices)
+
+    def invalidate_selected(self):
+        """Marks selected points invalid and clears the selection; returns the count."""
+        return self.invalidate_mask(self.selected.copy())
+
+    def cameras_changed(self):
+        """Drops columns and metrics that depend on camera parameters."""
+        self._columns.pop('coords', None)
+        self._filters = {}
+
+
+def _key(chunk):
+    return (PhotoScan.app.document.path, chunk.key)
+
+
+def sparse_cloud(chunk):
+    """Returns the cached SparseCloud for chunk, building it if needed."""
+    cloud = _CACHE.get(_key(chunk))
+    if cloud is None or cloud.count != len(chunk.point_cloud.points):
+        cloud = SparseCloud(chunk)
+        _CACHE[_key(chunk)] = cloud
+    return cloud
+
+
+def invalidate(chunk=None):
+    """Drops the cached view of chunk, or of every chunk when none is given."""
+    if chunk is None:
+        _CACHE.clear()
+    else:
+        _CACHE.pop(_key(chunk), None)
+
+
+def point_count(chunk):
+    """Number of valid points in the chunk's sparse cloud."""
+    return sparse_cloud(chunk).valid_count()
+
+
+def known_point_count(chunk):
+    """Valid point count from the cached view, or None when it is not loaded; never reads points."""
+    cloud = _CACHE.get(_key(chunk))
+    return None if cloud is None else cloud.loaded_valid_count()
+
+
+def selected_count(chunk):
+    """Number of currently selected points in the chunk's sparse cloud."""
+    return sparse_cloud(chunk).selected_count()
+
+
+def invalidate_selected_points(chunk):
+    """Marks selected points invalid, keeping them in the cloud; returns the count."""
+    return sparse_cloud(chunk).invalidate_selected()
+
+
+def remove_selected_points(chunk):
+    """Deletes selected points from the cloud and drops the cached view."""
+    chunk.point_cloud.removeSelectedPoints()
+    invalidate(chunk)
+
+
+def optimize_cameras(chunk, *args, **kwargs):
+    """Runs optimizeCameras and refreshes the camera-dependent parts of the cached view."""
+    chunk.optimizeCameras(*args, **kwargs)
+    cloud = _CACHE.get(_key(chunk))
+    if cloud is not None:
+        cloud.cameras_changed()
+
+
+def align_cameras(chunk, *args, **kwargs):
+    """Runs alignCameras and drops the cached view."""
+    chunk.alignCameras(*args, **kwargs)
+    invalidate(chunk)
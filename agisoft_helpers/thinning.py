@@ -0,0 +1,94 @@
+"""Spatially uniform thinning of the sparse cloud.
+
+Bundle adjustment cost grows with the number of tie points, but dense
+clusters on well textured areas add little to the solution. The cloud is
+hashed into a voxel grid and only the best points of each occupied cell are
+kept, so every area the cameras see stays covered. Points are ranked by
+reprojection error divided by track length (the number of images a point is
+seen in). Dropped points are marked invalid, like the optimization loop does.
+"""
+import logging
+
+import numpy as np
+import PhotoScan
+
+from agisoft_helpers import sparse
+from agisoft_helpers import tracing
+
+LOG = logging.getLogger(__name__)
+
+
+def voxel_ids(coords, resolution):
+    """Cell index of every point in a grid of resolution cells along the longest axis.
+
+    The grid spans the 1-99% range of each axis; points outside it fall in
+    the border cells, so a few far outliers do not make the cells huge.
+    """
+    low = np.percentile(coords, 1.0, axis=0)
+    high = np.percentile(coords, 99.0, axis=0)
+    cell = max(float((high - low).max()) / resolution, 1e-12)
+    cells = np.floor((np.clip(coords, low, high) - low) / cell).astype(np.int64)
+    shape = cells.max(axis=0) + 1
+    return np.ravel_multi_index(cells.T, shape)
+
+
+def best_per_cell(ids, scores, per_cell):
+    """Mask of the per_cell lowest-scoring points of every cell."""
+    order = np.lexsort((scores, ids))
+    sorted_ids = ids[order]
+    starts = np.r_[0, np.nonzero(np.diff(sorted_ids))[0] + 1]
+    ranks = np.arange(len(ids)) - np.repeat(starts, np.diff(np.r_[starts, len(ids)]))
+    keep = np.zeros(len(ids), dtype=bool)
+    keep[order[ranks < per_cell]] = True
+    return keep
+
+
+def kept_count(ids, per_cell):
+    """Number of points best_per_cell would keep."""
+    return int(np.minimum(np.unique(ids, return_counts=True)[1], per_cell).sum())
+
+
+def thin_mask(coords, scores, budget, per_cell=1):
+    """Mask keeping at most budget points, spread over the finest grid that fits the budget.
+
+    The grid resolution is found by bisection on the number of cells the
+    cloud occupies.
+    """
+    count = len(coords)
+    if count <= budget:
+        return np.ones(count, dtype=bool)
+    low, high = 1, 2
+    while kept_count(voxel_ids(coords, high), per_cell) <= budget:
+        tracing.count('grid_searches')
+        low, high = high, high * 2
+        if high > 1 << 16:
+            return np.ones(count, dtype=bool)
+    while high - low > 1:
+        middle = (low + high) // 2
+        tracing.count('grid_searches')
+        if kept_count(voxel_ids(coords, middle), per_cell) <= budget:
+            low = middle
+        else:
+            high = middle
+    return best_per_cell(voxel_ids(coords, low), scores, per_cell)
+
+
+def point_scores(cloud):
+    """Reprojection error over track length for every point; lower is better."""
+    errors = cloud.metric(PhotoScan.PointCloud.Filter.ReprojectionError)
+    tracks = cloud.metric(PhotoScan.PointCloud.Filter.ImageCount)
+    return errors / np.maximum(tracks, 1.0)
+
+
+def thin_chunk(chunk, budget, per_cell=1):
+    """Thins the valid tie points of chunk down to budget; returns the number dropped."""
+    cloud = sparse.sparse_cloud(chunk)
+    valid = np.nonzero(cloud.valid)[0]
+    if budget <= 0 or len(valid) <= budget:
+        return 0
+    keep = thin_mask(cloud.coords[valid], point_scores(cloud)[valid], budget, per_cell)
+    dropped = np.zeros(cloud.count, dtype=bool)
+    dropped[valid[~keep]] = True
+    removed = cloud.invalidate_mask(dropped)
+    LOG.info('%s: thinned %d of %d tie points', chunk.label, removed, len(valid))
+    return removed
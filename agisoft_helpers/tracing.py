@@ -0,0 +1,267 @@
+"""Instrumentation of pipeline actions with a JSONL trace per project.
+
+instrument_namespace wraps the functions of a module namespace (master.py
+wraps its own, so menu actions and the calls between them are traced) and
+instrument_module wraps chosen helper functions. Every call appends one
+record to the trace of the open project with wall and CPU time, nesting,
+peak RSS, counters such as loop iterations, and the chunk's point count
+before and after when it is known. One action can be run under cProfile.
+Threads working on different projects, like the driver's, send their records
+to their own project's trace with trace_to().
+Run this module with trace files or folders to print a summary:
+
+    python -m agisoft_helpers.tracing D:/scans
+"""
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+TRACE_NAME = 'trace.jsonl'
+PROFILE_FOLDER = 'profiles'
+
+_STATE = threading.local()
+_SETTINGS = {'trace_path': None, 'profile_action': '', 'points': None}
+
+
+def configure(trace_path=None, profile_action='', points=None):
+    """Sets where records go and what is measured.
+
+    trace_path() returns the trace file for the open project or None to skip
+    writing; points(args, kwargs) returns a point count or None.
+    """
+    _SETTINGS.update({'trace_path': trace_path, 'profile_action': profile_action,
+                      'points': points})
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where unknown."""
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_rss_mb()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def _windows_peak_rss_mb():
+    try:
+        import ctypes
+        from ctypes import wintypes
+    except ImportError:
+        return None
+
+    class Counters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t),
+                    ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+    try:
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters),
+                                                        counters.cb):
+            return None
+    except (AttributeError, OSError):
+        return None
+    return counters.PeakWorkingSetSize / (1024.0 * 1024.0)
+
+
+def _stack():
+    if not hasattr(_STATE, 'stack'):
+        _STATE.stack = []
+        _STATE.busy = False
+    return _STATE.stack
+
+
+def count(name, value=1):
+    """Adds value to a counter of the innermost traced call."""
+    stack = _stack()
+    if stack:
+        counts = stack[-1]['counts']
+        counts[name] = counts.get(name, 0) + value
+
+
+def _measure(function, args, kwargs):
+    """Calls a settings hook with tracing switched off for its own calls."""
+    _STATE.busy = True
+    try:
+        return function(*args, **kwargs)
+    except Exception:
+        return None
+    finally:
+        _STATE.busy = False
+
+
+@contextlib.contextmanager
+def trace_to(path):
+    """Sends the records of this thread to path instead of trace_path() inside the block."""
+    previous = getattr(_STATE, 'trace_file', None)
+    _STATE.trace_file = path
+    try:
+        yield
+    finally:
+        _STATE.trace_file = previous
+
+
+def _trace_file():
+    path = getattr(_STATE, 'trace_file', None)
+    if path is None and _SETTINGS['trace_path'] is not None:
+        path = _measure(_SETTINGS['trace_path'], (), {})
+    return path
+
+
+def _write(record):
+    path = _trace_file()
+    if not path:
+        return
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(path, 'a') as handle:
+        handle.write(json.dumps(record, default=str) + '\n')
+
+
+def _profile_path():
+    path = _trace_file()
+    folder = os.path.join(os.path.dirname(path) if path else '.', PROFILE_FOLDER)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+
+def traced(function, name=None):
+    """Wraps function so every call is recorded."""
+    if getattr(function, '__traced__', False):
+        return function
+    name = name or function.__module__ + '.' + function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        stack = _stack()
+        if _STATE.busy:
+            return function(*args, **kwargs)
+        points = _SETTINGS['points']
+        record = {'action': name, 'depth': len(stack),
+                  'parent': stack[-1]['action'] if stack else None,
+                  'start': time.time(), 'counts': {},
+                  'points_before': _measure(points, (args, kwargs), {}) if points else None}
+        stack.append(record)
+        wall, cpu = time.time(), time.process_time()
+        profiler = None
+        if _SETTINGS['profile_action'] in (name, function.__name__):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            result = function(*args, **kwargs)
+            record['status'] = 'ok'
+            return result
+        except BaseException as error:
+            record['status'] = 'error'
+            record['error'] = repr(error)
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                record['profile'] = os.path.join(
+                    _profile_path(), '%s_%d.prof' % (function.__name__, int(record['start'])))
+                profiler.dump_stats(record['profile'])
+            record['wall'] = time.time() - wall
+            record['cpu'] = time.process_time() - cpu
+            record['points_after'] = _measure(points, (args, kwargs), {}) if points else None
+            record['peak_rss_mb'] = peak_rss_mb()
+            stack.pop()
+            _write(record)
+
+    wrapper.__traced__ = True
+    return wrapper
+
+
+def instrument_namespace(namespace, module_name, exclude=()):
+    """Wraps, in place, the functions of namespace defined in module_name."""
+    for key, value in list(namespace.items()):
+        if (callable(value) and getattr(value, '__module__', None) == module_name and
+                key not in exclude and not isinstance(value, type)):
+            namespace[key] = traced(value, module_name + '.' + key)
+
+
+def instrument_module(module, names):
+    """Wraps the named functions of module in place."""
+    for key in names:
+        setattr(module, key, traced(getattr(module, key), module.__name__ + '.' + key))
+
+
+def read(paths):
+    """Records of the trace files in paths, each tagged with its project folder."""
+    records = []
+    for path in paths:
+        with open(path, 'r') as handle:
+            for line in handle:
+                if line.strip():
+                    record = json.loads(line)
+                    record['project'] = os.path.dirname(os.path.dirname(path))
+                    records.append(record)
+    return records
+
+
+def find_traces(paths):
+    """Trace files given directly or found below the given folders."""
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append(path)
+            continue
+        for folder, _, files in os.walk(path):
+            if TRACE_NAME in files:
+                found.append(os.path.join(folder, TRACE_NAME))
+    return sorted(found)
+
+
+def summarize(records):
+    """Per-action totals across records: calls, projects, wall, CPU, points removed, peak RSS."""
+    actions = {}
+    for record in records:
+        entry = actions.setdefault(record['action'], {
+            'calls': 0, 'errors': 0, 'projects': set(), 'wall': 0.0, 'cpu': 0.0,
+            'max_wall': 0.0, 'points_removed': 0, 'peak_rss_mb': 0.0, 'counts': {}})
+        entry['calls'] += 1
+        entry['errors'] += record.get('status') == 'error'
+        entry['projects'].add(record.get('project'))
+        entry['wall'] += record.get('wall', 0.0)
+        entry['cpu'] += record.get('cpu', 0.0)
+        entry['max_wall'] = max(entry['max_wall'], record.get('wall', 0.0))
+        if record.get('points_before') is not None and record.get('points_after') is not None:
+            entry['points_removed'] += record['points_before'] - record['points_after']
+        entry['peak_rss_mb'] = max(entry['peak_rss_mb'], record.get('peak_rss_mb') or 0.0)
+        for key, value in record.get('counts', {}).items():
+            entry['counts'][key] = entry['counts'].get(key, 0) + value
+    for entry in actions.values():
+        entry['projects'] = len(entry['projects'])
+    return actions
+
+
+def report(actions):
+    """Text table of summarize() output, slowest total first."""
+    lines = ['%-55s %6s %5s %10s %10s %10s %10s %8s' % (
+        'action', 'calls', 'proj', 'wall s', 'cpu s', 'max s', 'removed', 'rss MB')]
+    for name, entry in sorted(actions.items(), key=lambda item: -item[1]['wall']):
+        line = '%-55s %6d %5d %10.1f %10.1f %10.1f %10d %8.0f' % (
+            name[-55:], entry['calls'], entry['projects'], entry['wall'], entry['cpu'],
+            entry['max_wall'], entry['points_removed'], entry['peak_rss_mb'])
+        if entry['counts']:
+            line += '  ' + ' '.join('%s=%d' % item for item in sorted(entry['counts'].items()))
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(report(summarize(read(find_traces(sys.argv[1:] or ['.'])))))
@@ -0,0 +1,436 @@
+"""Synthetic stand-in for the PhotoScan 1.4 Python module, for benchmarks.
+
+Only what master.py and agisoft_helpers use is provided. Sparse clouds are
+held in NumPy arrays and make_chunk fills them with synthetic tie points:
+reprojection errors are a Rayleigh inlier population with a heavy-tailed
+outlier population, track lengths are 2 plus a geometric count, and
+reconstruction uncertainty is log-normal, growing for short tracks.
+optimizeCameras shrinks the errors of the remaining points a little, more
+so when outliers have been removed, so the optimization loops converge the
+way they do on real scans. Processing methods that build products do
+nothing. Filter values cover invalid points too and selectPoints selects by
+value alone, so helpers cannot rely on invalid points being left out.
+"""
+import copy as _copy
+import itertools
+
+import numpy as np
+
+from localserver import LocalNetworkClient as NetworkClient
+
+# Accuracy and quality values are the downscale levels, as in PhotoScan.
+HighestAccuracy, HighAccuracy, MediumAccuracy, LowAccuracy, LowestAccuracy = 0, 1, 2, 4, 8
+UltraQuality, HighQuality, MediumQuality, LowQuality, LowestQuality = 1, 2, 4, 8, 16
+Arbitrary, HeightField = range(2)
+DisabledInterpolation, EnabledInterpolation, Extrapolated = range(3)
+GenericMapping, OrthophotoMapping = range(2)
+MosaicBlending, AverageBlending = range(2)
+ImageFormatPNG, ImageFormatJPEG = range(2)
+ModelFormatOBJ, ModelFormatPLY = range(2)
+PointsFormatOBJ, PointsFormatPLY = range(2)
+TiePointsData, DenseCloudData = range(2)
+
+_KEYS = itertools.count(1)
+
+
+class TargetType(object):
+    CircularTarget12bit = 1
+
+
+class MaskSource(object):
+    MaskSourceAlpha, MaskSourceFile, MaskSourceBackground, MaskSourceModel = range(4)
+
+
+class MaskOperation(object):
+    MaskOperationReplacement = 0
+
+
+class Vector(list):
+    """3- or 4-component vector."""
+
+    @property
+    def x(self):
+        return self[0]
+
+    @property
+    def y(self):
+        return self[1]
+
+    @property
+    def z(self):
+        return self[2]
+
+    @property
+    def size(self):
+        return len(self)
+
+    @size.setter
+    def size(self, value):
+        del self[value:]
+
+
+class Matrix(object):
+    """Square matrix indexed as m[row, column]."""
+
+    def __init__(self, rows=None):
+        self.rows = np.array(rows if rows is not None else np.eye(4), dtype=np.float64)
+
+    def __getitem__(self, index):
+        return float(self.rows[index])
+
+    def __mul__(self, other):
+        if isinstance(other, Matrix):
+            return Matrix(self.rows.dot(other.rows))
+        if isinstance(other, (int, float)):
+            return Matrix(self.rows * other)
+        return Vector(self.rows.dot(np.asarray(other, dtype=np.float64)).tolist())
+
+    def t(self):
+        return Matrix(self.rows.T)
+
+    @staticmethod
+    def diag(values):
+        return Matrix(np.diag(values))
+
+
+class Region(object):
+    def __init__(self):
+        self.center = Vector([0.0, 0.0, 0.0])
+        self.size = Vector([10.0, 10.0, 10.0])
+        self.rot = Matrix(np.eye(3))
+
+
+class Transform(object):
+    def __init__(self):
+        self.matrix = Matrix()
+
+
+class Point(object):
+    """View of one tie point in the cloud's arrays."""
+
+    __slots__ = ('_cloud', '_index')
+
+    def __init__(self, cloud, index):
+        self._cloud = cloud
+        self._index = index
+
+    @property
+    def coord(self):
+        return Vector(self._cloud.coords[self._index].tolist() + [1.0])
+
+    @coord.setter
+    def coord(self, value):
+        self._cloud.coords[self._index] = list(value)[:3]
+
+    @property
+    def track_id(self):
+        return int(self._cloud.track_ids[self._index])
+
+    @property
+    def selected(self):
+        return bool(self._cloud.selected[self._index])
+
+    @selected.setter
+    def selected(self, value):
+        self._cloud.selected[self._index] = value
+
+    @property
+    def valid(self):
+        return bool(self._cloud.valid[self._index])
+
+    @valid.setter
+    def valid(self, value):
+        self._cloud.valid[self._index] = value
+
+
+class Points(object):
+    """Sequence of Point views."""
+
+    def __init__(self, cloud):
+        self._cloud = cloud
+
+    def __len__(self):
+        return len(self._cloud.errors)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return Point(self._cloud, index)
+
+    def __iter__(self):
+        cloud = self._cloud
+        return (Point(cloud, index) for index in range(len(cloud.errors)))
+
+
+class PointCloud(object):
+    """Sparse cloud backed by per-point arrays."""
+
+    class Filter(object):
+        ReprojectionError, ReconstructionUncertainty, ImageCount, ProjectionAccuracy = range(4)
+
+        def __init__(self):
+            self.values = []
+            self._cloud = None
+
+        def init(self, chunk, criterion):
+            cloud = chunk.point_cloud
+            self._cloud = cloud
+            self.values = {0: cloud.errors, 1: cloud.uncertainty,
+                           2: cloud.tracks.astype(np.float64),
+                           3: cloud.accuracy}[criterion].copy()
+
+        def selectPoints(self, threshold):
+            self._cloud.selected[:] = self.values > threshold
+
+    def __init__(self, count=0, seed=0):
+        random = np.random.RandomState(seed)
+        inliers = random.rand(count) >= 0.08
+        self.errors = np.where(inliers, random.rayleigh(0.25, count),
+                               random.lognormal(0.3, 0.8, count))
+        self.tracks = 2 + random.geometric(0.35, count)
+        self.uncertainty = random.lognormal(1.5, 0.9, count) * 6.0 / self.tracks
+        self.accuracy = random.lognormal(0.0, 0.3, count)
+        self.coords = random.standard_normal((count, 3)) * (0.3, 0.3, 0.5)
+        self.track_ids = np.arange(count, dtype=np.int64)
+        self.selected = np.zeros(count, dtype=bool)
+        self.valid = np.ones(count, dtype=bool)
+        self.points = Points(self)
+
+    def removeSelectedPoints(self):
+        keep = ~self.selected
+        for name in ('errors', 'tracks', 'uncertainty', 'accuracy', 'coords', 'track_ids',
+                     'valid'):
+            setattr(self, name, getattr(self, name)[keep])
+        self.selected = np.zeros(len(self.errors), dtype=bool)
+
+
+class Reference(object):
+    def __init__(self):
+        self.distance = None
+        self.accuracy = None
+        self.location = None
+        self.enabled = True
+
+
+class Marker(object):
+    def __init__(self, label, position=None):
+        self.key = next(_KEYS)
+        self.label = label
+        self.position = position
+        self.reference = Reference()
+
+
+class Scalebar(object):
+    def __init__(self, point0, point1):
+        self.key = next(_KEYS)
+        self.point0 = point0
+        self.point1 = point1
+        self.label = ''
+        self.reference = Reference()
+
+
+class Calibration(object):
+    def __init__(self):
+        self.f = 5000.0
+        self.cx = self.cy = 0.0
+        self.b1 = self.b2 = 0.0
+        self.k1 = self.k2 = self.k3 = self.k4 = 0.0
+        self.p1 = self.p2 = self.p3 = self.p4 = 0.0
+
+
+class Sensor(object):
+    def __init__(self):
+        self.key = next(_KEYS)
+        self.label = ''
+        self.calibration = Calibration()
+
+
+class Photo(object):
+    def __init__(self, path):
+        self.path = path
+
+
+class Camera(object):
+    def __init__(self, path, sensor):
+        self.key = next(_KEYS)
+        self.label = path.split('/')[-1]
+        self.photo = Photo(path)
+        self.sensor = sensor
+        self.enabled = True
+        self.transform = Matrix()
+
+
+class Chunk(object):
+    def __init__(self, label='Chunk'):
+        self.key = next(_KEYS)
+        self.label = label
+        self.enabled = True
+        self.cameras = []
+        self.sensors = []
+        self.markers = []
+        self.scalebars = []
+        self.point_cloud = PointCloud()
+        self.dense_cloud = None
+        self.model = None
+        self.region = Region()
+        self.transform = Transform()
+        self.crs = None
+        self.tiepoint_accuracy = 1.0
+
+    def addPhotos(self, paths):
+        if not self.sensors:
+            self.addSensor()
+        for path in paths:
+            self.cameras.append(Camera(path, self.sensors[0]))
+
+    def addSensor(self):
+        sensor = Sensor()
+        self.sensors.append(sensor)
+        return sensor
+
+    def addMarker(self, position=None):
+        marker = Marker('point ' + str(len(self.markers) + 1), position)
+        self.markers.append(marker)
+        return marker
+
+    def addScalebar(self, point0, point1):
+        scalebar = Scalebar(point0, point1)
+        self.scalebars.append(scalebar)
+        return scalebar
+
+    def remove(self, items):
+        for item in list(items):
+            for collection in (self.cameras, self.sensors, self.markers, self.scalebars):
+                if item in collection:
+                    collection.remove(item)
+
+    def copy(self):
+        duplicate = _copy.deepcopy(self)
+        duplicate.key = next(_KEYS)
+        return duplicate
+
+    def optimizeCameras(self, *args, **kwargs):
+        cloud = self.point_cloud
+        valid = cloud.valid
+        if valid.any():
+            outliers = np.count_nonzero(cloud.errors[valid] > 1.0) / float(np.count_nonzero(valid))
+            cloud.errors[valid] *= 0.97 - 0.2 * (0.08 - min(outliers, 0.08))
+
+    def matchPhotos(self, *args, **kwargs):
+        pass
+
+    def alignCameras(self, *args, **kwargs):
+        pass
+
+    def detectMarkers(self, *args, **kwargs):
+        pass
+
+    def buildDenseCloud(self, *args, **kwargs):
+        pass
+
+    def buildModel(self, *args, **kwargs):
+        pass
+
+    def buildUV(self, *args, **kwargs):
+        pass
+
+    def buildTexture(self, *args, **kwargs):
+        pass
+
+    def importMasks(self, *args, **kwargs):
+        pass
+
+    def exportModel(self, *args, **kwargs):
+        pass
+
+    def exportPoints(self, *args, **kwargs):
+        pass
+
+    def importModel(self, *args, **kwargs):
+        pass
+
+    def importPoints(self, *args, **kwargs):
+        pass
+
+
+class Document(object):
+    def __init__(self):
+        self.chunks = []
+        self.chunk = None
+        self.path = ''
+
+    def addChunk(self):
+        chunk = Chunk()
+        self.chunks.append(chunk)
+        self.chunk = chunk
+        return chunk
+
+    def remove(self, items):
+        for item in list(items if isinstance(items, (list, tuple)) else [items]):
+            if item in self.chunks:
+                self.chunks.remove(item)
+
+    def save(self, path=None):
+        if path is not None:
+            self.path = path
+
+    def open(self, path):
+        self.path = path
+
+    def append(self, document):
+        self.chunks.extend(document.chunks)
+
+    def mergeChunks(self, keys, **kwargs):
+        merged = Chunk('Merged Chunk')
+        self.chunks.append(merged)
+        return merged
+
+    def alignChunks(self, *args, **kwargs):
+        pass
+
+
+class NetworkTask(object):
+    def __init__(self):
+        self.name = ''
+        self.frames = []
+        self.params = {}
+
+
+class Viewpoint(object):
+    def __init__(self):
+        self.coo = None
+        self.rot = None
+        self.mag = None
+
+
+class Application(object):
+    def __init__(self):
+        self.document = Document()
+        self.viewpoint = Viewpoint()
+        self.menu_items = {}
+
+    def addMenuItem(self, label, function):
+        self.menu_items[label] = function
+
+    def getExistingDirectory(self, prompt=''):
+        return ''
+
+    def quit(self):
+        pass
+
+
+app = Application()
+
+
+def make_chunk(points, label='Auto: Optimized Side 1', seed=0, markers=64, cameras=200):
+    """Chunk with a synthetic sparse cloud, coded targets 1..markers and cameras."""
+    chunk = Chunk(label)
+    chunk.point_cloud = PointCloud(points, seed)
+    random = np.random.RandomState(seed + 1)
+    for number in range(1, markers + 1):
+        chunk.markers.append(Marker('target ' + str(number),
+                                    Vector(random.uniform(-0.5, 0.5, 3).tolist())))
+    chunk.addPhotos(['IMAGES/SIDEA/%04d.jpg' % index for index in range(cameras)])
+    return chunk
@@ -0,0 +1,90 @@
+"""In-process stand-in for PhotoScan.NetworkClient and its server.
+
+LocalNetworkClient records the batches it is given and lets tests or dry runs
+drive their status without a processing server. Pass the class as the client
+factory to the network helpers. With auto_advance set, every status request
+moves a running batch on by one task, so monitors see batches progress.
+"""
+import itertools
+
+
+class LocalNetworkServer(object):
+    """Holds batches submitted by any LocalNetworkClient that shares it."""
+
+    def __init__(self, nodes=('node-1',), auto_advance=False):
+        self.batches = {}
+        self.connections = 0
+        self.nodes = list(nodes)
+        self.auto_advance = auto_advance
+        self._ids = itertools.count(1)
+
+    def create(self, path, tasks):
+        batch_id = next(self._ids)
+        self.batches[batch_id] = {'path': path, 'tasks': list(tasks), 'status': 'paused',
+                                  'task_status': ['pending'] * len(tasks), 'current': 0}
+        return batch_id
+
+    def advance(self, batch_id):
+        """Finishes the running task of a batch and starts the next one."""
+        batch = self.batches[batch_id]
+        if batch['status'] != 'running':
+            return
+        current = batch['current']
+        if current < len(batch['tasks']) and batch['task_status'][current] == 'running':
+            batch['task_status'][current] = 'completed'
+            current += 1
+            batch['current'] = current
+        if current >= len(batch['tasks']):
+            batch['status'] = 'completed'
+        else:
+            batch['task_status'][current] = 'running'
+
+    def status(self, batch_id):
+        """Returns a batchStatus-style dict for a batch."""
+        batch = self.batches[batch_id]
+        tasks = []
+        for index, task in enumerate(batch['tasks']):
+            entry = {'name': getattr(task, 'name', str(task)),
+                     'status': batch['task_status'][index]}
+            if entry['status'] != 'pending':
+                entry['nodes'] = [self.nodes[index % len(self.nodes)]]
+            tasks.append(entry)
+        return {'batch_id': batch_id, 'status': batch['status'], 'tasks': tasks}
+
+
+DEFAULT_SERVER = LocalNetworkServer()
+
+
+class LocalNetworkClient(object):
+    """Subset of the PhotoScan.NetworkClient API backed by a LocalNetworkServer."""
+
+    def __init__(self, server=None):
+        self.server = server if server is not None else DEFAULT_SERVER
+        self.host = None
+
+    def connect(self, host, port=5840):
+        self.host = host
+        self.server.connections += 1
+
+    def createBatch(self, path, tasks):
+        if self.host is None:
+            raise RuntimeError('not connected')
+        return self.server.create(path, tasks)
+
+    def resumeBatch(self, batch_id):
+        self.server.batches[batch_id]['status'] = 'running'
+
+    def batchStatus(self, batch_id):
+        if self.server.auto_advance:
+            self.server.advance(batch_id)
+        return self.server.status(batch_id)
+
+    def pauseBatch(self, batch_id):
+        self.server.batches[batch_id]['status'] = 'paused'
+
+    def abortBatch(self, batch_id):
+        self.server.batches[batch_id]['status'] = 'aborted'
+
+    def batchList(self):
+        return {'batches': [{'batch_id': batch_id, 'path': batch['path'], 'status': batch['status']}
+                            for batch_id, batch in sorted(self.server.batches.items())]}
@@ -0,0 +1,155 @@
+"""Times master.py's selection, optimization, scale-bar and network functions.
+
+Runs against the synthetic PhotoScan module in this folder on sparse clouds
+of several sizes. Each benchmark gets a fresh chunk per repeat and the best
+time is kept. Results are written to results/<label>.json and compared with
+the most recent earlier result, so a slowdown between versions shows up:
+
+    python benchmarks/run_benchmarks.py --label 1.2 --sizes 100000 1000000
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import numpy as np
+import PhotoScan
+import master
+from agisoft_helpers import network
+from agisoft_helpers import sparse
+
+RESULTS_FOLDER = os.path.join(HERE, 'results')
+DEFAULT_SIZES = (100000, 1000000, 10000000)
+# A benchmark is reported as a regression when it is this much slower, by at least
+# REGRESSION_SECONDS so timer noise on very short runs is not reported.
+REGRESSION_RATIO = 1.2
+REGRESSION_SECONDS = 0.01
+
+
+def chunk_benchmark(action):
+    """Benchmark running a master action on a fresh chunk."""
+    def setup(size):
+        sparse.invalidate()
+        chunk = PhotoScan.make_chunk(size)
+        PhotoScan.app.document.chunks = [chunk]
+        PhotoScan.app.document.chunk = chunk
+        return (chunk,)
+
+    def run(chunk):
+        action(chunk)
+        return int(np.count_nonzero(chunk.point_cloud.valid))
+    return setup, run
+
+
+def network_setup(size):
+    """Two chunks and the flipflop dense task list."""
+    network.reset_client()
+    chunks = [PhotoScan.make_chunk(0, 'Auto: Optimized Side %d' % side, cameras=size // 1000)
+              for side in (1, 2)]
+    PhotoScan.app.document.chunks = chunks
+    return chunks, master.dense_model_tasks() + master.mask_tasks() + master.align_chunks_tasks()
+
+
+def network_run(chunks, tasks):
+    return master.add_network_tasks_to_queue(chunks, tasks)
+
+
+BENCHMARKS = [
+    ('gradual_selection_reprojectionerror',
+     chunk_benchmark(master.gradual_selection_reprojectionerror)),
+    ('gradualselection_reconstructionuncertainty',
+     chunk_benchmark(master.gradualselection_reconstructionuncertainty)),
+    ('gradualselection_reconstructionuncertainty_ten',
+     chunk_benchmark(master.gradualselection_reconstructionuncertainty_ten)),
+    ('ramp_gradual_selection_reprojectionerror',
+     chunk_benchmark(master.ramp_gradual_selection_reprojectionerror)),
+    ('optimize_sparse_cloud', chunk_benchmark(master.optimize_sparse_cloud)),
+    ('optimize_sparse_cloud_new', chunk_benchmark(master.optimize_sparse_cloud_new)),
+    ('optimize_sparse_cloud_elbow', chunk_benchmark(master.optimize_sparse_cloud_elbow)),
+    ('add_scalebars_to_chunk', chunk_benchmark(master.add_scalebars_to_chunk)),
+    ('add_network_tasks_to_queue', (network_setup, network_run)),
+]
+
+
+def run_benchmarks(names, sizes, repeat):
+    """Returns {name: {size: {'seconds': best, 'points': remaining}}}."""
+    results = {}
+    for name, (setup, run) in BENCHMARKS:
+        if names and name not in names:
+            continue
+        for size in sizes:
+            best = None
+            points = None
+            for _ in range(repeat):
+                args = setup(size)
+                start = time.perf_counter()
+                points = run(*args)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results.setdefault(name, {})[str(size)] = {'seconds': best, 'points': points}
+            print('%-48s %10d %10.3fs' % (name, size, best))
+    return results
+
+
+def latest_result(exclude):
+    """Most recent stored result other than exclude, or None."""
+    paths = [path for path in glob.glob(os.path.join(RESULTS_FOLDER, '*.json'))
+             if os.path.abspath(path) != os.path.abspath(exclude)]
+    if not paths:
+        return None
+    with open(max(paths, key=os.path.getmtime), 'r') as handle:
+        return json.load(handle)
+
+
+def compare(previous, current):
+    """Prints the ratio to a previous result; returns the regressed (name, size) pairs."""
+    regressions = []
+    for name, sizes in sorted(current['results'].items()):
+        for size, entry in sorted(sizes.items(), key=lambda item: int(item[0])):
+            before = previous['results'].get(name, {}).get(size)
+            if not before or not before['seconds']:
+                continue
+            ratio = entry['seconds'] / before['seconds']
+            flag = ''
+            if (ratio > REGRESSION_RATIO and
+                    entry['seconds'] - before['seconds'] > REGRESSION_SECONDS):
+                flag = '  REGRESSION'
+                regressions.append((name, size))
+            print('%-48s %10s %7.2fx%s' % (name, size, ratio, flag))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--label', default=time.strftime('%Y%m%d-%H%M%S'),
+                        help='name of the result file, e.g. a version number')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', default=[], help='benchmark names to run')
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+    results = run_benchmarks(args.only, args.sizes, args.repeat)
+    output = {'label': args.label, 'time': time.time(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'machine': platform.node(), 'results': results}
+    if not os.path.exists(RESULTS_FOLDER):
+        os.makedirs(RESULTS_FOLDER)
+    path = os.path.join(RESULTS_FOLDER, args.label + '.json')
+    previous = latest_result(path)
+    with open(path, 'w') as handle:
+        json.dump(output, handle, indent=1, sort_keys=True)
+    if previous is not None:
+        print('compared with %s:' % previous['label'])
+        return 1 if compare(previous, output) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,38 @@
 import os
 import re
+import sys
 import math
+import time
+import functools
+import logging
+from urllib.parse import quote
+STARTED = time.time()
 import PhotoScan
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from agisoft_helpers import registry
+from agisoft_helpers import tracing
+# Helpers load on first use, so start-up does not wait for NumPy and Pillow.
+artifacts = registry.lazy('agisoft_helpers.artifacts')
+checkpoint = registry.lazy('agisoft_helpers.checkpoint')
+executor = registry.lazy('agisoft_helpers.executor')
+exports = registry.lazy('agisoft_helpers.exports')
+ingest = registry.lazy('agisoft_helpers.ingest')
+masks = registry.lazy('agisoft_helpers.masks')
+monitor = registry.lazy('agisoft_helpers.monitor')
+network = registry.lazy('agisoft_helpers.network')
+pools = registry.lazy('agisoft_helpers.pools')
+pairs = registry.lazy('agisoft_helpers.pairs')
+preflight = registry.lazy('agisoft_helpers.preflight')
+quality = registry.lazy('agisoft_helpers.quality')
+roi = registry.lazy('agisoft_helpers.roi')
+scalebars = registry.lazy('agisoft_helpers.scalebars')
+scheduler = registry.lazy('agisoft_helpers.scheduler')
+selection = registry.lazy('agisoft_helpers.selection')
+snapshots = registry.lazy('agisoft_helpers.snapshots')
+sparse = registry.lazy('agisoft_helpers.sparse')
+thinning = registry.lazy('agisoft_helpers.thinning')
+
 # Specify folder of unique identifier.
 # Files must be in the following locations:
 # [identifier]
@@ -10,9 +40,10 @@ import PhotoScan
 #       \SIDEA\ -- location of jpegs for top view
 #       \SIDEB\ -- location of jpegs for bottom view
 #   \PROCESSING\ -- location to be used for psx file
-#   \EXPORT\
+#   \EXPORT\ -- [identifier]_export.json report and thumbnail
 #       \OBJ\
 #       \PLY\
+#       \LOD\
 
 # Note that a lot of these tasks only work when chunks have specific
 # labels. Many of the tasks will only work when performed at the
@@ -29,497 +60,1024 @@ TURNTABLE = False
 VALID_IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'tif', 'tiff', 'png', 'bmp', 'exr',
                           'tga', 'pgm', 'ppm', 'dng', 'mpo', 'seq', 'ara']
 UID_FOLDER = ''
+# Overrides of the scheduler.Schedule defaults for the optimization loops.
+OPTIMIZE_SCHEDULE = {}
+LOCAL_WORKERS = 1
+PHOTOSCAN_EXECUTABLE = ''
+INGEST_WORKERS = 8
+PREFILTER = False
+PREFILTER_ACTION = 'remove'
+PREFILTER_WORKERS = None
+PYTHON_EXECUTABLE = ''
+MONITOR_INTERVAL = 30.0
+TIMELINE_PATH = ''
+ROI_TRIM = 0.02
+ROI_METHOD = 'percentile'
+ROI_EXCLUDE_MARKERS = True
+ROI_CUT_MARKER_PLANE = TURNTABLE
+# Tie point budgets; thinning marks the other points invalid for good, so it is off (None)
+# unless set. THIN_BUDGET is used by the Thin Sparse Cloud menu item.
+OPTIMIZE_POINT_BUDGET = None
+ALIGN_POINT_BUDGET = None
+THIN_BUDGET = 100000
+THIN_PER_CELL = 1
+# Pair planning for TURNTABLE captures; frames_per_ring None splits rings at capture pauses.
+TURNTABLE_PAIRS = {'neighbors': 3, 'cross_ring': 1, 'cross_side': 4, 'gap_factor': 3.0,
+                   'frames_per_ring': None}
+# Flipflop side masks: 'model' builds a dense cloud and model per side, 'images' segments photos.
+MASK_SOURCE = 'model'
+IMAGE_MASKS = {'method': 'threshold', 'background': '', 'threshold': None, 'dilate': 4}
+MASK_WORKERS = None
+# Network task settings; with PREFLIGHT each project gets its own, chosen to fit the budget.
+TASK_DEFAULTS = {'match_downscale': int(PhotoScan.HighestAccuracy), 'keypoint_limit': 80000,
+                 'dense_downscale': int(PhotoScan.UltraQuality), 'face_count': 3,
+                 'texture_size': 4096}
+# Exports: PLY LODs as fractions of the faces, gzip copies, a thumbnail, and worker processes.
+EXPORT_LODS = (0.25, 0.05)
+EXPORT_COMPRESS = True
+EXPORT_THUMBNAIL = True
+EXPORT_WORKERS = None
+# Built dense clouds and textured models are cached under SHARED_ROOT, up to this many GB;
+# processing nodes use their own mount of SHARED_ROOT, found from the project path.
+ARTIFACT_FOLDER = 'artifact_cache'
+ARTIFACT_CACHE_GB = 500.0
+PREFLIGHT = False
+PREFLIGHT_HOURS = 4.0
+PREFLIGHT_MEMORY_GB = 32.0
+# Every action is traced to PROCESSING/trace.jsonl; PROFILE_ACTION names one to run under cProfile.
+TRACE = True
+PROFILE_ACTION = ''
+# Menus: modes of ACTIONS to show ('flipflop', 'one_side', 'network', 'tools'), None for all.
+MENU_MODES = None
+# Start-up and helper import times are appended to this JSONL file when set.
+STARTUP_LOG = ''
+# Scale bars: target sets in SCALEBAR_CONFIG; bars further off than this many robust
+# deviations of the others are disabled before each camera optimization.
+SCALEBAR_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scalebars.json')
+SCALEBAR_SET = 'default'
+SCALEBAR_OUTLIER_SIGMA = 4.0
+# agisoft_helpers/network_script.py as processing nodes see it; empty sends its path next to
+# this file, relative to SHARED_ROOT like project paths.
+NETWORK_SCRIPT = ''
 
+LOG = logging.getLogger(__name__)
 
-def add_network_tasks_to_queue(chunks, tasks):
-    """Adds network tasks to queue."""
-    network_tasks = []
-    network_client = PhotoScan.NetworkClient()
-    network_client.connect(SERVER_IP)
-    for task_parameters in tasks:
-        new_network_task = PhotoScan.NetworkTask()
-        for chunk in chunks:
-            new_network_task.frames.append((chunk.key, 0))
-            new_network_task.name = task_parameters['name']
-            for key in task_parameters:
-                if key != 'name':
-                    new_network_task.params[key] = task_parameters[key]
-        network_tasks.append(new_network_task)
-    network_save = PhotoScan.app.document.path.replace(SHARED_ROOT, '')
-    batch_id = network_client.createBatch(network_save, network_tasks)
-    network_client.resumeBatch(batch_id)
-
-def add_images_to_workspace_nside():
+
+def add_network_tasks_to_queue(chunks, tasks, document=None):
+    """Adds network tasks to queue. Saves the project first, as nodes read it from disk."""
+    return submit_batch(network.BatchBuilder().add_stage(chunks, tasks), document)
+
+def submit_batch(builder, document=None):
+    """Saves the project and submits the tasks of builder as one batch."""
+    if document is None:
+        document = PhotoScan.app.document
+    document.save()
+    return network.submit(SERVER_IP, document.path.replace(SHARED_ROOT, ''), builder)
+
+def network_script():
+    """Path of network_script.py for RunScript tasks."""
+    if NETWORK_SCRIPT:
+        return NETWORK_SCRIPT
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agisoft_helpers',
+                        'network_script.py').replace('\\', '/')
+    return path.replace(SHARED_ROOT, '') if SHARED_ROOT else path
+
+def network_script_args(*actions, document=None):
+    """RunScript args running actions; they carry the project path relative to SHARED_ROOT.
+
+    network_script.py strips it from the path the node opened, so SHARED_ROOT
+    is the node's own mount of the share while the actions run there.
+    """
+    if document is None:
+        document = PhotoScan.app.document
+    project = document.path.replace('\\', '/').replace(SHARED_ROOT, '')
+    return ' '.join(('--project', quote(project)) + actions)
+
+def add_alignment_stage(builder, chunks, tasks, match_action):
+    """Adds alignment tasks; on TURNTABLE captures matching runs as match_action instead.
+
+    MatchPhotos network tasks cannot take a pair list, so the planned pairs
+    are matched by a RunScript task on one node.
+    """
+    if TURNTABLE:
+        builder.add_script(network_script(), match_action)
+        tasks = [task for task in tasks if task['name'] != 'MatchPhotos']
+    return builder.add_stage(chunks, tasks)
+
+def task_settings(document=None):
+    """Task settings for document: its pre-flight choices if there are any, else the defaults."""
+    if document is None:
+        document = PhotoScan.app.document
+    settings = dict(TASK_DEFAULTS)
+    if document.path:
+        result = preflight.load(processing_folder(document) + '/' + preflight.PREFLIGHT_NAME)
+        if result is not None:
+            settings.update(result['settings'])
+    return settings
+
+def align_tasks(settings=None):
+    """Network tasks to match and align photos and detect markers."""
+    if settings is None:
+        settings = task_settings()
+    return [{'name': 'MatchPhotos',
+             'downscale': settings['match_downscale'],
+             'network_distribute': True,
+             'keypoint_limit': str(settings['keypoint_limit']),
+             'tiepoint_limit': '0'},
+            {'name': 'AlignCameras',
+             'network_distribute': True},
+            {'name': 'DetectMarkers',
+             'tolerance': '75',
+             'network_distribute': True}]
+
+def dense_model_tasks(settings=None):
+    """Network tasks to build the dense cloud and model."""
+    if settings is None:
+        settings = task_settings()
+    return [{'name': 'BuildDenseCloud',
+             'downscale': settings['dense_downscale'],
+             'network_distribute': True},
+            {'name': 'BuildModel',
+             'face_count': settings['face_count'],
+             'network_distribute': True}]
+
+def mask_tasks():
+    """Network tasks to mask photos from the model."""
+    return [{'name': 'ImportMasks',
+             'method': 3,
+             'network_distribute': True}]
+
+def align_chunks_tasks():
+    """Network tasks to align side chunks on their masked points."""
+    return [{'name': 'AlignChunks',
+             'match_filter_mask': 1,
+             'match_point_limit': 80000,
+             'network_distribute': True}]
+
+def texture_tasks(settings=None):
+    """Network tasks to build UV and texture."""
+    if settings is None:
+        settings = task_settings()
+    return [{'name': 'BuildUV'},
+            {'name': 'BuildTexture',
+             'texture_count': 1,
+             'texture_size': settings['texture_size'],
+             'network_distribute': True}]
+
+def merged_align_tasks(settings=None):
+    """Network tasks to align the masked photos of the merged chunk."""
+    if settings is None:
+        settings = task_settings()
+    return [{'name': 'MatchPhotos',
+             'downscale': settings['match_downscale'],
+             'network_distribute': True,
+             'filter_mask': '1',
+             'keypoint_limit': str(settings['keypoint_limit']),
+             'tiepoint_limit': '0'},
+            {'name': 'AlignCameras',
+             'network_distribute': True}]
+
+def pipeline_builder(chunks, flipflop=True, settings=None):
+    """Builds one ordered batch: align, optimize, dense, model, (masks, align chunks), texture."""
+    if settings is None:
+        settings = task_settings()
+    builder = network.BatchBuilder()
+    add_alignment_stage(builder, chunks, align_tasks(settings), 'match_aligned_sides')
+    builder.add_script(network_script(), 'optimize_sides_in_place fit_optimized_regions' +
+                       (' thin_optimized_chunks' if flipflop else ''))
+    builder.add_stage(chunks, dense_model_tasks(settings))
+    if flipflop:
+        builder.add_stage(chunks, mask_tasks())
+        builder.add_stage(chunks, align_chunks_tasks())
+    builder.add_stage(chunks, texture_tasks(settings))
+    return builder
+
+def auto_pipeline_network(uid_folder=None):
+    """Imports photos and submits the whole pipeline for them as a single network batch."""
+    uid_folder = get_uid_folder(uid_folder)
+    document = prepare_project(uid_folder, PhotoScan.app.document)
+    chunks = aligned_chunks(document)
+    builder = pipeline_builder(chunks, len(chunks) > 1)
+    return network.submit(SERVER_IP, document.path.replace(SHARED_ROOT, ''), builder)
+
+def auto_pipeline_network_folders(root_folder=None):
+    """Submits whole-pipeline batches for every UID folder under a root folder."""
+    root_folder = get_uid_folder(root_folder)
+    projects = []
+    for entry in sorted(os.listdir(root_folder)):
+        uid_folder = root_folder + '/' + entry
+        if not os.path.isdir(uid_folder + '/' + IMAGES_FOLDER):
+            continue
+        document = prepare_project(uid_folder, open_project(uid_folder))
+        chunks = aligned_chunks(document)
+        if not any(len(chunk.cameras) for chunk in chunks):
+            continue
+        projects.append((document.path.replace(SHARED_ROOT, ''),
+                         pipeline_builder(chunks, len(chunks) > 1, task_settings(document))))
+    return network.submit_projects(SERVER_IP, projects)
+
+def monitor_batches(batches, on_complete=None):
+    """Watches {project path: batch id} until all finish; returns throughput figures.
+
+    The task timeline is appended to TIMELINE_PATH when it is set.
+    """
+    batch_monitor = monitor.BatchMonitor(network.get_client(SERVER_IP), TIMELINE_PATH or None,
+                                         MONITOR_INTERVAL)
+    for project, batch_id in sorted(batches.items()):
+        batch_monitor.watch(batch_id, project, on_complete)
+    return batch_monitor.run()
+
+def prepare_project(uid_folder, document):
+    """Adds photos of uid_folder to document, prefilters them if enabled and saves it."""
+    add_images_to_workspace_nside(uid_folder, document)
+    if PREFILTER:
+        prefilter_images(uid_folder, document)
+    if PREFLIGHT:
+        estimate_settings(uid_folder)
+    save_workspace(uid_folder, document)
+    return document
+
+def estimate_settings(uid_folder=None):
+    """Profiles the photos of uid_folder and saves the task settings that fit the budget.
+
+    Past runs in TIMELINE_PATH, when set, calibrate the time predictions.
+    """
+    uid_folder = get_uid_folder(uid_folder)
+    folder = uid_folder + '/' + PROCESS_FOLDER
+    records = list(ingest.load_manifest(folder + '/' + ingest.MANIFEST_NAME).values())
+    models = None
+    if TIMELINE_PATH:
+        models = preflight.fit_models(TIMELINE_PATH, lambda project: os.path.dirname(
+            SHARED_ROOT + project))
+    profile = preflight.profile_images(records)
+    settings, prediction = preflight.choose_settings(profile, PREFLIGHT_HOURS,
+                                                     PREFLIGHT_MEMORY_GB, models)
+    preflight.save(folder + '/' + preflight.PREFLIGHT_NAME, profile, settings, prediction)
+    LOG.info('%s: %s, predicted %.1f h', uid_folder, settings,
+             sum(cost[0] for cost in prediction.values()) / 3600.0)
+    return settings
+
+def aligned_chunks(document=None):
+    """Returns the 'Auto: Aligned' chunks of document."""
+    if document is None:
+        document = PhotoScan.app.document
+    chunks = []
+    for chunk in document.chunks:
+        if chunk.label.startswith("Auto: Aligned"):
+            chunks.append(chunk)
+    return chunks
+
+def get_uid_folder(uid_folder=None):
+    """Returns uid_folder with forward slashes, asking for it when not given."""
+    if uid_folder is None:
+        uid_folder = PhotoScan.app.getExistingDirectory("Specify uid path:")
+    return uid_folder.replace('\\', '/')
+
+def add_images_to_workspace_nside(uid_folder=None, document=None):
     """ Adds images to workspace. Will put arbitrary number of sides into their own chunks. """
-    uid_folder = PhotoScan.app.getExistingDirectory("Specify uid path:")
-    uid_folder = uid_folder.replace('\\', '/')
+    if document is None:
+        document = PhotoScan.app.document
+    uid_folder = get_uid_folder(uid_folder)
     path_photos = uid_folder + '/' + IMAGES_FOLDER
-    folder_list = []
-    for folder in os.listdir(path_photos):
-        if os.path.isdir(os.path.join(path_photos, folder)):
-            folder_list.append(folder)
-    for side_index, side in enumerate(folder_list):
-        image_list = []
-        for image in os.listdir(path_photos + '/' + side):
-            extension = image.split('.')[-1].lower()
-            if extension in VALID_IMAGE_EXTENSIONS and not image.startswith('._'):
-                image_list.append(path_photos + '/' + side + '/' + image)
-        chunk = PhotoScan.app.document.addChunk()
-        chunk.label = 'Auto: Aligned Side ' + str(side_index + 1)
-        chunk.addPhotos(image_list)
-
-def save_workspace():
-    """Save file as .psx as it is requried for netwrok processing."""
-    uid_folder = PhotoScan.app.getExistingDirectory("Specify uid path:")
-    uid_folder = uid_folder.replace('\\', '/')
+    manifest = uid_folder + '/' + PROCESS_FOLDER + '/' + ingest.MANIFEST_NAME
+    sides, _ = ingest.ingest(path_photos, manifest, VALID_IMAGE_EXTENSIONS, INGEST_WORKERS)
+    for side_index, side in enumerate(sorted(sides)):
+        label = 'Auto: Aligned Side ' + str(side_index + 1)
+        chunk = None
+        for existing in document.chunks:
+            if existing.label == label:
+                chunk = existing
+        if chunk is None:
+            chunk = document.addChunk()
+            chunk.label = label
+        loaded = set(camera.photo.path.replace('\\', '/') for camera in chunk.cameras)
+        records = [record for record in sides[side] if record['path'] not in loaded]
+        if records:
+            chunk.addPhotos([record['path'] for record in records])
+            ingest.apply_calibration_groups(chunk, sides[side])
+
+def prefilter_images(uid_folder=None, document=None):
+    """Drops blurred, badly exposed and duplicate photos from the aligned side chunks."""
+    uid_folder = get_uid_folder(uid_folder)
+    cache_path = uid_folder + '/' + PROCESS_FOLDER + '/' + quality.SCORES_NAME
+    for chunk in aligned_chunks(document):
+        quality.prefilter_chunk(chunk, cache_path, PREFILTER_ACTION, PREFILTER_WORKERS,
+                                PYTHON_EXECUTABLE)
+
+def project_path(uid_folder):
+    """Returns the .psx path used for a uid folder."""
     uid = uid_folder.split('/')[-1]
-    save_path = uid_folder + '/' + PROCESS_FOLDER + '/'
-    save_file = save_path + uid + '.psx'
-    if not os.path.exists(save_path):
-        os.makedirs(save_path)
-    PhotoScan.app.document.save(save_file)
+    return uid_folder + '/' + PROCESS_FOLDER + '/' + uid + '.psx'
+
+def open_project(uid_folder, document=None):
+    """Opens the saved project of uid_folder, or returns a new document if there is none."""
+    if document is None:
+        document = PhotoScan.Document()
+    if os.path.exists(project_path(uid_folder)):
+        document.open(project_path(uid_folder))
+    return document
+
+def save_workspace(uid_folder=None, document=None):
+    """Save file as .psx as it is requried for netwrok processing."""
+    if document is None:
+        document = PhotoScan.app.document
+    uid_folder = get_uid_folder(uid_folder)
+    save_file = project_path(uid_folder)
+    if not os.path.exists(os.path.dirname(save_file)):
+        os.makedirs(os.path.dirname(save_file))
+    document.save(save_file)
+
+def stage_settings(name):
+    """Settings that, when changed, make a pipeline stage run again."""
+    schedule = optimize_schedule().__dict__
+    region = [ROI_TRIM, ROI_METHOD, ROI_EXCLUDE_MARKERS, ROI_CUT_MARKER_PLANE]
+    defaults = TASK_DEFAULTS
+    settings = {'ingest': [VALID_IMAGE_EXTENSIONS, PREFILTER, PREFLIGHT, PREFLIGHT_HOURS,
+                           PREFLIGHT_MEMORY_GB],
+                'align': [align_tasks(defaults), TURNTABLE, TURNTABLE_PAIRS],
+                'optimize': [schedule, OPTIMIZE_POINT_BUDGET, THIN_PER_CELL],
+                'dense_mask': [dense_model_tasks(defaults), mask_tasks(), align_chunks_tasks(),
+                               region, ALIGN_POINT_BUDGET, MASK_SOURCE, IMAGE_MASKS],
+                'merged_align': [merged_align_tasks(defaults), TURNTABLE, TURNTABLE_PAIRS],
+                'merged_optimize': [schedule, OPTIMIZE_POINT_BUDGET, THIN_PER_CELL],
+                'final': [dense_model_tasks(defaults), texture_tasks(defaults), region],
+                'export': [EXPORT_FOLDER, EXPORT_LODS, EXPORT_COMPRESS, EXPORT_THUMBNAIL]}
+    return [MODE, settings.get(name)]
+
+def images_fingerprint(uid_folder):
+    """Fingerprint of the photos of a uid folder, the input of the ingest stage."""
+    return checkpoint.fingerprint(ingest.list_images(uid_folder + '/' + IMAGES_FOLDER,
+                                                     VALID_IMAGE_EXTENSIONS))
+
+def record_stage(name, after, finished=True, document=None):
+    """Records a pipeline stage run from the menu in the project's stage manifest.
+
+    after is the stage before it, None for 'ingest'. A finished stage is
+    recorded as the driver records it, so the driver resumes after it. A stage
+    not finished, such as one submitted as a network batch, is forgotten, so
+    the driver runs it again.
+    """
+    if document is None:
+        document = PhotoScan.app.document
+    if not document.path:
+        return
+    manifest = checkpoint.StageManifest(checkpoint.manifest_path(document.path))
+    if not finished:
+        manifest.invalidate([name])
+        return
+    manifest.complete(name, stage_inputs(manifest, name, after, document),
+                      checkpoint.document_fingerprint(document))
 
-def auto_phase_one():
+def stage_inputs(manifest, name, after, document):
+    """Input fingerprint of stage name: its settings and the output of stage after."""
+    if after is None:
+        previous = images_fingerprint(os.path.dirname(os.path.dirname(document.path)))
+    else:
+        previous = manifest.output(after)
+    return checkpoint.fingerprint(name, stage_settings(name), previous)
+
+def stage_is_current(name, after, document=None):
+    """True when stage name can be skipped, as the driver would skip it.
+
+    The stage must have been recorded with the current inputs, and the project
+    must be as it or a stage recorded after it left it.
+    """
+    if document is None:
+        document = PhotoScan.app.document
+    if not document.path:
+        return False
+    manifest = checkpoint.StageManifest(checkpoint.manifest_path(document.path))
+    if not manifest.is_current(name, stage_inputs(manifest, name, after, document)):
+        return False
+    completed = manifest.stages[name]['completed']
+    outputs = set(record['output'] for record in manifest.stages.values()
+                  if record['completed'] >= completed)
+    if checkpoint.document_fingerprint(document) not in outputs:
+        return False
+    LOG.info('stage %s is up to date; skipped', name)
+    return True
+
+def auto_phase_one(uid_folder=None):
     """Automatic Step 1: Attempts to align all photos."""
-    add_images_to_workspace_nside()
-    save_workspace()
-    chunks = []
-    for chunk in PhotoScan.app.document.chunks:
-        if chunk.label.startswith("Auto: Aligned"):
-            chunks.append(chunk)
+    uid_folder = get_uid_folder(uid_folder)
+    if not stage_is_current('ingest', None):
+        prepare_project(uid_folder, PhotoScan.app.document)
+        record_stage('ingest', None)
+    if stage_is_current('align', 'ingest'):
+        return None
+    batch_id = align_sides()
+    record_stage('align', 'ingest', batch_id is None)
+    return batch_id
 
+def align_sides():
+    """Aligns the side chunks; returns the batch id in network mode."""
+    chunks = aligned_chunks()
     if MODE == 'network':
-        tasks = [{'name': 'MatchPhotos',
-                  'downscale': int(PhotoScan.HighestAccuracy),
-                  'network_distribute': True,
-                  'keypoint_limit': '80000',
-                  'tiepoint_limit': '0'},
-                 {'name': 'AlignCameras',
-                  'network_distribute': True},
-                 {'name': 'DetectMarkers',
-                  'tolerance': '75',
-                  'network_distribute': True}]
-        add_network_tasks_to_queue(chunks, tasks)
+        return submit_batch(add_alignment_stage(network.BatchBuilder(), chunks, align_tasks(),
+                                                'match_aligned_sides'))
+    run_local(chunks, align_chunk)
+
+def run_local(chunks, action):
+    """Runs a per-chunk action on chunks, in parallel when LOCAL_WORKERS allows."""
+    return executor.run_per_chunk(chunks, action, LOCAL_WORKERS, PHOTOSCAN_EXECUTABLE)
+
+def align_chunk(chunk=None):
+    """Matches and aligns photos of a chunk and detects its markers."""
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    match_photos(chunk, PhotoScan.HighestAccuracy)
+    sparse.align_cameras(chunk)
+    chunk.detectMarkers(type=PhotoScan.TargetType.CircularTarget12bit,
+                        tolerance=75,
+                        inverted=False,
+                        noparity=False)
+
+def processing_folder(document=None):
+    """PROCESSING folder of the UID the open project belongs to."""
+    if document is None:
+        document = PhotoScan.app.document
+    return re.sub(r"/" + PROCESS_FOLDER + "/.*", '', document.path) + '/' + PROCESS_FOLDER
+
+def turntable_pairs(chunk=None):
+    """Planned camera key pairs for chunk, cached per image set under PROCESSING."""
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    folder = processing_folder()
+    manifest = ingest.load_manifest(folder + '/' + ingest.MANIFEST_NAME)
+    return pairs.chunk_pairs(chunk, manifest, folder + '/' + pairs.CACHE_FOLDER, TURNTABLE_PAIRS)
+
+def match_photos(chunk, accuracy, **kwargs):
+    """Matches photos of chunk; on TURNTABLE captures only the planned pairs are matched."""
+    if TURNTABLE:
+        chunk.matchPhotos(accuracy=accuracy, generic_preselection=False,
+                          reference_preselection=False, pairs=turntable_pairs(chunk), **kwargs)
     else:
-        for chunk in chunks:
-            chunk.matchPhotos(accuracy=PhotoScan.HighestAccuracy,
-                              generic_preselection=True,
-                              reference_preselection=False)
-            chunk.alignCameras()
-            chunk.detectMarkers(type=PhotoScan.TargetType.CircularTarget12bit,
-                                tolerance=75,
-                                inverted=False,
-                                noparity=False)
+        chunk.matchPhotos(accuracy=accuracy, generic_preselection=True,
+                          reference_preselection=False, **kwargs)
 
-def auto_setup_optimize():
-    """Creates copies of Alignment chunks for future optimization."""
+def match_accuracy(settings):
+    """PhotoScan accuracy of the match_downscale in task settings."""
+    for accuracy in (PhotoScan.HighestAccuracy, PhotoScan.HighAccuracy, PhotoScan.MediumAccuracy,
+                     PhotoScan.LowAccuracy, PhotoScan.LowestAccuracy):
+        if int(accuracy) == settings['match_downscale']:
+            return accuracy
+    raise ValueError('no accuracy for match_downscale %r' % (settings['match_downscale'],))
+
+def match_aligned_sides():
+    """Matches the side chunks with the parameters of align_tasks."""
+    settings = task_settings()
+    for chunk in aligned_chunks():
+        match_photos(chunk, match_accuracy(settings), keypoint_limit=settings['keypoint_limit'],
+                     tiepoint_limit=0)
+
+def match_merged_chunk():
+    """Matches the masked photos of the merged chunk with the parameters of merged_align_tasks."""
+    settings = task_settings()
     for chunk in PhotoScan.app.document.chunks:
-        if chunk.label.startswith('Auto: Aligned'):
-            new_chunk = chunk.copy()
-            new_chunk.label = chunk.label.replace('Aligned', 'Unoptimized')
-            chunk.enabled = False
+        if chunk.label == "Auto: Merged Chunk":
+            match_photos(chunk, match_accuracy(settings), filter_mask=True,
+                         keypoint_limit=settings['keypoint_limit'], tiepoint_limit=0)
 
-def auto_optimize_sparse_clouds():
-    """Optimizes sparse cloud using specified method."""
+def auto_setup_optimize():
+    """Snapshots Alignment chunks, then marks them for optimization in place."""
+    document = PhotoScan.app.document
+    for chunk in aligned_chunks(document):
+        if chunk.enabled:
+            snapshots.save(chunk, snapshots.snapshot_path(document.path, chunk, 'aligned'))
+            chunk.label = chunk.label.replace('Aligned', 'Unoptimized')
+
+def optimize_sides_in_place(method=None):
+    """Optimizes the side chunks in place after snapshotting their alignment.
+
+    Keeps chunk keys unchanged so later tasks of the same network batch still
+    refer to the optimized chunks.
+    """
+    if method is None:
+        method = optimize_sparse_cloud
+    auto_setup_optimize()
+    add_scalebars(unoptimized_chunks())
     for chunk in PhotoScan.app.document.chunks:
-        if chunk.label.startswith("Auto: Unoptimized"):
-            PhotoScan.app.document.chunk = chunk
-            optimize_sparse_cloud()
+        if chunk.label.startswith("Auto: Unoptimized Side"):
+            method(chunk)
             chunk.label = chunk.label.replace('Unoptimized', 'Optimized')
 
+def auto_optimize_sparse_clouds(method=None):
+    """Optimizes sparse cloud using specified method."""
+    if method is None:
+        method = optimize_sparse_cloud
+    for chunk in run_local(unoptimized_chunks(), method):
+        chunk.label = chunk.label.replace('Unoptimized', 'Optimized')
+
 def auto_optimize_sparse_clouds_new():
     """Optimizes sparse cloud using specified method."""
-    for chunk in PhotoScan.app.document.chunks:
-        if chunk.label.startswith("Auto: Unoptimized"):
-            PhotoScan.app.document.chunk = chunk
-            optimize_sparse_cloud_new()
-            chunk.label = chunk.label.replace('Unoptimized', 'Optimized')
+    auto_optimize_sparse_clouds(optimize_sparse_cloud_new)
 
 def auto_setup_and_optimize():
     """Sets up optimization, then performs old optimziation method."""
+    if stage_is_current('optimize', 'align'):
+        return
     auto_setup_optimize()
+    add_scalebars(unoptimized_chunks())
     auto_optimize_sparse_clouds()
-    add_scalebars_to_chunk()
+    record_stage('optimize', 'align')
 
 def auto_setup_and_optimize_new():
     """Sets up optimization, then performs new optimziation method."""
     auto_setup_optimize()
+    add_scalebars(unoptimized_chunks())
     auto_optimize_sparse_clouds_new()
-    add_scalebars_to_chunk()
-
-def add_scalebars_to_chunk():
-    """Adds scalebars to chunk according to hard-coded measurements for encoded markers."""
-    accuracy = 0.0001
-    pairings = ['1_3', '2_4', '49_50', '50_51', '52_53', '53_54',
-                '55_56', '57_58', '58_59', '60_61', '61_62', '63_64']
-    scale_values = {'49_50': 0.50024, '50_51': 0.50058, '52_53': 0.25007, '53_54': 0.25034,
-                    '55_56': 0.25033, '57_58': 0.50027, '58_59': 0.50053, '60_61': 0.25004,
-                    '61_62': 0.25033, '63_64': 0.25034, '1_3': 0.12500, '2_4': 0.12500}
-    chunk = PhotoScan.app.document.chunk
-    markers = {}
-    for marker in chunk.markers:
-        markers.update({marker.label.replace('target ', ''): marker})
-    scalebars = {}
-    for pair in pairings:
-        left, right = pair.split('_')
-        if left in markers.keys():
-            scalebars[pair] = chunk.addScalebar(markers[left], markers[right])
-            scalebars[pair].label = pair
-            scalebars[pair].reference.accuracy = accuracy
-            scalebars[pair].reference.distance = scale_values[pair]
-
-def optimize_sparse_cloud():
+    # the driver optimizes with the old method, so it must run this stage again
+    record_stage('optimize', 'align', False)
+
+def unoptimized_chunks(document=None):
+    """Chunks set up for optimization."""
+    if document is None:
+        document = PhotoScan.app.document
+    return [chunk for chunk in document.chunks if chunk.label.startswith("Auto: Unoptimized")]
+
+def scalebar_targets():
+    """The SCALEBAR_SET target set of SCALEBAR_CONFIG."""
+    return scalebars.load_config(SCALEBAR_CONFIG)[SCALEBAR_SET]
+
+def add_scalebars_to_chunk(chunk=None):
+    """Adds scalebars to chunk between the detected targets of the configured target set."""
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    return scalebars.apply(chunk, scalebar_targets())
+
+def add_scalebars(chunks=None):
+    """Adds scalebars to chunks, by default every chunk of the project."""
+    if chunks is None:
+        chunks = PhotoScan.app.document.chunks
+    for label, count in sorted(scalebars.apply_all(chunks, scalebar_targets()).items()):
+        LOG.info('%s: %d scale bars', label, count)
+
+def check_scalebars(chunk=None):
+    """Disables scale bars whose length disagrees with the others, before optimizing."""
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    disabled = scalebars.disable_outliers(chunk, SCALEBAR_OUTLIER_SIGMA)
+    for label, residual in disabled:
+        LOG.warning('%s: disabled scale bar %s, residual %.5f m', chunk.label, label, residual)
+    return disabled
+
+def optimize_sparse_cloud(chunk=None, select_reprojection=None):
     """Optimizes sparse cloud"""
-    gradualselection_reconstructionuncertainty_ten()
-    delete_and_optimize()
-    gradualselection_reconstructionuncertainty_ten()
-    delete_and_optimize()
-    var = gradual_selection_reprojectionerror()
-    while var >= 1:
-        var = gradual_selection_reprojectionerror()
-        delete_and_optimize()
-    if var <= 1.0:
-        PhotoScan.app.document.chunk.tiepoint_accuracy = 0.1
-    while var >= 0.3:
-        var = gradual_selection_reprojectionerror()
-        delete_and_optimize_all()
-
-def optimize_sparse_cloud_new():
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    gradualselection_reconstructionuncertainty_ten(chunk)
+    delete_and_optimize(chunk)
+    gradualselection_reconstructionuncertainty_ten(chunk)
+    delete_and_optimize(chunk)
+    optimize_reprojection_error(chunk, select_reprojection)
+
+def optimize_sparse_cloud_elbow(chunk=None):
+    """Optimizes sparse cloud, selecting by the elbow of the reprojection error curve."""
+    optimize_sparse_cloud(chunk, ramp_gradual_selection_reprojectionerror)
+
+def optimize_sparse_cloud_new(chunk=None):
     """Optimizes sparse cloud"""
-    gradualselection_reconstructionuncertainty()
-    delete_and_optimize()
-    gradualselection_reconstructionuncertainty()
-    delete_and_optimize()
-    var = gradual_selection_reprojectionerror()
-    while var >= 1:
-        var = gradual_selection_reprojectionerror()
-        delete_and_optimize()
-    if var <= 1.0:
-        PhotoScan.app.document.chunk.tiepoint_accuracy = 0.1
-    while var >= 0.3:
-        var = gradual_selection_reprojectionerror()
-        delete_and_optimize_all()
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    gradualselection_reconstructionuncertainty(chunk)
+    delete_and_optimize(chunk)
+    gradualselection_reconstructionuncertainty(chunk)
+    delete_and_optimize(chunk)
+    optimize_reprojection_error(chunk)
 
-def auto_phase_two_noalign():
-    """Build dense cloud, model, and texture."""
+def optimize_schedule():
+    """Schedule of the optimization loops, with OPTIMIZE_SCHEDULE applied."""
+    return scheduler.Schedule(**OPTIMIZE_SCHEDULE)
+
+def optimize_reprojection_error(chunk=None, select_reprojection=None):
+    """Removes high reprojection error points on a schedule down to 1, then to 0.3.
+
+    The 0.3 pass, with tighter tie point accuracy, runs only once the error is
+    down to 1; otherwise the chunk is left after the first pass and a warning
+    is logged.
+    """
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    if OPTIMIZE_POINT_BUDGET:
+        thin_sparse_cloud(chunk, OPTIMIZE_POINT_BUDGET)
+    var = scheduler.run(chunk, PhotoScan.PointCloud.Filter.ReprojectionError, 1.0,
+                        optimize_partial, optimize_schedule(), select_reprojection)
+    if var > 1.0:
+        LOG.warning('%s: reprojection error stopped at %.3f above 1.0; skipping the 0.3 pass',
+                    chunk.label, var)
+        return
+    chunk.tiepoint_accuracy = 0.1
+    scheduler.run(chunk, PhotoScan.PointCloud.Filter.ReprojectionError, 0.3,
+                  optimize_all, optimize_schedule(), select_reprojection)
+
+def fit_optimized_regions():
+    """Fits the region of every optimized chunk to its sparse cloud; returns the chunks."""
     chunks = []
     for chunk in PhotoScan.app.document.chunks:
         if chunk.label.startswith("Auto: Optimized"):
+            create_roi(chunk)
             chunks.append(chunk)
-    if MODE == 'network':
-        tasks = [{'name': 'BuildDenseCloud',
-                  'downscale': int(PhotoScan.HighAccuracy),
-                  'network_distribute': True},
-                 {'name': 'BuildModel',
-                  'face_count': 3,
-                  'network_distribute': True},
-                 {'name': 'BuildUV'},
-                 {'name': 'BuildTexture',
-                  'texture_count': 1,
-                  'texture_size': 4096,
-                  'network_distribute': True}]
-        add_network_tasks_to_queue(chunks, tasks)
-    else:
-        for chunk in chunks:
-            chunk.buildDenseCloud(quality=PhotoScan.MediumQuality)
-            chunk.buildModel(surface=PhotoScan.Arbitrary, interpolation=PhotoScan.EnabledInterpolation)
-            chunk.buildUV(mapping=PhotoScan.GenericMapping)
-            chunk.buildTexture(blending=PhotoScan.MosaicBlending, size=4096)
+    return chunks
 
-def auto_phase_two_nside():
-    """Build dense cloud, model, create mask from model, align chunks."""
-    chunks = []
+def thin_optimized_chunks():
+    """Thins the sparse cloud of every optimized chunk to ALIGN_POINT_BUDGET points, if set."""
+    if not ALIGN_POINT_BUDGET:
+        return
     for chunk in PhotoScan.app.document.chunks:
         if chunk.label.startswith("Auto: Optimized"):
-            chunks.append(chunk)
+            thin_sparse_cloud(chunk, ALIGN_POINT_BUDGET)
+
+def auto_phase_two_noalign():
+    """Build dense cloud, model, and texture, or import them from the artifact cache."""
+    if stage_is_current('final', 'optimize'):
+        return None
+    chunks = import_cached_artifacts(fit_optimized_regions())
+    batch_id = build_and_store(chunks, store_side_artifacts)
+    record_stage('final', 'optimize', batch_id is None)
+    return batch_id
+
+def build_and_store(chunks, store_action):
+    """Builds dense cloud, model and texture for chunks, then runs store_action to cache them.
+
+    In network mode store_action runs as a script task at the end of the batch.
+    """
+    if not chunks:
+        return None
     if MODE == 'network':
-        tasks = [{'name': 'BuildDenseCloud',
-                  'downscale': int(PhotoScan.HighAccuracy),
-                  'network_distribute': True},
-                 {'name': 'BuildModel',
-                  'face_count': 3,
-                  'network_distribute': True},
-                 {'name': 'ImportMasks',
-                  'method': 3,
-                  'network_distribute': True},
-                 {'name': 'AlignChunks',
-                  'match_filter_mask': 1,
-                  'match_point_limit': 80000,
-                  'network_distribute': True}]
-        add_network_tasks_to_queue(chunks, tasks)
+        builder = network.BatchBuilder().add_stage(chunks, dense_model_tasks() + texture_tasks())
+        if artifact_cache() is not None:
+            builder.add_script(network_script(), network_script_args(store_action.__name__))
+        return submit_batch(builder)
     else:
+        run_local(chunks, build_textured_model)
+        store_action()
+
+def build_textured_model(chunk=None):
+    """Builds dense cloud, model, UV and texture for a chunk."""
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    chunk.buildDenseCloud(quality=PhotoScan.MediumQuality)
+    chunk.buildModel(surface=PhotoScan.Arbitrary,
+                     interpolation=PhotoScan.EnabledInterpolation)
+    chunk.buildUV(mapping=PhotoScan.GenericMapping)
+    chunk.buildTexture(blending=PhotoScan.MosaicBlending, size=4096)
+
+def auto_phase_two_nside():
+    """Build dense cloud, model, create mask from model, align chunks."""
+    if stage_is_current('dense_mask', 'optimize'):
+        return None
+    chunks = fit_optimized_regions()
+    thin_optimized_chunks()
+    batch_id = None
+    if MASK_SOURCE == 'images':
         for chunk in chunks:
-            chunk.buildDenseCloud(quality=PhotoScan.MediumQuality)
-            chunk.buildModel(surface=PhotoScan.Arbitrary,
-                             interpolation=PhotoScan.EnabledInterpolation)
-            #chunk.buildUV(mapping=PhotoScan.GenericMapping)
-            #chunk.buildTexture(blending=PhotoScan.MosaicBlending, size=4096)
-            chunk.importMasks(path='', source=PhotoScan.MaskSource.MaskSourceModel,
-                              operation=PhotoScan.MaskOperation.MaskOperationReplacement)
-        PhotoScan.app.document.alignChunks(chunks, chunks[0], method='points', fix_scale=False,
-                                           accuracy=PhotoScan.HighAccuracy, preselection=False,
-                                           filter_mask=True, point_limit=80000)
+            make_image_masks(chunk)
+        if MODE == 'network':
+            batch_id = add_network_tasks_to_queue(chunks, align_chunks_tasks())
+        else:
+            align_masked_chunks(chunks)
+    elif MODE == 'network':
+        batch_id = add_network_tasks_to_queue(chunks, dense_model_tasks() + mask_tasks() +
+                                              align_chunks_tasks())
+    else:
+        align_masked_chunks(run_local(chunks, build_model_mask))
+    record_stage('dense_mask', 'optimize', batch_id is None)
+    return batch_id
+
+def align_masked_chunks(chunks):
+    """Aligns chunks on the points of their masked photos."""
+    PhotoScan.app.document.alignChunks(chunks, chunks[0], method='points', fix_scale=False,
+                                       accuracy=PhotoScan.HighAccuracy, preselection=False,
+                                       filter_mask=True, point_limit=80000)
+
+def make_image_masks(chunk=None):
+    """Segments the photos of a chunk and imports the masks, replacing any existing ones."""
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    for template, cameras in masks.chunk_masks(chunk, processing_folder(), IMAGE_MASKS,
+                                               MASK_WORKERS, PYTHON_EXECUTABLE):
+        chunk.importMasks(path=template, source=PhotoScan.MaskSource.MaskSourceFile,
+                          operation=PhotoScan.MaskOperation.MaskOperationReplacement,
+                          cameras=cameras)
+
+def build_model_mask(chunk=None):
+    """Builds dense cloud and model for a chunk, then masks its photos from the model."""
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    chunk.buildDenseCloud(quality=PhotoScan.MediumQuality)
+    chunk.buildModel(surface=PhotoScan.Arbitrary,
+                     interpolation=PhotoScan.EnabledInterpolation)
+    chunk.importMasks(path='', source=PhotoScan.MaskSource.MaskSourceModel,
+                      operation=PhotoScan.MaskOperation.MaskOperationReplacement)
+
+def merge_sides():
+    """Merges the optimized side chunks into 'Auto: Merged Chunk' unless it exists; returns it."""
+    document = PhotoScan.app.document
+    sides = []
+    for chunk in document.chunks:
+        if chunk.label == "Auto: Merged Chunk":
+            return chunk
+        if chunk.label.startswith("Auto: Optimized Side"):
+            sides.append(chunk)
+    document.mergeChunks([chunk.key for chunk in sides], merge_markers=True)
+    merged = document.chunks[-1]
+    merged.label = "Auto: Merged Chunk"
+    return merged
 
 def auto_phase_three():
     """Merge chunks and align masked photos."""
+    if stage_is_current('merged_align', 'dense_mask'):
+        return None
+    chunk = merge_sides()
+    PhotoScan.app.document.chunk = chunk
+    batch_id = None
     if MODE == 'network':
-        tasks = [{'name': 'MatchPhotos',
-                  'downscale': int(PhotoScan.HigesthAccuracy),
-                  'network_distribute': True,
-                  'filter_mask': '1',
-                  'keypoint_limit': '80000',
-                  'tiepoint_limit': '0'},
-                 {'name': 'AlignCameras',
-                  'network_distribute': True}]
-        add_network_tasks_to_queue([PhotoScan.app.document.chunk], tasks)
+        batch_id = submit_batch(add_alignment_stage(network.BatchBuilder(), [chunk],
+                                                    merged_align_tasks(), 'match_merged_chunk'))
     else:
-        chunk = PhotoScan.app.document.chunk
-        chunk.matchPhotos(accuracy=PhotoScan.HighAccuracy,
-                          generic_preselection=True,
-                          reference_preselection=False)
-        chunk.alignCameras()
+        match_photos(chunk, PhotoScan.HighAccuracy)
+        sparse.align_cameras(chunk)
+    record_stage('merged_align', 'dense_mask', batch_id is None)
+    return batch_id
 
 def auto_setup_merged_optimization():
-    """Creates duplicate of the 'merged alignment chunk' for future optimization."""
-    for chunk in PhotoScan.app.document.chunks:
+    """Snapshots the 'merged alignment chunk', then marks it for optimization in place."""
+    document = PhotoScan.app.document
+    for chunk in document.chunks:
         if chunk.label == "Auto: Merged Chunk":
-            chunk_om = chunk.copy()
-            chunk_om.label = "Auto: Unoptimized Merged Chunk"
-            chunk.enabled = False
+            snapshots.save(chunk, snapshots.snapshot_path(document.path, chunk, 'aligned'))
+            chunk.label = "Auto: Unoptimized Merged Chunk"
 
 def auto_optimize_merged_sides():
     """Perform all steps needed for optimizing merged sides."""
+    if stage_is_current('merged_optimize', 'merged_align'):
+        return
     auto_setup_merged_optimization()
     auto_optimize_sparse_clouds()
+    record_stage('merged_optimize', 'merged_align')
 
 def auto_phase_four():
-    """Build dense cloud, model, texture for merged chunk."""
+    """Build dense cloud, model, texture for merged chunk, or import them from the cache."""
+    if stage_is_current('final', 'merged_optimize'):
+        return None
     chunks = []
     for chunk in PhotoScan.app.document.chunks:
         if chunk.label == ("Auto: Optimized Merged Chunk"):
+            create_roi(chunk)
             chunks.append(chunk)
+    batch_id = build_and_store(import_cached_artifacts(chunks), store_merged_artifacts)
+    record_stage('final', 'merged_optimize', batch_id is None)
+    return batch_id
+
+def artifact_cache():
+    """Shared cache of built dense clouds and models, or None when it is not configured."""
+    if not SHARED_ROOT or not ARTIFACT_CACHE_GB:
+        return None
+    root = SHARED_ROOT.rstrip('/') + '/' + ARTIFACT_FOLDER
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    return artifacts.ArtifactCache(root, int(ARTIFACT_CACHE_GB * 1024 ** 3))
+
+def artifact_key(chunk):
+    """Cache key of chunk's dense cloud, model and texture as build_and_store makes them."""
+    folder = processing_folder() + '/' + masks.CACHE_FOLDER
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    paths = sorted(set(camera.photo.path.replace('\\', '/') for camera in chunk.cameras))
+    hashes = masks.content_hashes(paths, folder + '/' + masks.INDEX_NAME)
     if MODE == 'network':
-        tasks = [{'name': 'BuildDenseCloud',
-                  'downscale': int(PhotoScan.HighAccuracy),
-                  'network_distribute': True},
-                 {'name': 'BuildModel',
-                  'face_count': 3,
-                  'network_distribute': True},
-                 {'name': 'BuildUV'},
-                 {'name': 'BuildTexture',
-                  'texture_count': 1,
-                  'texture_size': 4096,
-                  'network_distribute': True}]
-        add_network_tasks_to_queue(chunks, tasks)
+        params = dense_model_tasks() + texture_tasks()
     else:
-        for chunk in chunks:
-            chunk.buildDenseCloud(quality=PhotoScan.MediumQuality)
-            chunk.buildModel(surface=PhotoScan.Arbitrary,
-                             interpolation=PhotoScan.EnabledInterpolation)
-            chunk.buildUV(mapping=PhotoScan.GenericMapping)
-            chunk.buildTexture(blending=PhotoScan.MosaicBlending, size=4096)
+        params = ['build_textured_model']
+    return artifacts.chunk_key(chunk, hashes, params)
+
+def import_cached_artifacts(chunks):
+    """Imports cached dense clouds and models into chunks; returns the chunks still to build."""
+    cache = artifact_cache()
+    if cache is None:
+        return chunks
+    missing = []
+    for chunk in chunks:
+        folder = cache.lookup(artifact_key(chunk))
+        if folder is None:
+            missing.append(chunk)
+            continue
+        try:
+            chunk.importPoints(folder + '/' + artifacts.DENSE_NAME,
+                               format=PhotoScan.PointsFormatPLY)
+            chunk.importModel(folder + '/' + artifacts.MODEL_NAME,
+                              format=PhotoScan.ModelFormatOBJ)
+        except (RuntimeError, IOError, OSError) as error:
+            LOG.warning('%s: cannot import cached build %s: %s', chunk.label, folder, error)
+            missing.append(chunk)
+            continue
+        LOG.info('%s: imported cached build %s', chunk.label, folder)
+    return missing
+
+def export_artifacts(chunk, folder):
+    """Writes chunk's dense cloud as binary PLY and its textured model as OBJ into folder."""
+    chunk.exportPoints(folder + '/' + artifacts.DENSE_NAME, binary=True, precision=6,
+                       normals=True, colors=True, source=PhotoScan.DenseCloudData,
+                       format=PhotoScan.PointsFormatPLY)
+    chunk.exportModel(folder + '/' + artifacts.MODEL_NAME, False, 6, PhotoScan.ImageFormatPNG,
+                      True, True, True, False, False, False, False, '',
+                      PhotoScan.ModelFormatOBJ)
 
-def delete_and_optimize():
+def store_artifacts(chunks):
+    """Adds the built dense clouds and models of chunks to the artifact cache."""
+    cache = artifact_cache()
+    if cache is None:
+        return
+    for chunk in chunks:
+        if chunk.dense_cloud is not None and chunk.model is not None:
+            cache.store(artifact_key(chunk),
+                        lambda folder, chunk=chunk: export_artifacts(chunk, folder))
+
+def store_side_artifacts():
+    """Caches the builds of the optimized side chunks."""
+    store_artifacts([chunk for chunk in PhotoScan.app.document.chunks
+                     if chunk.label.startswith("Auto: Optimized Side")])
+
+def store_merged_artifacts():
+    """Caches the build of the optimized merged chunk."""
+    store_artifacts([chunk for chunk in PhotoScan.app.document.chunks
+                     if chunk.label == "Auto: Optimized Merged Chunk"])
+
+def export_final_models():
+    """Exports the last optimized chunk: the merged chunk if there is one, else the first side."""
+    final = None
+    for chunk in PhotoScan.app.document.chunks:
+        if chunk.label == "Auto: Optimized Merged Chunk":
+            final = chunk
+        elif final is None and chunk.label.startswith("Auto: Optimized"):
+            final = chunk
+    export_models(final)
+
+def delete_and_optimize(chunk=None):
     """Deletes selected points and optimizes with some options."""
-    delete_selected_points()
-    optimize_partial()
+    delete_selected_points(chunk)
+    optimize_partial(chunk)
 
-def delete_and_optimize_all():
+def delete_and_optimize_all(chunk=None):
     """Deletes selected points and optimizes with some options."""
-    delete_selected_points()
-    optimize_all()
-
-def rescale(val, in_array, out_array):
-    """Rescale array of values to arbitrary scale"""
-    return min(out_array) + (val - min(in_array)) * ((max(out_array) - min(out_array)) / (max(in_array) - min(in_array)))
-
-def find_nearest(array, value):
-    """I forget why I created this."""
-    diff = 91
-    idx = 0
-    for index in array:
-        idiff = abs(value - index)
-        if idiff < diff:
-            diff = idiff
-            idx = index
-    return array.index(idx)
-
-def ramp_gradual_selection_reprojectionerror():
-    """Performs a gradual selection using 'reprojection error' with ramp method."""
-    point_cloud_filter = PhotoScan.PointCloud.Filter()
-    point_cloud_filter.init(PhotoScan.app.document.chunk,
-                            PhotoScan.PointCloud.Filter.ReconstructionUncertainty)
-    points = PhotoScan.app.document.chunk.point_cloud.points.__len__()
-    thresh = 1
-    thresh_jump = 1
-    selected = points
-    curve = []
-    while selected > 50000:
-        selected = 0
-        point_cloud_filter.selectPoints(thresh)
-        for point in PhotoScan.app.document.chunk.point_cloud.points:
-            if point.selected:
-                selected += 1
-        thresh += thresh_jump
-        curve.append(selected)
-    angles = []
-    for index in range(0, len(curve)-2):
-        (distx, disty) = 1.0, abs(rescale(curve[index], curve, range(0, len(curve)-1)))
-        angle = math.atan(disty/distx)
-        angle *= 180/math.pi
-        angles.append(angle)
-    elbow = find_nearest(angles, 45)
-    return elbow
-
-def gradual_selection_reprojectionerror():
-    """Performs a gradual selection using 'reprojection error'."""
-    point_cloud_filter = PhotoScan.PointCloud.Filter()
-    point_cloud_filter.init(PhotoScan.app.document.chunk,
-                            PhotoScan.PointCloud.Filter.ReprojectionError)
-    target_percent = 10
-    points = PhotoScan.app.document.chunk.point_cloud.points.__len__()
-    target = int(points / target_percent)
-    thresh = 1
-    thresh_jump = 1
-    selected = points
-    high = False
-    low = False
-    while selected != target:
-        selected = 0
-        point_cloud_filter.selectPoints(thresh)
-        for point in PhotoScan.app.document.chunk.point_cloud.points:
-            if point.selected:
-                selected += 1
-        if selected == target:
-            break
-        elif selected > target:
-            high = True
-            thresh += thresh_jump
-        else:
-            low = True
-            thresh -= thresh_jump
-        if high & low:
-            high = False
-            low = False
-            thresh_jump = thresh_jump / 10
-    return thresh
-
-def gradualselection_reconstructionuncertainty_ten():
+    delete_selected_points(chunk)
+    optimize_all(chunk)
+
+def ramp_gradual_selection_reprojectionerror(chunk=None):
+    """Performs a gradual selection using 'reprojection error' at the elbow of the error curve."""
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    return selection.select_elbow(chunk, PhotoScan.PointCloud.Filter.ReprojectionError)
+
+def gradual_selection_reprojectionerror(chunk=None):
+    """Performs a gradual selection using 'reprojection error' of the worst 10%."""
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    return selection.select_fraction(chunk, PhotoScan.PointCloud.Filter.ReprojectionError, 0.1)
+
+def gradualselection_reconstructionuncertainty_ten(chunk=None):
     """Performs a gradual selection using 'reconstruction uncertainty' with 10."""
-    point_cloud_filter = PhotoScan.PointCloud.Filter()
-    point_cloud_filter.init(PhotoScan.app.document.chunk,
-                            PhotoScan.PointCloud.Filter.ReconstructionUncertainty)
-    point_cloud_filter.selectPoints(10)
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    selection.select_threshold(chunk, PhotoScan.PointCloud.Filter.ReconstructionUncertainty, 10)
 
-def gradualselection_reconstructionuncertainty():
+def gradualselection_reconstructionuncertainty(chunk=None):
     """Performs a gradual selection using 'reconstruction uncertainty' with 10%."""
-    point_cloud_filter = PhotoScan.PointCloud.Filter()
-    point_cloud_filter.init(PhotoScan.app.document.chunk,
-                            PhotoScan.PointCloud.Filter.ReconstructionUncertainty)
-    target_percent = 10
-    points = PhotoScan.app.document.chunk.point_cloud.points.__len__()
-    target = int(points / target_percent)
-    thresh = 100
-    thresh_jump = 100
-    selected = points
-    high = False
-    low = False
-    while selected != target:
-        selected = 0
-        point_cloud_filter.selectPoints(thresh)
-        for point in PhotoScan.app.document.chunk.point_cloud.points:
-            if point.selected:
-                selected += 1
-        if selected == target:
-            break
-        elif selected > target:
-            high = True
-            thresh += thresh_jump
-        else:
-            low = True
-            thresh -= thresh_jump
-        if high & low:
-            high = False
-            low = False
-            thresh_jump = thresh_jump / 10
-
-def delete_selected_points():
-    """Deletes selected points"""
-    PhotoScan.app.document.chunk.point_cloud.removeSelectedPoints()
-
-def export_models():
-    """Exports a PLY and OBJ"""
-    path = re.sub(r"PROCESSING/.*", '', PhotoScan.app.document.path)
-    export = path + EXPORT_FOLDER
-    ply = export + '/PLY/test.ply'
-    obj = export + '/OBJ/test.obj'
-
-    # export obj
-    PhotoScan.app.document.chunk.exportModel(obj, False, 6, PhotoScan.ImageFormatPNG, True, False,
-                                             False, False, False, False, False, '',
-                                             PhotoScan.ModelFormatOBJ)
-
-    # export ply
-    PhotoScan.app.document.chunk.exportModel(ply, False, 6, PhotoScan.ImageFormatPNG, True, False,
-                                             False, False, False, False, False, '',
-                                             PhotoScan.ModelFormatPLY)
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    return selection.select_fraction(chunk, PhotoScan.PointCloud.Filter.ReconstructionUncertainty,
+                                     0.1)
+
+def delete_selected_points(chunk=None):
+    """Deletes selected points from the solution; they stay in the cloud, marked invalid."""
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    sparse.invalidate_selected_points(chunk)
+
+def export_models(chunk=None):
+    """Exports chunk's model as binary PLY and textured OBJ named by UID, then checks them.
+
+    PhotoScan writes one export at a time, so the PLY is written first and
+    its validation, compressed copy, LODs and thumbnail run in worker
+    processes while the OBJ is written. A report with vertex and face
+    counts, bounds, checksums and any problems is saved next to the exports.
+    """
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    uid_folder = re.sub(r"/" + PROCESS_FOLDER + "/.*", '', PhotoScan.app.document.path)
+    uid = os.path.basename(uid_folder)
+    export = uid_folder + '/' + EXPORT_FOLDER
+    for folder in ('PLY', 'OBJ', 'LOD'):
+        if not os.path.isdir(export + '/' + folder):
+            os.makedirs(export + '/' + folder)
+    ply = export + '/PLY/' + uid + '.ply'
+    obj = export + '/OBJ/' + uid + '.obj'
+    lod_paths = dict((fraction, '%s/LOD/%s_%g.ply' % (export, uid, fraction))
+                     for fraction in EXPORT_LODS)
+    thumbnail = export + '/' + uid + '_thumbnail.png' if EXPORT_THUMBNAIL else None
+
+    with pools.worker_pool(EXPORT_WORKERS, PYTHON_EXECUTABLE) as pool:
+        # binary PLY with vertex colours; the texture is only written with the OBJ
+        chunk.exportModel(ply, True, 6, PhotoScan.ImageFormatPNG, False, True,
+                          True, False, False, False, False, '',
+                          PhotoScan.ModelFormatPLY)
+        futures = {ply: exports.submit(pool, ply, lod_paths, thumbnail, EXPORT_COMPRESS)}
+        chunk.exportModel(obj, False, 6, PhotoScan.ImageFormatPNG, True, False,
+                          False, False, False, False, False, '',
+                          PhotoScan.ModelFormatOBJ)
+        futures[obj] = exports.submit(pool, obj, compressed=EXPORT_COMPRESS)
+        report = dict((path, exports.collect(jobs)) for path, jobs in futures.items())
+    exports.save_report(export + '/' + uid + '_export.json', report)
+    for problem in exports.problems(report):
+        LOG.warning(problem)
+    return report
 
 # optimizeCameras(fit_f=True, fit_cx=True, fit_cy=True, fit_b1=True?, fit_b2=True?, fit_k1=True,
 #                 fit_k2=True, fit_k3=True, fit_k4=False, fit_p1=True, fit_p2=True, fit_p3=False,
 #                 fit_p4=False, fit_shutter=False[, progress])
 
-def optimize_partial():
+def thin_sparse_cloud(chunk=None, budget=None):
+    """Thins tie points to a budget, by default THIN_BUDGET, keeping the best of each voxel cell.
+
+    The other valid points are marked invalid and are not restored.
+    """
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    if budget is None:
+        budget = THIN_BUDGET
+    return thinning.thin_chunk(chunk, budget, THIN_PER_CELL)
+
+def optimize_partial(chunk=None):
     """Optimizes some of the options, Selections according to the CHI-method"""
-    PhotoScan.app.document.chunk.optimizeCameras(True, True, True, True, True, True, True,
-                                                 True, False, True, True, False, False, False)
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    check_scalebars(chunk)
+    sparse.optimize_cameras(chunk,
+                            True, True, True, True, True, True, True,
+                            True, False, True, True, False, False, False)
 
-def optimize_all():
+def optimize_all(chunk=None):
     """Optimizes all of the options, Selections according to the CHI-method"""
-    PhotoScan.app.document.chunk.optimizeCameras(True, True, True, True, True, True, True,
-                                                 True, True, True, True, True, True, False)
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    check_scalebars(chunk)
+    sparse.optimize_cameras(chunk,
+                            True, True, True, True, True, True, True,
+                            True, True, True, True, True, True, False)
 
 def revert_to_clean():
-    """Deletes all chunks other than Algined Side A and B."""
-    for chunk in PhotoScan.app.document.chunks:
+    """Returns side chunks to their aligned state and deletes all other chunks.
+
+    Side chunks optimized in place are restored from their alignment snapshot
+    and lose their dense cloud, model and scale bars. When a side chunk has no
+    snapshot, nothing is changed and RuntimeError is raised, since deleting
+    it would lose the alignment.
+    """
+    document = PhotoScan.app.document
+    sides = [chunk for chunk in document.chunks
+             if re.match(r"Auto: (Unoptimized|Optimized) Side", chunk.label)]
+    missing = [chunk.label for chunk in sides
+               if not os.path.exists(snapshots.snapshot_path(document.path, chunk, 'aligned'))]
+    if missing:
+        raise RuntimeError('no alignment snapshot for ' + ', '.join(missing) +
+                           '; nothing was reverted')
+    side_keys = set(chunk.key for chunk in sides)
+    for chunk in list(document.chunks):
         if chunk.label.startswith("Auto: Aligned"):
             chunk.enabled = True
+        elif chunk.key in side_keys:
+            snapshot = snapshots.snapshot_path(document.path, chunk, 'aligned')
+            snapshots.restore(chunk, snapshots.load(snapshot))
+            chunk.dense_cloud = None
+            chunk.model = None
+            chunk.remove(list(chunk.scalebars))
+            chunk.label = re.sub(r"Auto: (Unoptimized|Optimized) ", "Auto: Aligned ", chunk.label)
+            chunk.enabled = True
         else:
-            PhotoScan.app.document.remove(chunk)
+            document.remove(chunk)
+    if PhotoScan.app.document.path:
+        manifest = checkpoint.StageManifest(checkpoint.manifest_path(PhotoScan.app.document.path))
+        manifest.keep_only(checkpoint.CLEAN_STAGES)
 
-def reset_view():
+def reset_view(chunk=None):
     """Moves viewport to face the center of the ROI box; this doesn't seem to always work."""
-    PhotoScan.app.viewpoint.coo = PhotoScan.app.document.chunk.region.center
-    PhotoScan.app.viewpoint.rot = PhotoScan.app.document.chunk.region.rot
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    PhotoScan.app.viewpoint.coo = chunk.region.center
+    PhotoScan.app.viewpoint.rot = chunk.region.rot
     PhotoScan.app.viewpoint.mag = 100
 
 
-def create_roi():
-    """ Attempts to create the region ROI. This places the center of the ROI region """
-    # """at the midpoint of all of the scale bar markers. """
-    # """NOTE: This doesn't actually do anything yet."""
-    x_axis, y_axis, z_axis = 0, 0, 0
-    for chunk in PhotoScan.app.document.chunks:
-        if chunk.label == 'Aligned Side A':
-            x_axis, y_axis, z_axis = 0, 0, 0
-            num_markers = chunk.markers.__len__()
-            for marker in chunk.markers:
-                x_axis += marker.position.x
-                y_axis += marker.position.y
-                z_axis += marker.position.z
-
-            cent_x = x_axis / num_markers
-            cent_y = y_axis / num_markers
-            cent_z = z_axis / num_markers
-
-            newregion = PhotoScan.Region()
-            newregion.size = chunk.region.size
-            newregion.rot = chunk.region.rot
-            newregion.center = PhotoScan.Vector([cent_x, cent_y, cent_z])
-            chunk.region = newregion
-
-def center_bbox_xyz():
+def create_roi(chunk=None):
+    """Fits the ROI region to the sparse cloud, leaving out outliers and marker areas."""
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
+    return roi.fit_region(chunk, ROI_TRIM, ROI_METHOD, ROI_EXCLUDE_MARKERS, ROI_CUT_MARKER_PLANE)
+
+def center_bbox_xyz(chunk=None):
     """Centers bounding box to XYZ center."""
-    chunk = PhotoScan.app.document.chunk
+    if chunk is None:
+        chunk = PhotoScan.app.document.chunk
     transform_matrix = chunk.transform.matrix
     if chunk.crs:
         vect_tm = transform_matrix * PhotoScan.Vector([0, 0, 0, 1])
@@ -537,38 +1095,93 @@ def center_bbox_xyz():
     reg.rot = mat.t()
     chunk.region = reg
 
-#
-# Setup Menus
-PhotoScan.app.addMenuItem("Automate/Flipflop/1. Import and Align", auto_phase_one)
-PhotoScan.app.addMenuItem("Automate/Flipflop/2a. Old Optimize", auto_setup_and_optimize)
-PhotoScan.app.addMenuItem("Automate/Flipflop/2b. New Optimize", auto_setup_and_optimize_new)
-PhotoScan.app.addMenuItem("Automate/Flipflop/3. Create Dense, Model, Mask, Align",
-                          auto_phase_two_nside)
-PhotoScan.app.addMenuItem("Automate/Flipflop/4. Merge Sides and Realign", auto_phase_three)
-PhotoScan.app.addMenuItem("Automate/Flipflop/5. Optimize Merged", auto_optimize_merged_sides)
-PhotoScan.app.addMenuItem("Automate/Flipflop/6. Create Dense, Model, and Texture",
-                          auto_phase_four)
-PhotoScan.app.addMenuItem("Automate/Flipflop/7. Export Models", export_models)
-
-PhotoScan.app.addMenuItem("Automate/One Side/1. Import and Align", auto_phase_one)
-PhotoScan.app.addMenuItem("Automate/One Side/2a. Old Optimize", auto_setup_and_optimize)
-PhotoScan.app.addMenuItem("Automate/One Side/2b. New Optimize", auto_setup_and_optimize_new)
-PhotoScan.app.addMenuItem("Automate/One Side/3. Create Dense, Model, and Texture",
-                          auto_phase_two_noalign)
-PhotoScan.app.addMenuItem("Automate/One Side/4. Export Models", export_models)
-
-PhotoScan.app.addMenuItem("Reset/Back to Align", revert_to_clean)
-PhotoScan.app.addMenuItem("Reset/Reset View", reset_view)
-
-PhotoScan.app.addMenuItem("Optimize/Cameras/Partial", optimize_partial)
-PhotoScan.app.addMenuItem("Optimize/Cameras/All", optimize_all)
-PhotoScan.app.addMenuItem("Optimize/Chunk/Sparse Cloud method 1", optimize_sparse_cloud)
-PhotoScan.app.addMenuItem("Optimize/Chunk/Sparse Cloud method 2", optimize_sparse_cloud_new)
-PhotoScan.app.addMenuItem("Optimize/Selection/Reconstruction Uncertainty 10",
-                          gradualselection_reconstructionuncertainty_ten)
-PhotoScan.app.addMenuItem("Optimize/Selection/Reconstruction Uncertainty 10%",
-                          gradualselection_reconstructionuncertainty)
-PhotoScan.app.addMenuItem("Optimize/Selection/Reprojection Error",
-                          gradual_selection_reprojectionerror)
-
-PhotoScan.app.addMenuItem("Parts/Add Scale Bars", add_scalebars_to_chunk)
+def drop_cached_clouds():
+    """Drops the cached sparse clouds, as the project may have been edited since they were read.
+
+    Runs before every menu action; NumPy is not loaded for it.
+    """
+    if 'agisoft_helpers.sparse' in sys.modules:
+        sparse.invalidate()
+
+def trace_path():
+    """Trace file of the open project, or None while it is unsaved."""
+    if not PhotoScan.app.document.path:
+        return None
+    return processing_folder() + '/' + tracing.TRACE_NAME
+
+def chunk_points(args, kwargs):
+    """Known valid point count of the chunk a call was given, if any."""
+    chunk = kwargs.get('chunk', args[0] if args else None)
+    if chunk is None or not hasattr(chunk, 'point_cloud'):
+        return None
+    return sparse.known_point_count(chunk)
+
+# Menu items: (path, action, mode). Actions are looked up when invoked, so helper
+# modules load then; MENU_MODES None shows every mode.
+ACTIONS = [
+    ('Automate/Flipflop/1. Import and Align', 'auto_phase_one', 'flipflop'),
+    ('Automate/Flipflop/2a. Old Optimize', 'auto_setup_and_optimize', 'flipflop'),
+    ('Automate/Flipflop/2b. New Optimize', 'auto_setup_and_optimize_new', 'flipflop'),
+    ('Automate/Flipflop/3. Create Dense, Model, Mask, Align', 'auto_phase_two_nside',
+     'flipflop'),
+    ('Automate/Flipflop/4. Merge Sides and Realign', 'auto_phase_three', 'flipflop'),
+    ('Automate/Flipflop/5. Optimize Merged', 'auto_optimize_merged_sides', 'flipflop'),
+    ('Automate/Flipflop/6. Create Dense, Model, and Texture', 'auto_phase_four', 'flipflop'),
+    ('Automate/Flipflop/7. Export Models', 'export_models', 'flipflop'),
+    ('Automate/Network/Submit Whole Pipeline', 'auto_pipeline_network', 'network'),
+    ('Automate/Network/Submit Pipelines for All UIDs in Folder',
+     'auto_pipeline_network_folders', 'network'),
+    ('Automate/One Side/1. Import and Align', 'auto_phase_one', 'one_side'),
+    ('Automate/One Side/2a. Old Optimize', 'auto_setup_and_optimize', 'one_side'),
+    ('Automate/One Side/2b. New Optimize', 'auto_setup_and_optimize_new', 'one_side'),
+    ('Automate/One Side/3. Create Dense, Model, and Texture', 'auto_phase_two_noalign',
+     'one_side'),
+    ('Automate/One Side/4. Export Models', 'export_models', 'one_side'),
+    ('Optimize/Photos/Prefilter Images', 'prefilter_images', 'tools'),
+    ('Optimize/Photos/Estimate Task Settings', 'estimate_settings', 'tools'),
+    ('Optimize/Photos/Mask Photos from Images', 'make_image_masks', 'tools'),
+    ('Reset/Back to Align', 'revert_to_clean', 'tools'),
+    ('Reset/Reset View', 'reset_view', 'tools'),
+    ('Reset/Fit Region to Sparse Cloud', 'create_roi', 'tools'),
+    ('Optimize/Cameras/Partial', 'optimize_partial', 'tools'),
+    ('Optimize/Cameras/All', 'optimize_all', 'tools'),
+    ('Optimize/Chunk/Thin Sparse Cloud', 'thin_sparse_cloud', 'tools'),
+    ('Optimize/Chunk/Sparse Cloud method 1', 'optimize_sparse_cloud', 'tools'),
+    ('Optimize/Chunk/Sparse Cloud method 2', 'optimize_sparse_cloud_new', 'tools'),
+    ('Optimize/Chunk/Sparse Cloud elbow method', 'optimize_sparse_cloud_elbow', 'tools'),
+    ('Optimize/Selection/Reconstruction Uncertainty 10',
+     'gradualselection_reconstructionuncertainty_ten', 'tools'),
+    ('Optimize/Selection/Reconstruction Uncertainty 10%',
+     'gradualselection_reconstructionuncertainty', 'tools'),
+    ('Optimize/Selection/Reprojection Error', 'gradual_selection_reprojectionerror', 'tools'),
+    ('Optimize/Selection/Reprojection Error Elbow',
+     'ramp_gradual_selection_reprojectionerror', 'tools'),
+    ('Parts/Add Scale Bars', 'add_scalebars_to_chunk', 'tools'),
+    ('Parts/Add Scale Bars to All Chunks', 'add_scalebars', 'tools'),
+    ('Parts/Disable Outlier Scale Bars', 'check_scalebars', 'tools')]
+
+if TRACE:
+    tracing.configure(trace_path, PROFILE_ACTION, chunk_points)
+    tracing.instrument_namespace(globals(), __name__,
+                                 exclude=('trace_path', 'chunk_points', 'optimize_schedule',
+                                          'drop_cached_clouds'))
+    # helper functions are wrapped when their module is first imported
+    for module, names in ((sparse, ('optimize_cameras', 'align_cameras',
+                                    'invalidate_selected_points', 'remove_selected_points')),
+                          (selection, ('select_fraction', 'select_threshold', 'select_elbow')),
+                          (scheduler, ('run',)),
+                          (thinning, ('thin_chunk',)),
+                          (roi, ('fit_region',)),
+                          (masks, ('chunk_masks',)),
+                          (quality, ('prefilter_chunk',)),
+                          (ingest, ('ingest',)),
+                          (executor, ('run_per_chunk',)),
+                          (network, ('submit', 'submit_projects')),
+                          (snapshots, ('save', 'restore')),
+                          (exports, ('collect',)),
+                          (scalebars, ('apply_all', 'disable_outliers'))):
+        registry.on_import(module, functools.partial(tracing.instrument_module, names=names))
+
+registry.configure(STARTUP_LOG)
+registry.register(PhotoScan.app, ACTIONS, globals(), MENU_MODES, before=drop_cached_clouds)
+registry.finish_startup(STARTED)
@@ -0,0 +1,70 @@
+"""Artifact cache store, lookup and eviction."""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agisoft_helpers import artifacts
+
+
+def writer(size):
+    def write(folder):
+        with open(folder + '/' + artifacts.DENSE_NAME, 'wb') as handle:
+            handle.write(b'x' * size)
+    return write
+
+
+class ArtifactCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = artifacts.ArtifactCache(self.root, 10 ** 9)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def age(self, key, seconds):
+        """Marks key as last used seconds ago."""
+        entry = self.cache._read_entry(key)
+        entry['used'] = time.time() - seconds
+        self.cache._write_entry(self.cache.folder(key), entry)
+
+    def test_store_and_lookup(self):
+        self.assertIsNone(self.cache.lookup('a'))
+        folder = self.cache.store('a', writer(100))
+        self.assertEqual(self.cache.lookup('a'), folder)
+        self.assertTrue(os.path.exists(folder + '/' + artifacts.DENSE_NAME))
+        self.assertEqual(self.cache.store('a', writer(5)), folder)
+        self.assertEqual(os.path.getsize(folder + '/' + artifacts.DENSE_NAME), 100)
+        self.assertEqual(os.listdir(self.root), ['a'])
+
+    def test_failed_write_leaves_no_entry(self):
+        def fail(folder):
+            raise ValueError('export failed')
+        self.assertRaises(ValueError, self.cache.store, 'a', fail)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_evicts_least_recently_used(self):
+        for key, seconds in (('old', 3000), ('older', 4000), ('new', 2000)):
+            self.cache.store(key, writer(1000))
+            self.age(key, seconds)
+        size = self.cache.entries()[0][1]
+        self.cache.max_bytes = 2 * size
+        self.assertEqual(self.cache.evict(), ['older'])
+        self.assertEqual(sorted(os.listdir(self.root)), ['new', 'old'])
+
+    def test_keeps_recently_used_above_bound(self):
+        for key in ('a', 'b'):
+            self.cache.store(key, writer(1000))
+        self.age('a', artifacts.RECENT_SECONDS * 2)
+        self.cache.max_bytes = 0
+        self.assertEqual(self.cache.evict(), ['a'])
+        self.assertIsNotNone(self.cache.lookup('b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Stage manifest and fingerprints."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agisoft_helpers import checkpoint
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_stable_and_order_independent_for_dicts(self):
+        self.assertEqual(checkpoint.fingerprint({'a': 1, 'b': 2}),
+                         checkpoint.fingerprint({'b': 2, 'a': 1}))
+        self.assertNotEqual(checkpoint.fingerprint('align', [1]),
+                            checkpoint.fingerprint('align', [2]))
+
+    def test_manifest_path(self):
+        self.assertEqual(checkpoint.manifest_path('D:/scan/PROCESSING/scan.psx'),
+                         'D:/scan/PROCESSING/scan' + checkpoint.MANIFEST_SUFFIX)
+
+
+class StageManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'PROCESSING', 'scan.stages.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_complete_is_saved(self):
+        manifest = checkpoint.StageManifest(self.path)
+        manifest.complete('ingest', 'in', 'out', 1.5)
+        loaded = checkpoint.StageManifest(self.path)
+        self.assertTrue(loaded.is_current('ingest', 'in'))
+        self.assertFalse(loaded.is_current('ingest', 'other'))
+        self.assertFalse(loaded.is_current('align', 'in'))
+        self.assertEqual(loaded.output('ingest'), 'out')
+        self.assertIsNone(loaded.output('align'))
+
+    def test_keep_only(self):
+        manifest = checkpoint.StageManifest(self.path)
+        for stage in ('ingest', 'align', 'optimize'):
+            manifest.complete(stage, stage, stage)
+        manifest.keep_only(checkpoint.CLEAN_STAGES)
+        self.assertEqual(sorted(checkpoint.StageManifest(self.path).stages),
+                         sorted(checkpoint.CLEAN_STAGES))
+
+    def test_unreadable_manifest_is_empty(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as handle:
+            handle.write('{')
+        self.assertEqual(checkpoint.StageManifest(self.path).stages, {})
+        checkpoint.save_json(self.path, {'version': -1, 'stages': {'ingest': {}}})
+        self.assertEqual(checkpoint.StageManifest(self.path).stages, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Export validation and LOD decimation on small PLY files."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from agisoft_helpers import exports
+
+
+def grid_mesh(size):
+    """Triangulated size x size vertex grid in the z = 0 plane."""
+    y, x = np.mgrid[0:size, 0:size]
+    vertices = np.column_stack([x.ravel(), y.ravel(), np.zeros(size * size)])
+    corners = (y[:-1, :-1] * size + x[:-1, :-1]).ravel()
+    faces = np.vstack([np.column_stack([corners, corners + 1, corners + size]),
+                       np.column_stack([corners + 1, corners + size + 1, corners + size])])
+    return vertices.astype(np.float32), faces.astype(np.int32)
+
+
+class ExportsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'model.ply')
+        self.vertices, self.faces = grid_mesh(50)
+        exports.write_ply(self.path, self.vertices, self.faces)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_validate_ply(self):
+        report = exports.validate_ply(self.path)
+        self.assertEqual(report['vertices'], len(self.vertices))
+        self.assertEqual(report['faces'], len(self.faces))
+        self.assertEqual(report['bounds'], [[0.0, 0.0, 0.0], [49.0, 49.0, 0.0]])
+        self.assertEqual(report['problems'], [])
+        self.assertEqual(report['sha256'], exports.checksum(self.path))
+
+    def test_validate_finds_bad_rows(self):
+        vertices = self.vertices.copy()
+        vertices[3] = np.nan
+        faces = self.faces.copy()
+        faces[0, 0] = len(vertices)
+        exports.write_ply(self.path, vertices, faces)
+        self.assertEqual(len(exports.validate_ply(self.path)['problems']), 2)
+
+    def test_make_lod(self):
+        target = os.path.join(self.folder, 'lod.ply')
+        result = exports.make_lod(self.path, target, 0.25)
+        report = exports.validate_ply(target)
+        self.assertEqual(report['problems'], [])
+        self.assertEqual(report['faces'], result['faces'])
+        self.assertGreater(result['faces'], len(self.faces) * 0.1)
+        self.assertLess(result['faces'], len(self.faces) * 0.5)
+
+    def test_validate_obj(self):
+        path = os.path.join(self.folder, 'model.obj')
+        with open(path, 'w') as handle:
+            handle.write('v 0 0 0\nv 1 2 3\nv 1 0 0\nvt 0 0\nf 1 2 3\n')
+        report = exports.validate_obj(path)
+        self.assertEqual((report['vertices'], report['faces']), (3, 1))
+        self.assertEqual(report['bounds'], [[0.0, 0.0, 0.0], [1.0, 2.0, 3.0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""BatchMonitor against the in-process LocalNetworkServer."""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from agisoft_helpers import monitor
+from localserver import LocalNetworkClient, LocalNetworkServer
+
+
+class Clock(object):
+    """Clock that moves on by one second per reading."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+class FailingClient(LocalNetworkClient):
+    """Client whose status requests fail for one batch."""
+
+    def __init__(self, server, failing):
+        LocalNetworkClient.__init__(self, server)
+        self.failing = failing
+
+    def batchStatus(self, batch_id):
+        if batch_id == self.failing:
+            raise IOError('connection reset')
+        return LocalNetworkClient.batchStatus(self, batch_id)
+
+
+def submit(client, tasks):
+    batch_id = client.createBatch('project.psx', tasks)
+    client.resumeBatch(batch_id)
+    return batch_id
+
+
+class BatchMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalNetworkServer(nodes=('node-1', 'node-2'), auto_advance=True)
+        self.client = LocalNetworkClient(self.server)
+        self.client.connect('localhost')
+
+    def test_records_every_task(self):
+        batch_id = submit(self.client, ['MatchPhotos', 'AlignCameras', 'BuildDenseCloud'])
+        batch_monitor = monitor.BatchMonitor(self.client, poll_interval=0, clock=Clock())
+        batch_monitor.watch(batch_id, 'project')
+        summary = batch_monitor.run()
+        self.assertEqual([record['task'] for record in batch_monitor.records],
+                         ['MatchPhotos', 'AlignCameras', 'BuildDenseCloud'])
+        self.assertEqual(summary['completed'], 1)
+
+    def test_records_tasks_finished_between_polls(self):
+        batch_id = submit(self.client, ['MatchPhotos', 'AlignCameras'])
+        for _ in range(3):
+            self.server.advance(batch_id)
+        self.assertEqual(self.server.batches[batch_id]['status'], 'completed')
+        clock = Clock()
+        batch_monitor = monitor.BatchMonitor(self.client, poll_interval=0, clock=clock)
+        batch_monitor.watch(batch_id, 'project')
+        batch_monitor.run()
+        records = batch_monitor.records
+        self.assertEqual([record['status'] for record in records], ['completed', 'completed'])
+        for record in records:
+            self.assertEqual(record['start'], 1001.0)
+            self.assertEqual(record['end'], 1002.0)
+            self.assertTrue(record['node'])
+
+    def test_status_errors_do_not_stop_other_batches(self):
+        good = submit(self.client, ['MatchPhotos'])
+        bad = submit(self.client, ['MatchPhotos'])
+        client = FailingClient(self.server, bad)
+        completed = []
+        batch_monitor = monitor.BatchMonitor(client, poll_interval=0, clock=Clock())
+        batch_monitor.watch(good, 'good', lambda _, batch_id, status: completed.append(batch_id))
+        batch_monitor.watch(bad, 'bad', lambda _, batch_id, status: completed.append(batch_id))
+        summary = batch_monitor.run()
+        self.assertEqual(sorted(completed), sorted([good, bad]))
+        self.assertEqual(batch_monitor.batches[good]['status'], 'completed')
+        self.assertEqual(batch_monitor.batches[bad]['status'], 'error')
+        self.assertEqual((summary['completed'], summary['failed']), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Turntable pair planning."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agisoft_helpers import pairs
+
+
+def frames(side, rings, per_ring, start=0.0):
+    """Frames shot 2 s apart with a 60 s pause between rings."""
+    result = []
+    for ring in range(rings):
+        for index in range(per_ring):
+            result.append({'path': '%s/%02d_%03d.jpg' % (side, ring, index), 'side': side,
+                           'time': start + ring * (per_ring * 2.0 + 60.0) + index * 2.0})
+    return result
+
+
+class PlanTest(unittest.TestCase):
+
+    def test_capture_time(self):
+        exif = {'datetime': '1970:01:02 00:00:01', 'subsec': '25'}
+        self.assertAlmostEqual(pairs.capture_time(exif), 86401.25)
+        self.assertIsNone(pairs.capture_time({}))
+
+    def test_split_rings_at_pauses(self):
+        times = [frame['time'] for frame in frames('A', 3, 10)]
+        rings = pairs.split_rings(times, 3.0)
+        self.assertEqual([len(ring) for ring in rings], [10, 10, 10])
+        self.assertEqual(len(pairs.split_rings(times, 3.0, frames_per_ring=12)), 3)
+
+    def test_ring_wraps_around(self):
+        links = pairs.ring_pairs(list(range(10)), 2)
+        self.assertIn((9, 0), links)
+        self.assertIn((8, 0), links)
+        self.assertEqual(len(links), 20)
+        self.assertNotIn((3, 0), pairs.ring_pairs(list(range(4)), 2))
+
+    def test_plan_is_linear_in_frames(self):
+        captured = frames('A', 3, 24) + frames('B', 3, 24, start=1e4)
+        planned = pairs.plan_pairs(captured)
+        count = len(captured)
+        self.assertTrue(all(first < second < count for first, second in planned))
+        self.assertEqual(len(planned), len(set(planned)))
+        self.assertLess(len(planned), count * 10)
+        sides = set((captured[first]['side'], captured[second]['side'])
+                    for first, second in planned)
+        self.assertEqual(sides, set([('A', 'A'), ('B', 'B'), ('A', 'B')]))
+
+    def test_cached_plan(self):
+        folder = tempfile.mkdtemp()
+        try:
+            captured = frames('A', 2, 12)
+            planned = pairs.cached_plan(folder, captured)
+            self.assertEqual(len(os.listdir(folder)), 1)
+            self.assertEqual(pairs.cached_plan(folder, captured), planned)
+            self.assertEqual(planned, pairs.plan_pairs(captured))
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
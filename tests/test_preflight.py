@@ -0,0 +1,97 @@
+"""Pre-flight cost model and settings choice."""
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agisoft_helpers import preflight
+
+PROFILE = {'images': 200, 'megapixels': 24.0, 'density': 0.004}
+SETTINGS = {'match_downscale': 1, 'dense_downscale': 1, 'face_count': 3, 'texture_size': 4096,
+            'keypoint_limit': 10 ** 9}
+
+
+def work(**changes):
+    return preflight.stage_work(PROFILE, dict(SETTINGS, **changes))
+
+
+class StageWorkTest(unittest.TestCase):
+
+    def test_options_are_photoscan_levels(self):
+        options = dict((name, values) for name, values, _ in preflight.OPTIONS)
+        self.assertTrue(set(options['match_downscale']) <= set([0, 1, 2, 4, 8]))
+        self.assertTrue(set(options['dense_downscale']) <= set([1, 2, 4, 8, 16]))
+
+    def test_highest_accuracy_matches_four_times_the_pixels(self):
+        self.assertAlmostEqual(work(match_downscale=0)['align'] / work()['align'], 4.0)
+        self.assertAlmostEqual(work(match_downscale=2)['align'] / work()['align'], 0.25)
+
+    def test_dense_pixels_fall_with_the_square_of_the_downscale(self):
+        for downscale, ratio in ((2, 0.25), (4, 1.0 / 16)):
+            self.assertAlmostEqual(work(dense_downscale=downscale)['dense'] / work()['dense'],
+                                   ratio)
+            self.assertAlmostEqual(work(dense_downscale=downscale)['model'] / work()['model'],
+                                   ratio)
+
+    def test_keypoints_are_capped(self):
+        self.assertEqual(work(keypoint_limit=1000)['align'], PROFILE['images'] * 1.0)
+
+
+class ChooseSettingsTest(unittest.TestCase):
+
+    def test_large_budget_keeps_most_detailed(self):
+        settings, _ = preflight.choose_settings(PROFILE, 1e6, 1e6)
+        self.assertEqual(settings, dict((name, values[0])
+                                        for name, values, _ in preflight.OPTIONS))
+
+    def test_no_fit_gives_cheapest(self):
+        settings, prediction = preflight.choose_settings(PROFILE, 1e-6, 1e-6)
+        self.assertEqual(settings['dense_downscale'], 4)
+        self.assertEqual(settings['match_downscale'], 2)
+        self.assertEqual(settings['face_count'], 1)
+
+    def test_choice_fits_budget(self):
+        hours = 0.5 * sum(cost[0] for cost in preflight.predict(
+            PROFILE, dict((name, values[0]) for name, values, _ in preflight.OPTIONS)).values())
+        hours /= 3600.0
+        settings, prediction = preflight.choose_settings(PROFILE, hours, 1e6)
+        self.assertLessEqual(sum(cost[0] for cost in prediction.values()), hours * 3600.0)
+        self.assertEqual(prediction, preflight.predict(PROFILE, settings))
+
+
+class FitModelsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_recovers_time_coefficients(self):
+        timeline = os.path.join(self.folder, 'timeline.jsonl')
+        with open(timeline, 'w') as handle:
+            for index, downscale in enumerate((1, 2, 4)):
+                project = 'project%d' % index
+                os.makedirs(os.path.join(self.folder, project))
+                settings = dict(SETTINGS, dense_downscale=downscale)
+                preflight.save(os.path.join(self.folder, project, preflight.PREFLIGHT_NAME),
+                               PROFILE, settings, {})
+                work = preflight.stage_work(PROFILE, settings)['dense']
+                handle.write(json.dumps({'project': project, 'task': 'BuildDenseCloud',
+                                         'status': 'completed',
+                                         'duration': 3.0 * work ** 1.2}) + '\n')
+        models = preflight.fit_models(timeline, lambda project: os.path.join(self.folder,
+                                                                             project))
+        b0, b1 = models['dense']['time']
+        self.assertAlmostEqual(b0, math.log(3.0), places=6)
+        self.assertAlmostEqual(b1, 1.2, places=6)
+        self.assertEqual(models['align'], preflight.DEFAULT_MODELS['align'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Scale bar config, residuals and outlier detection."""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from agisoft_helpers import scalebars
+
+
+class ScalebarsTest(unittest.TestCase):
+
+    def test_load_config(self):
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'scalebars.json')
+            with open(path, 'w') as handle:
+                json.dump({'default': {'accuracy': '0.0001', 'bars': [['1', 3, 0.125]]}}, handle)
+            self.assertEqual(scalebars.load_config(path),
+                             {'default': {'accuracy': 0.0001, 'bars': [(1, 3, 0.125)]}})
+        finally:
+            shutil.rmtree(folder)
+
+    def test_residuals_use_median_scale(self):
+        reference = np.array([0.1, 0.2, 0.3, 0.4])
+        measured = reference * 5.0
+        measured[3] *= 1.1
+        residual = scalebars.residuals(reference, measured)
+        self.assertTrue(np.allclose(residual[:3], 0.0))
+        self.assertAlmostEqual(residual[3], 0.04)
+        self.assertTrue(np.isnan(scalebars.residuals(reference, np.zeros(4))).all())
+
+    def test_outliers(self):
+        residual = np.array([1e-5, -2e-5, 1.5e-5, -1e-5, 5e-3, np.nan])
+        accuracy = np.full(len(residual), 1e-4)
+        self.assertEqual(scalebars.outliers(residual, accuracy).tolist(),
+                         [False, False, False, False, True, True])
+
+    def test_accuracy_limits_outliers(self):
+        residual = np.array([1e-6, -1e-6, 2e-6, 5e-5])
+        self.assertFalse(scalebars.outliers(residual, np.full(4, 1e-4)).any())
+        self.assertTrue(scalebars.outliers(residual, np.full(4, 1e-7))[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Adaptive optimization schedule against the fake PhotoScan module in benchmarks."""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import numpy as np
+import PhotoScan
+from agisoft_helpers import scheduler
+from agisoft_helpers import sparse
+
+ERROR = PhotoScan.PointCloud.Filter.ReprojectionError
+
+
+class RunTest(unittest.TestCase):
+
+    def setUp(self):
+        sparse.invalidate()
+        self.chunk = PhotoScan.make_chunk(5000, markers=0, cameras=0)
+
+    def test_converges_below_target(self):
+        start = scheduler.measure(self.chunk, ERROR)
+        target = 0.8 * start
+        result = scheduler.run(self.chunk, ERROR, target, sparse.optimize_cameras)
+        self.assertLess(result, target)
+        self.assertAlmostEqual(result, scheduler.measure(self.chunk, ERROR))
+        self.assertLess(sparse.point_count(self.chunk), 5000)
+
+    def test_stops_at_point_floor(self):
+        schedule = scheduler.Schedule(min_point_fraction=0.6, min_improvement=0.0,
+                                      max_iterations=100)
+        scheduler.run(self.chunk, ERROR, 0.0, sparse.optimize_cameras, schedule)
+        self.assertEqual(sparse.point_count(self.chunk), 3000)
+
+    def test_min_points_raises_floor(self):
+        schedule = scheduler.Schedule(min_points=4500, min_improvement=0.0, max_iterations=100)
+        scheduler.run(self.chunk, ERROR, 0.0, sparse.optimize_cameras, schedule)
+        self.assertEqual(sparse.point_count(self.chunk), 4500)
+
+    def test_iteration_budget(self):
+        calls = []
+        schedule = scheduler.Schedule(min_improvement=0.0, max_iterations=3)
+        scheduler.run(self.chunk, ERROR, 0.0, calls.append, schedule)
+        self.assertEqual(len(calls), 3)
+
+    def test_stops_without_improvement(self):
+        calls = []
+        schedule = scheduler.Schedule(min_improvement=0.5, patience=2, max_iterations=100)
+        scheduler.run(self.chunk, ERROR, 0.0, calls.append, schedule)
+        self.assertEqual(len(calls), 2)
+
+
+class BatchFractionTest(unittest.TestCase):
+
+    def test_bounds(self):
+        schedule = scheduler.Schedule(max_fraction=0.2, min_fraction=0.02, aggressiveness=0.5)
+        values = np.arange(100.0)
+        self.assertEqual(schedule.batch_fraction(values, 1000.0), 0.02)
+        self.assertEqual(schedule.batch_fraction(values, -1.0), 0.2)
+        self.assertAlmostEqual(schedule.batch_fraction(values, 79.5), 0.1)
+        self.assertEqual(schedule.batch_fraction(np.zeros(0), 1.0), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""Threshold and elbow selection on plain arrays."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from agisoft_helpers import selection
+
+
+class ThresholdForFractionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.values = np.random.RandomState(0).lognormal(0.0, 1.0, 1001)
+
+    def test_leaves_fraction_above(self):
+        for fraction in (0.01, 0.1, 0.5, 0.9):
+            thresh = selection.threshold_for_fraction(self.values, fraction)
+            count = int(self.values.size * fraction)
+            self.assertEqual(np.count_nonzero(self.values > thresh), count)
+            self.assertEqual(np.count_nonzero(self.values >= thresh), count)
+
+    def test_edges(self):
+        self.assertEqual(np.count_nonzero(
+            self.values > selection.threshold_for_fraction(self.values, 0.0)), 0)
+        self.assertEqual(np.count_nonzero(
+            self.values > selection.threshold_for_fraction(self.values, 1.0)), self.values.size)
+        self.assertEqual(selection.threshold_for_fraction(np.zeros(0), 0.5), 0.0)
+
+
+class ElbowTest(unittest.TestCase):
+
+    def test_remaining_curve(self):
+        thresholds, remaining = selection.remaining_curve(np.array([3.0, 1.0, 2.0]), None)
+        self.assertEqual(thresholds.tolist(), [1.0, 2.0, 3.0])
+        self.assertEqual(remaining.tolist(), [2.0, 1.0, 0.0])
+
+    def test_knee_between_inliers_and_outliers(self):
+        random = np.random.RandomState(1)
+        values = np.concatenate([random.uniform(0.0, 1.0, 9000),
+                                 random.uniform(1.0, 20.0, 1000)])
+        thresh = selection.elbow_threshold(values)
+        self.assertGreater(thresh, 0.5)
+        self.assertLess(thresh, 3.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""SparseCloud selection against the fake PhotoScan module in benchmarks."""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import numpy as np
+import PhotoScan
+from agisoft_helpers import sparse
+
+ERROR = PhotoScan.PointCloud.Filter.ReprojectionError
+
+
+class SelectTest(unittest.TestCase):
+
+    def setUp(self):
+        sparse.invalidate()
+        self.chunk = PhotoScan.make_chunk(2000, markers=0, cameras=0)
+        self.cloud = sparse.sparse_cloud(self.chunk)
+
+    def test_invalid_points_are_not_selected(self):
+        values = self.cloud.metric(ERROR)
+        worst = values > np.percentile(values, 90)
+        self.cloud.invalidate_mask(worst)
+        thresh = float(np.percentile(values, 50))
+        count = self.cloud.select(ERROR, thresh)
+        native = self.chunk.point_cloud.selected
+        self.assertEqual(count, np.count_nonzero((values > thresh) & ~worst))
+        self.assertFalse(native[worst].any())
+        self.assertTrue((native == self.cloud.selected).all())
+
+    def test_invalidate_selected_keeps_points(self):
+        self.cloud.select(ERROR, float(np.percentile(self.cloud.metric(ERROR), 80)))
+        removed = sparse.invalidate_selected_points(self.chunk)
+        self.assertEqual(len(self.chunk.point_cloud.points), 2000)
+        self.assertEqual(sparse.point_count(self.chunk), 2000 - removed)
+        self.assertEqual(sparse.known_point_count(self.chunk), 2000 - removed)
+        self.assertEqual(self.cloud.selected_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
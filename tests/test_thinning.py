@@ -0,0 +1,45 @@
+"""Voxel thinning of tie point coordinates."""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import numpy as np
+from agisoft_helpers import thinning
+
+
+class ThinMaskTest(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        # a dense cluster and a sparse spread of points
+        self.coords = np.vstack([random.normal(0.0, 0.01, (4000, 3)),
+                                 random.uniform(-1.0, 1.0, (1000, 3))])
+        self.scores = random.rand(len(self.coords))
+
+    def test_keeps_at_most_budget(self):
+        for budget in (50, 500, 2000):
+            keep = thinning.thin_mask(self.coords, self.scores, budget)
+            self.assertLessEqual(np.count_nonzero(keep), budget)
+            self.assertGreater(np.count_nonzero(keep), budget // 4)
+
+    def test_under_budget_keeps_all(self):
+        self.assertTrue(thinning.thin_mask(self.coords, self.scores, len(self.coords)).all())
+
+    def test_spreads_over_the_cloud(self):
+        keep = thinning.thin_mask(self.coords, self.scores, 500)
+        self.assertGreater(np.count_nonzero(keep[4000:]), np.count_nonzero(keep[:4000]))
+
+    def test_best_per_cell(self):
+        ids = np.array([0, 0, 0, 1, 1, 2])
+        scores = np.array([3.0, 1.0, 2.0, 5.0, 4.0, 9.0])
+        keep = thinning.best_per_cell(ids, scores, 1)
+        self.assertEqual(keep.tolist(), [False, True, False, False, True, True])
+        self.assertEqual(thinning.kept_count(ids, 2), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()